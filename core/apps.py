@@ -51,7 +51,23 @@ DEFAULT_CFG = {
     "fields_controls_user": {},
     "fields_controls_eo": {},
     "is_valid_health_facility_contract_required": False,
-    "secondary_calendar": None
+    "secondary_calendar": None,
+    "jwt_signing_key_cache_size": "1024",
+    "jwt_signing_key_cache_ttl": "60",
+    "last_login_flush_interval": "60",
+    "total_count_cache_ttl": "10",
+    "total_count_estimate_threshold": "100000",
+    "export_chunk_size": "2000",
+    "async_exports": "False",
+    "user_activity_report_concurrency": "1",
+    "registers_status_rollup": "database",
+    "report_snapshots": "False",
+    "report_snapshot_ttl": "900",
+    "report_snapshot_max_age": "86400",
+    "mutation_log_archive_days": "0",
+    "mutation_payload_compress_threshold": "0",
+    "mutation_payload_file_threshold": "0",
+    "mutation_batch_size": "1",
 }
 
 
@@ -84,6 +100,20 @@ class CoreConfig(AppConfig):
     gql_mutation_update_claim_administrator_perms = []
     gql_mutation_delete_claim_administrator_perms = []
     is_valid_health_facility_contract_required = None
+    last_login_flush_interval = 60
+    total_count_cache_ttl = 10
+    total_count_estimate_threshold = 100000
+    export_chunk_size = 2000
+    async_exports = False
+    user_activity_report_concurrency = 1
+    registers_status_rollup = "database"
+    report_snapshots = False
+    report_snapshot_ttl = 900
+    report_snapshot_max_age = 86400
+    mutation_log_archive_days = 0
+    mutation_payload_compress_threshold = 0
+    mutation_payload_file_threshold = 0
+    mutation_batch_size = 1
 
     fields_controls_user = {}
     fields_controls_eo = {}
@@ -167,6 +197,34 @@ class CoreConfig(AppConfig):
         CoreConfig.fields_controls_user = cfg["fields_controls_user"]
         CoreConfig.fields_controls_eo = cfg["fields_controls_eo"]
 
+    def _configure_jwt(self, cfg):
+        from .jwt import signing_key_cache
+        signing_key_cache.configure(int(cfg["jwt_signing_key_cache_size"]), int(cfg["jwt_signing_key_cache_ttl"]))
+
+    def _configure_last_login(self, cfg):
+        CoreConfig.last_login_flush_interval = int(cfg["last_login_flush_interval"])
+
+    def _configure_total_count(self, cfg):
+        CoreConfig.total_count_cache_ttl = int(cfg["total_count_cache_ttl"])
+        CoreConfig.total_count_estimate_threshold = int(cfg["total_count_estimate_threshold"])
+
+    def _configure_exports(self, cfg):
+        CoreConfig.export_chunk_size = int(cfg["export_chunk_size"])
+        CoreConfig.async_exports = str(cfg["async_exports"]).lower() == "true"
+
+    def _configure_mutation_logs(self, cfg):
+        CoreConfig.mutation_log_archive_days = int(cfg["mutation_log_archive_days"])
+        CoreConfig.mutation_payload_compress_threshold = int(cfg["mutation_payload_compress_threshold"])
+        CoreConfig.mutation_payload_file_threshold = int(cfg["mutation_payload_file_threshold"])
+        CoreConfig.mutation_batch_size = int(cfg["mutation_batch_size"])
+
+    def _configure_reports(self, cfg):
+        CoreConfig.user_activity_report_concurrency = int(cfg["user_activity_report_concurrency"])
+        CoreConfig.registers_status_rollup = cfg["registers_status_rollup"]
+        CoreConfig.report_snapshots = str(cfg["report_snapshots"]).lower() == "true"
+        CoreConfig.report_snapshot_ttl = int(cfg["report_snapshot_ttl"])
+        CoreConfig.report_snapshot_max_age = int(cfg["report_snapshot_max_age"])
+
     def _configure_additional_settings(self, cfg):
         CoreConfig.is_valid_health_facility_contract_required = cfg["is_valid_health_facility_contract_required"]
         CoreConfig.secondary_calendar = cfg["secondary_calendar"]
@@ -182,10 +240,19 @@ class CoreConfig(AppConfig):
         self._configure_graphql(cfg)
         self._configure_currency(cfg)
         self._configure_permissions(cfg)
+        self._configure_jwt(cfg)
+        self._configure_last_login(cfg)
+        self._configure_total_count(cfg)
+        self._configure_exports(cfg)
+        self._configure_reports(cfg)
+        self._configure_mutation_logs(cfg)
         self._configure_additional_settings(cfg)
 
         self.password_reset_template = cfg["password_reset_template"]
 
+        # Connects the receivers dropping the cached display names of the saved users
+        from core import user_names  # noqa: F401
+
         # The scheduler starts as soon as it gets a job, which could be before Django is ready, so we enable it here
         from core import scheduler
         if settings.SCHEDULER_AUTOSTART:
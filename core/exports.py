@@ -0,0 +1,266 @@
+"""
+Streaming engine behind ExportableQueryModel exports.
+
+The queryset is read with `.iterator(chunk_size=...)`, each chunk becomes a small DataFrame (a record batch) on which
+the export patches are applied, then it is handed over to the writer of the requested format which appends it to a
+temporary file. Only one chunk is held in memory at a time, whatever the number of exported rows. The temporary file
+is finally handed over to the storage backend of ExportableQueryModel.content.
+
+As they are applied chunk by chunk, export patches must work row-wise (renaming, mapping or formatting columns...),
+a patch aggregating or deduplicating the whole export would only see one chunk at a time.
+
+Formats are pluggable, other modules can register their own writer:
+
+    class XlsxExportWriter(ExportWriter):
+        format = "xlsx"
+        ...
+
+    register_export_writer(XlsxExportWriter)
+
+Expired exports are reaped by `reap_expired_exports`, run by the core scheduled tasks and the `reapexports` command.
+"""
+import gzip
+import io
+import logging
+import uuid
+from datetime import datetime as py_datetime
+from itertools import islice
+
+from django.apps import apps
+from pandas import DataFrame, RangeIndex
+
+from core.apps import CoreConfig
+
+logger = logging.getLogger(__name__)
+
+
+class ExportWriter:
+    """
+    Writes the record batches of an export, in a given format, to a binary file.
+    """
+    format = None
+    extension = None
+    content_type = "application/octet-stream"
+    # Compressed as a whole, fetch_export can send it with Content-Encoding: gzip
+    gzipped = False
+
+    def __init__(self, target):
+        self.target = target
+
+    def write_batch(self, frame, first):
+        """
+        :param frame: DataFrame of the batch, indexed from the position of its first row in the export
+        :param first: True for the first batch (always written, even if empty)
+        """
+        raise NotImplementedError("ExportWriter subclasses must implement write_batch")
+
+    def close(self):
+        """
+        Flushes what is still buffered to the target file, without closing it.
+        """
+        pass
+
+
+class CsvExportWriter(ExportWriter):
+    format = "csv"
+    extension = "csv"
+    content_type = "text/csv"
+
+    def __init__(self, target):
+        super().__init__(target)
+        self.binary = self._open_binary(target)
+        self.stream = io.TextIOWrapper(self.binary, encoding="utf-8", newline="")
+
+    def _open_binary(self, target):
+        return target
+
+    def write_batch(self, frame, first):
+        frame.to_csv(self.stream, header=first)
+
+    def close(self):
+        self.stream.flush()
+        self.stream.detach()
+
+
+class GzipCsvExportWriter(CsvExportWriter):
+    format = "csv.gz"
+    extension = "csv.gz"
+    gzipped = True
+
+    def _open_binary(self, target):
+        return gzip.GzipFile(fileobj=target, mode="wb")
+
+    def close(self):
+        super().close()
+        # Writes the gzip trailer, the target itself stays open
+        self.binary.close()
+
+
+class JsonlExportWriter(ExportWriter):
+    format = "jsonl"
+    extension = "jsonl"
+    content_type = "application/x-ndjson"
+
+    def __init__(self, target):
+        super().__init__(target)
+        self.stream = io.TextIOWrapper(target, encoding="utf-8", newline="")
+
+    def write_batch(self, frame, first):
+        if len(frame):
+            frame.to_json(self.stream, orient="records", lines=True, date_format="iso", default_handler=str)
+            self.stream.write("\n")
+
+    def close(self):
+        self.stream.flush()
+        self.stream.detach()
+
+
+class ParquetExportWriter(ExportWriter):
+    """
+    Parquet file with one row group per batch, requires pyarrow. The schema is set by the first batch: columns that
+    are entirely empty in it are typed as strings, UUIDs are written as strings.
+    """
+    format = "parquet"
+    extension = "parquet"
+    content_type = "application/vnd.apache.parquet"
+
+    def __init__(self, target):
+        super().__init__(target)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as exc:
+            raise ValueError("The parquet export format requires pyarrow") from exc
+        self.pyarrow = pyarrow
+        self.writer = None
+        self.schema = None
+
+    @staticmethod
+    def _uuids_as_strings(frame):
+        for column in frame.columns:
+            if frame[column].dtype == object:
+                sample = frame[column].dropna()
+                if len(sample) and isinstance(sample.iloc[0], uuid.UUID):
+                    frame[column] = frame[column].map(lambda value: None if value is None else str(value))
+        return frame
+
+    def write_batch(self, frame, first):
+        pa = self.pyarrow
+        frame = self._uuids_as_strings(frame)
+        if self.writer is None:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            self.schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                for field in table.schema
+            ]).remove_metadata()
+            self.writer = pa.parquet.ParquetWriter(self.target, self.schema)
+        if len(frame) or first:
+            self.writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+EXPORT_WRITERS = {}
+
+
+def register_export_writer(writer_class):
+    EXPORT_WRITERS[writer_class.format] = writer_class
+
+
+for _writer_class in (CsvExportWriter, GzipCsvExportWriter, JsonlExportWriter, ParquetExportWriter):
+    register_export_writer(_writer_class)
+
+
+def get_export_writer(export_format):
+    """
+    :raises ValueError: if no writer is registered for that format
+    """
+    writer_class = EXPORT_WRITERS.get(export_format)
+    if writer_class is None:
+        raise ValueError("Unsupported export format: %s (%s)" % (export_format, ", ".join(EXPORT_WRITERS)))
+    return writer_class
+
+
+def iter_chunks(qs, values, chunk_size):
+    """
+    Yields the rows of qs.values_list(*values) as lists of at most chunk_size tuples, without caching the queryset.
+    """
+    rows = qs.values_list(*values).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_frame(rows, values, offset, column_names=None, patches=None):
+    """
+    DataFrame of one chunk, indexed from offset as if the whole export was a single DataFrame, with the patches applied
+    and the columns renamed.
+    """
+    frame = DataFrame.from_records(rows, columns=values) if rows else DataFrame(columns=values)
+    frame.index = RangeIndex(offset, offset + len(frame))
+    for patch in patches or []:
+        frame = patch(frame)
+    column_names = column_names or {}
+    frame.columns = [column_names.get(column) or column for column in frame.columns]
+    return frame
+
+
+def write_export(qs, values, writer, column_names=None, patches=None, chunk_size=None, on_chunk=None):
+    """
+    Writes the export of the queryset with the given ExportWriter, chunk by chunk, and closes the writer.
+    :param on_chunk: called with the number of rows exported so far after each chunk
+    :return: the number of exported rows
+    """
+    chunk_size = chunk_size or CoreConfig.export_chunk_size
+    exported = 0
+    for rows in iter_chunks(qs, values, chunk_size):
+        writer.write_batch(build_frame(rows, values, exported, column_names, patches), exported == 0)
+        exported += len(rows)
+        if on_chunk:
+            on_chunk(exported)
+    if exported == 0:
+        writer.write_batch(build_frame([], values, 0, column_names, patches), True)
+    writer.close()
+    return exported
+
+
+REAP_BATCH_SIZE = 200
+
+
+def reap_expired_exports(batch_size=REAP_BATCH_SIZE):
+    """
+    Deletes the files of the expired exports and flags them as deleted, batch_size exports at a time (one query to
+    select them, one bulk update to flag them).
+    :return: (number of reaped exports, reclaimed bytes)
+    """
+    export_model = apps.get_model("core", "ExportableQueryModel")
+    storage = export_model._meta.get_field("content").storage
+    now = py_datetime.now()
+    reaped, reclaimed = 0, 0
+    while True:
+        batch = list(export_model.objects
+                     .filter(expire_date__lt=now, is_deleted=False)
+                     .order_by("expire_date", "id")
+                     .values_list("id", "content")[:batch_size])
+        if not batch:
+            break
+        for export_id, file_name in batch:
+            if not file_name:
+                continue
+            try:
+                if storage.exists(file_name):
+                    size = storage.size(file_name)
+                    storage.delete(file_name)
+                    reclaimed += size
+            except Exception as exc:
+                # Still flagged as deleted, the file is left for manual cleanup rather than retried forever
+                logger.warning("Could not delete the file %s of export %s: %s", file_name, export_id, exc)
+        export_model.objects.filter(id__in=[export_id for export_id, _ in batch]).update(is_deleted=True)
+        reaped += len(batch)
+    if reaped:
+        logger.info("Reaped %s expired exports, %s bytes reclaimed", reaped, reclaimed)
+    return reaped, reclaimed
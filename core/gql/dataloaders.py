@@ -0,0 +1,135 @@
+"""
+Request-scoped DataLoaders, batching the per-row lookups of GraphQL types into one query per field and page.
+
+A loader is instantiated once per request (and per loader class) with `get_dataloader(info, LoaderClass)`, its
+`load(key)` returns a Promise resolved once all the keys of the current page are collected. Other modules can
+subclass `BatchLoader` (or `ModelByIdLoader`) for their own types:
+
+    class InsureeFamilyLoader(ModelByIdLoader):
+        def get_queryset(self):
+            return Family.objects.filter(validity_to__isnull=True)
+
+    def resolve_family(self, info):
+        return get_dataloader(info, InsureeFamilyLoader).load(self.family_id)
+"""
+from graphql import GraphQLList, GraphQLNonNull
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from core import filter_validity
+
+_CONTEXT_ATTRIBUTE = "_openimis_dataloaders"
+
+
+def get_dataloader(info, loader_class):
+    """
+    :return: the instance of loader_class bound to the current request, created on first use
+    """
+    context = info.context
+    loaders = getattr(context, _CONTEXT_ATTRIBUTE, None)
+    if loaders is None:
+        loaders = {}
+        setattr(context, _CONTEXT_ATTRIBUTE, loaders)
+    loader = loaders.get(loader_class)
+    if loader is None:
+        loader = loader_class(info)
+        loaders[loader_class] = loader
+    return loader
+
+
+def returns_list(info):
+    """
+    True if the resolved field is a plain list (as opposed to a connection, which needs a queryset to filter on).
+    """
+    return_type = info.return_type
+    if isinstance(return_type, GraphQLNonNull):
+        return_type = return_type.of_type
+    return isinstance(return_type, GraphQLList)
+
+
+class BatchLoader(DataLoader):
+    """
+    Base loader: subclasses implement `batch_load(keys)` returning a dict key -> value, missing keys get `default`.
+    """
+    default = None
+
+    def __init__(self, info, **kwargs):
+        self.info = info
+        super().__init__(**kwargs)
+
+    def batch_load(self, keys):
+        raise NotImplementedError("BatchLoader subclasses must implement batch_load")
+
+    def batch_load_fn(self, keys):
+        values = self.batch_load(keys)
+        return Promise.resolve([values.get(key, self.default) for key in keys])
+
+
+class ModelByIdLoader(BatchLoader):
+    """
+    Loads instances by primary key, from `get_queryset()` so that row security still applies.
+    """
+
+    def get_queryset(self):
+        raise NotImplementedError("ModelByIdLoader subclasses must implement get_queryset")
+
+    def batch_load(self, keys):
+        return {obj.pk: obj for obj in self.get_queryset().filter(pk__in=keys)}
+
+
+class UserRolesLoader(BatchLoader):
+    """
+    InteractiveUser id -> currently valid roles of that user
+    """
+
+    def batch_load(self, keys):
+        from core.models import UserRole
+        roles = {key: [] for key in keys}
+        for user_role in UserRole.objects \
+                .filter(user_id__in=keys, validity_to__isnull=True, role__validity_to__isnull=True) \
+                .select_related("role") \
+                .order_by("id"):
+            roles[user_role.user_id].append(user_role.role)
+        return roles
+
+
+class UserDistrictsLoader(BatchLoader):
+    """
+    InteractiveUser id -> currently valid UserDistrict of that user
+    """
+
+    def batch_load(self, keys):
+        from django.apps import apps
+        user_district_class = apps.get_model("location", "UserDistrict")
+        districts = {key: [] for key in keys}
+        for user_district in user_district_class.objects \
+                .filter(*filter_validity(), user_id__in=keys) \
+                .order_by("id"):
+            districts[user_district.user_id].append(user_district)
+        return districts
+
+
+class HealthFacilityLoader(ModelByIdLoader):
+    """
+    HealthFacility id -> HealthFacility, restricted to what the requesting user may see
+    """
+
+    def get_queryset(self):
+        from django.apps import apps
+        return apps.get_model("location", "HealthFacility").get_queryset(None, self.info)
+
+
+class PendingUserMutationLoader(BatchLoader):
+    """
+    core User id -> client_mutation_id of its first mutation still in RECEIVED status
+    """
+
+    def batch_load(self, keys):
+        from core.models import MutationLog, UserMutation
+        pending = {}
+        for core_user_id, client_mutation_id in UserMutation.objects \
+                .filter(core_user_id__in=keys, mutation__status=MutationLog.RECEIVED) \
+                .order_by("id") \
+                .values_list("core_user_id", "mutation__client_mutation_id"):
+            pending.setdefault(core_user_id, client_mutation_id)
+        return pending
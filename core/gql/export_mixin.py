@@ -12,7 +12,9 @@ from graphene.types.generic import GenericScalar
 from pandas import DataFrame
 
 from core import fields
+from core.apps import CoreConfig
 from core.custom_filters import CustomFilterWizardStorage
+from core.exports import get_export_writer
 from core.models import ExportableQueryModel
 from graphql.utils.ast_to_dict import ast_to_dict
 
@@ -81,6 +83,10 @@ class ExportableQueryMixin:
             new_args = fld.args
             new_args['fields'] = graphene.List(of_type=graphene.String)
             new_args['fields_columns'] = GenericScalar()
+            new_args['async_export'] = graphene.Boolean(
+                description="Build the file in the background, the returned name can be polled with exportStatus")
+            new_args['format'] = graphene.String(
+                description="csv (default), csv.gz, jsonl or parquet")
             setattr(cls, field_name, graphene.Field(graphene.String, args=new_args))
             cls.create_export_function(field)
 
@@ -103,12 +109,24 @@ class ExportableQueryMixin:
             custom_filters = kwargs.pop("customFilters", None)
             export_fields = [cls._adjust_notation(f) for f in kwargs.pop('fields')]
             fields_mapping = json.loads(kwargs.pop('fields_columns'))
+            async_export = kwargs.pop('async_export', None)
+            export_format = kwargs.pop('format', None) or "csv"
+            # Fails before anything is queued
+            get_export_writer(export_format)
+            if async_export is None:
+                async_export = CoreConfig.async_exports
             qs = default_resolve(None, info, **kwargs)
             qs = qs.filter(**kwargs)
             qs = cls.__append_custom_filters(custom_filters, qs)
-            export_file = ExportableQueryModel\
-                .create_csv_export(qs, export_fields, info.context.user, column_names=fields_mapping,
-                                   patches=cls.get_patches_for_field(field_name))
+            if async_export:
+                export_file = ExportableQueryModel \
+                    .create_async_export(qs, export_fields, info.context.user, column_names=fields_mapping,
+                                         patches_ref=(f"{cls.__module__}.{cls.__qualname__}", field_name),
+                                         export_format=export_format)
+            else:
+                export_file = ExportableQueryModel\
+                    .create_export(qs, export_fields, info.context.user, column_names=fields_mapping,
+                                   patches=cls.get_patches_for_field(field_name), export_format=export_format)
 
             return export_file.name
 
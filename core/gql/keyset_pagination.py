@@ -0,0 +1,165 @@
+"""
+Keyset (a.k.a. seek) pagination helpers for KeysetDjangoFilterConnectionField.
+
+Instead of an offset, the cursor of an edge holds the ordering values of its row (e.g. request_date_time and id), the
+next page is then `WHERE (request_date_time, id) > (cursor values)`, which the database answers from an index however
+deep the page is. The primary key is always appended to the ordering so that it is total. NULL values are ordered as
+if they were greater than any other value, on all database backends.
+
+The ordering values must be those of a single row: an ordering through a multi-valued relation (e.g. the roles of the
+users) yields a row per related object, even in a .distinct() queryset, and is paginated by offset instead.
+"""
+import base64
+import datetime
+import decimal
+import json
+import uuid
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+
+CURSOR_PREFIX = "keyset:"
+
+_ENCODERS = (
+    (datetime.datetime, "datetime", lambda value: value.isoformat()),
+    (datetime.date, "date", lambda value: value.isoformat()),
+    (decimal.Decimal, "decimal", str),
+    (uuid.UUID, "uuid", str),
+)
+_DECODERS = {
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "decimal": decimal.Decimal,
+    "uuid": uuid.UUID,
+}
+
+
+def _encode_value(value):
+    # Tagged rather than DjangoJSONEncoder, which truncates the microseconds of datetimes
+    for value_type, tag, encode in _ENCODERS:
+        if isinstance(value, value_type):
+            return [tag, encode(value)]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        tag, encoded = value
+        return _DECODERS[tag](encoded)
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.b64encode((CURSOR_PREFIX + payload).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    :return: the ordering values held by the cursor
+    :raises ValueError: if the cursor was not produced by encode_cursor (e.g. an offset cursor)
+    """
+    try:
+        decoded = base64.b64decode(cursor.encode("ascii")).decode("utf-8")
+        if not decoded.startswith(CURSOR_PREFIX):
+            raise ValueError(cursor)
+        return [_decode_value(value) for value in json.loads(decoded[len(CURSOR_PREFIX):])]
+    except (ValueError, KeyError, TypeError, UnicodeError) as exc:
+        raise ValueError("Invalid keyset cursor: %s" % cursor) from exc
+
+
+def _is_pk(field, opts):
+    return field in ("pk", opts.pk.name, opts.pk.attname)
+
+
+def _is_multi_valued(field, opts):
+    for name in field.split("__"):
+        try:
+            model_field = opts.get_field(name)
+        except FieldDoesNotExist:
+            # Annotation or lookup
+            return False
+        if model_field.many_to_many or model_field.one_to_many:
+            return True
+        if not model_field.is_relation:
+            return False
+        opts = model_field.related_model._meta
+    return False
+
+
+def keyset_ordering(queryset):
+    """
+    :return: the ordering of the queryset as a list of (field, descending), primary key last, or None if that ordering
+    can't be used as a keyset (random or expression ordering, relation ordered by its model's Meta.ordering, ordering
+    through a multi-valued relation)
+    """
+    query = queryset.query
+    opts = query.get_meta()
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering:
+        ordering = opts.ordering or ()
+    else:
+        ordering = ()
+    keys = []
+    for item in ordering:
+        if not isinstance(item, str) or item == "?":
+            return None
+        field = item.lstrip("-")
+        if _is_multi_valued(field, opts):
+            return None
+        if "__" not in field and not _is_pk(field, opts):
+            try:
+                model_field = opts.get_field(field)
+            except FieldDoesNotExist:
+                model_field = None
+            if model_field is not None and model_field.is_relation and model_field.related_model._meta.ordering:
+                return None
+        keys.append((field, item.startswith("-")))
+        if _is_pk(field, opts):
+            # Anything after the primary key is irrelevant
+            return keys
+    keys.append(("pk", False))
+    return keys
+
+
+def order_by_keyset(queryset, keys, reverse=False):
+    return queryset.order_by(*[
+        F(field).desc(nulls_first=True) if descending != reverse else F(field).asc(nulls_last=True)
+        for field, descending in keys
+    ])
+
+
+def _after_value(field, value, descending):
+    # Rows coming after the value in that direction, NULL being greater than anything
+    if descending:
+        return Q(**{f"{field}__isnull": False}) if value is None else Q(**{f"{field}__lt": value})
+    if value is None:
+        return Q(pk__in=[])
+    return Q(**{f"{field}__gt": value}) | Q(**{f"{field}__isnull": True})
+
+
+def keyset_filter(keys, values, reverse=False):
+    """
+    :return: the condition selecting the rows after (or before if reverse) the one with the given ordering values
+    """
+    if len(keys) != len(values):
+        raise ValueError("The keyset cursor doesn't match the requested ordering")
+    condition = Q(pk__in=[])
+    equal = Q()
+    for (field, descending), value in zip(keys, values):
+        condition |= equal & _after_value(field, value, descending != reverse)
+        equal &= Q(**{f"{field}__isnull": True}) if value is None else Q(**{field: value})
+    return condition
+
+
+def annotate_keyset(queryset, keys):
+    return queryset.annotate(**{keyset_alias(index): F(field) for index, (field, _) in enumerate(keys)})
+
+
+def keyset_alias(index):
+    return f"keyset_{index}"
+
+
+def row_cursor(row, keys):
+    return encode_cursor([getattr(row, keyset_alias(index)) for index in range(len(keys))])
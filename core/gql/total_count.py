@@ -0,0 +1,98 @@
+"""
+Counting strategies for the total_count of connections.
+
+Counts are issued on a stripped queryset (no ordering, no select_related/prefetch_related) and cached per query
+signature and user for `total_count_cache_ttl` seconds, so that paging through a list doesn't recount it on every page.
+
+A connection class can opt into the estimated mode for very large tables: the database statistics are used instead of
+a COUNT(*) when they report at least `total_count_estimate_threshold` rows, smaller results are still counted exactly.
+
+    class MutationLogConnection(ExtendedConnection):
+        total_count_mode = COUNT_ESTIMATED
+
+        class Meta:
+            abstract = True
+"""
+import hashlib
+import json
+import logging
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+
+from core.apps import CoreConfig
+
+logger = logging.getLogger(__name__)
+
+COUNT_EXACT = "exact"
+COUNT_ESTIMATED = "estimated"
+
+_COUNT_KEY = "total_count_%s_%s"
+
+
+def strip_for_count(queryset):
+    """
+    :return: the queryset without what doesn't change the number of rows but makes the count more expensive
+    """
+    return queryset.order_by().select_related(None).prefetch_related(None)
+
+
+def _count_key(queryset, user):
+    sql, params = queryset.query.sql_with_params()
+    signature = hashlib.sha1(f"{queryset.db}|{sql}|{params!r}".encode("utf-8")).hexdigest()
+    return _COUNT_KEY % (getattr(user, "id", None) or "-", signature)
+
+
+def estimate_count(queryset):
+    """
+    Row estimate from the database statistics, without scanning the table.
+    :return: the estimate or None if the database backend can't provide one for this queryset
+    """
+    connection = connections[queryset.db]
+    try:
+        if connection.vendor == "postgresql":
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+        if connection.vendor == "microsoft" and not queryset.query.where:
+            # SQL Server only keeps per table statistics, usable for unfiltered lists
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT SUM(row_count) FROM sys.dm_db_partition_stats "
+                    "WHERE object_id = OBJECT_ID(%s) AND index_id IN (0, 1)",
+                    [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            return int(row[0]) if row and row[0] is not None else None
+    except Exception as exc:
+        logger.warning("Could not estimate the count of %s: %s", queryset.model.__name__, exc)
+    return None
+
+
+def count_queryset(queryset, user=None, mode=COUNT_EXACT):
+    """
+    Number of rows of the queryset, served from the cache when the same query was counted for the same user less
+    than `total_count_cache_ttl` seconds ago.
+    """
+    queryset = strip_for_count(queryset)
+    try:
+        key = _count_key(queryset, user)
+    except EmptyResultSet:
+        # e.g. queryset.none() or an empty __in filter
+        return 0
+    count = cache.get(key)
+    if count is not None:
+        return count
+    if mode == COUNT_ESTIMATED:
+        estimate = estimate_count(queryset)
+        if estimate is not None and estimate >= CoreConfig.total_count_estimate_threshold:
+            count = estimate
+    if count is None:
+        count = queryset.count()
+    if CoreConfig.total_count_cache_ttl > 0:
+        cache.set(key, count, CoreConfig.total_count_cache_ttl)
+    return count
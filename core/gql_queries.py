@@ -3,11 +3,12 @@ import location.gql_queries
 from core import ExtendedConnection, filter_validity
 from core.models import Officer, Role, RoleRight, UserRole, User, InteractiveUser, UserMutation, Language
 from graphene_django import DjangoObjectType
-from location.models import HealthFacility
 from .apps import CoreConfig
 from django.utils.translation import gettext as _
 from django.core.exceptions import PermissionDenied
 
+from .gql.dataloaders import get_dataloader, returns_list, HealthFacilityLoader, PendingUserMutationLoader, \
+    UserDistrictsLoader, UserRolesLoader
 from .utils import prefix_filterset
 
 
@@ -118,27 +119,22 @@ class InteractiveUserGQLType(DjangoObjectType):
         if not info.context.user.has_perms(CoreConfig.gql_query_users_perms):
             raise PermissionDenied(_("unauthorized"))
         if self.health_facility_id:
-            return HealthFacility.get_queryset(None, info).filter(pk=self.health_facility_id).first()
+            return get_dataloader(info, HealthFacilityLoader).load(self.health_facility_id)
         else:
             return None
 
     def resolve_roles(self, info, **kwargs):
         if not info.context.user.is_authenticated:
             raise PermissionDenied(_("unauthorized"))
-        if self.user_roles:
-            return Role.objects\
-                .filter(validity_to__isnull=True)\
-                .filter(user_roles__user_id=self.id, user_roles__validity_to__isnull=True)
-        else:
-            return None
+        return get_dataloader(info, UserRolesLoader).load(self.id)
 
     def resolve_userdistrict_set(self, info, **kwargs):
         if not info.context.user.is_authenticated:
             raise PermissionDenied(_("unauthorized"))
-        if self.userdistrict_set:
-            return self.userdistrict_set.filter(*filter_validity())
-        else:
-            return None
+        if returns_list(info):
+            return get_dataloader(info, UserDistrictsLoader).load(self.id)
+        # Connections are filtered and paginated on a queryset, they can't be batched
+        return self.userdistrict_set.filter(*filter_validity())
 
     @classmethod
     def get_queryset(cls, queryset, info):
@@ -177,8 +173,7 @@ class UserGQLType(DjangoObjectType):
     def resolve_client_mutation_id(self, info):
         if not info.context.user.has_perms(CoreConfig.gql_query_users_perms):
             raise PermissionDenied(_("unauthorized"))
-        user_mutation = self.mutations.select_related('mutation').filter(mutation__status=0).first()
-        return user_mutation.mutation.client_mutation_id if user_mutation else None
+        return get_dataloader(info, PendingUserMutationLoader).load(self.id)
 
 
 class PermissionOpenImisGQLType(graphene.ObjectType):
@@ -1,6 +1,13 @@
 # from graphql_auth.backends import GraphQLAuthBackend
 # from django.utils.deprecation import MiddlewareMixin
+import binascii
+import json
+import threading
+import time
+from collections import OrderedDict
+
 import jwt
+from jwt.utils import base64url_decode
 from graphql_jwt.settings import jwt_settings
 from graphql_jwt.signals import token_issued
 from django.apps import apps
@@ -14,9 +21,9 @@ logger = logging.getLogger(__file__)
 
 @receiver(token_issued)
 def on_token_issued(sender, request, user, **kwargs):
-    # Store the date on which the user got the auth token
-    user.last_login = timezone.now()
-    user.save()
+    # Store the date on which the user got the auth token, written to the database in batches
+    from core.last_login import record_last_login
+    record_last_login(user, timezone.now())
 
 
 def jwt_encode_user_key(payload, context=None):
@@ -32,32 +39,23 @@ def jwt_encode_user_key(payload, context=None):
 
 
 def jwt_decode_user_key(token, context=None):
-    # First decode the token without validating it, so we can extract the username
-    not_validated = jwt.decode(
-        token,
-        get_jwt_key(encode=False, context=context),
-        options={
-            'verify_exp': jwt_settings.JWT_VERIFY_EXPIRATION,
-            'verify_aud': jwt_settings.JWT_AUDIENCE is not None,
-            'verify_signature': False,
-        },
-        leeway=jwt_settings.JWT_LEEWAY,
-        audience=jwt_settings.JWT_AUDIENCE,
-        issuer=jwt_settings.JWT_ISSUER,
-        algorithms=[jwt_settings.JWT_ALGORITHM],
-    )
-    if not_validated and not_validated.get("username"):
-        user_class = apps.get_model("core", "User")
-        db_user = user_class.objects\
-            .filter(username=not_validated.get("username"))\
-            .only("i_user__private_key")\
-            .first()
-        if db_user and db_user.private_key:
-            key = db_user.private_key
-        else:
-            key = get_jwt_key(encode=False)
-    else:
-        key = get_jwt_key(encode=False)
+    # Only read the claims to find out whose key signed the token, the actual validation happens once, below
+    username = _read_unverified_claims(token).get("username")
+    user_key = get_user_signing_key(username) if username else None
+    try:
+        return _decode_verified(token, user_key or get_jwt_key(encode=False))
+    except jwt.InvalidSignatureError:
+        if not username:
+            raise
+        # The key might have been rotated by another process after we cached it
+        signing_key_cache.invalidate(username)
+        fresh_key = get_user_signing_key(username)
+        if fresh_key == user_key:
+            raise
+        return _decode_verified(token, fresh_key or get_jwt_key(encode=False))
+
+
+def _decode_verified(token, key):
     return jwt.decode(
         token,
         key,
@@ -73,6 +71,89 @@ def jwt_decode_user_key(token, context=None):
     )
 
 
+def _read_unverified_claims(token):
+    """
+    Decodes the payload segment of the token without any check. Malformed tokens give an empty dict and are then
+    rejected by the verified decoding.
+    """
+    if isinstance(token, bytes):
+        token = token.decode("utf-8", errors="replace")
+    try:
+        claims = json.loads(base64url_decode(token.split(".")[1]))
+    except (AttributeError, IndexError, ValueError, TypeError, binascii.Error):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+_MISSING = object()
+
+
+class SigningKeyCache:
+    """
+    Process-local, bounded (LRU) cache of the users' private keys used to sign their tokens. Entries expire after
+    `ttl` seconds so that a key rotated from another process is picked up without restart.
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_size, ttl):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, username):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return _MISSING
+            key, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[username]
+                return _MISSING
+            self._entries.move_to_end(username)
+            return key
+
+    def set(self, username, key):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[username] = (key, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username=None):
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+
+signing_key_cache = SigningKeyCache()
+
+
+def get_user_signing_key(username):
+    """
+    :return: the private key of the interactive user behind username, None if there is none (unknown user, technical
+             user...), in which case the default JWT key applies.
+    """
+    key = signing_key_cache.get(username)
+    if key is _MISSING:
+        user_class = apps.get_model("core", "User")
+        key = user_class.objects \
+            .filter(username=username) \
+            .values_list("i_user__private_key", flat=True) \
+            .first()
+        signing_key_cache.set(username, key)
+    return key
+
+
 def get_jwt_key(encode=True, context=None, payload=None):
     user_key = extract_private_key_from_context(context)
     if user_key is None and payload is not None:
@@ -91,10 +172,8 @@ def get_jwt_key(encode=True, context=None, payload=None):
 
 def extract_private_key_from_payload(payload):
     # Get user private key from payload. This covers the refresh token mutation
-    from core.models import User
-
     if "username" in payload:
-        return User.objects.get(username=payload["username"]).private_key
+        return get_user_signing_key(payload["username"])
 
 
 def extract_private_key_from_context(context):
@@ -0,0 +1,164 @@
+"""
+Buffered tracking of the users' last login.
+
+Issuing a token used to save the whole user (and its underlying InteractiveUser/TechnicalUser row). Logins are now
+appended to a buffer kept in the Django cache and written in batches, one bulk UPDATE of the LastLogin column per
+batch. The buffer is flushed every `last_login_flush_interval` seconds by the core scheduled task and on demand with the
+`flushlastlogins` management command. Should the buffer grow past FLUSH_BATCH_SIZE entries or the scheduled task not
+have flushed it for two intervals, the next login flushes it.
+
+The buffer needs both the scheduled task (`SCHEDULER_AUTOSTART`) and a cache shared by the processes: otherwise each
+login writes its own LastLogin column right away, with a single UPDATE.
+
+Each login takes a sequence number, then stores its entry under that number: a flush can see a number whose entry is
+not stored yet. The flush only goes past the entries that are present, and stops at the first missing one unless it was
+already taken at the previous flush (the entry was then lost: evicted, expired or its process died).
+
+With a shared cache (redis, memcached...), a flush from any process writes the logins recorded by all of them.
+"""
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import FieldDoesNotExist
+
+from core.apps import CoreConfig
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+_SEQUENCE_KEY = "last_login_seq"
+_FLUSHED_KEY = "last_login_flushed"
+_SEEN_KEY = "last_login_seen"
+_ENTRY_KEY = "last_login_entry_%s"
+_FLUSH_LOCK_KEY = "last_login_flush_lock"
+_FLUSHED_RECENTLY_KEY = "last_login_flushed_recently"
+_FLUSH_LOCK_TIMEOUT = 300
+
+
+def _entry_timeout():
+    # Entries must outlive a few missed flushes but not linger forever if nothing flushes
+    return max(CoreConfig.last_login_flush_interval * 10, _FLUSH_LOCK_TIMEOUT)
+
+
+def _next_sequence():
+    cache.add(_SEQUENCE_KEY, 0, None)
+    try:
+        return cache.incr(_SEQUENCE_KEY)
+    except ValueError:
+        # Evicted between add and incr
+        cache.add(_SEQUENCE_KEY, 0, None)
+        return cache.incr(_SEQUENCE_KEY)
+
+
+def _tracked_user(user):
+    """
+    :return: the model instance holding the LastLogin column for this user, None if there is none (e.g. Officer)
+    """
+    backing_user = getattr(user, "_u", user)
+    if backing_user is None or backing_user.pk is None:
+        return None
+    try:
+        backing_user._meta.get_field("last_login")
+    except FieldDoesNotExist:
+        return None
+    return backing_user
+
+
+def _is_buffered():
+    # A per-process cache would keep the logins of the other processes out of reach of the scheduled task
+    return settings.SCHEDULER_AUTOSTART and not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def record_last_login(user, timestamp):
+    """
+    Sets the last login of the user in memory and queues it for the next flush, or writes it right away if the logins
+    can't be buffered.
+    """
+    user.last_login = timestamp
+    tracked = _tracked_user(user)
+    if tracked is None:
+        return
+    if not _is_buffered():
+        type(tracked).objects.filter(pk=tracked.pk).update(last_login=timestamp)
+        return
+    sequence = _next_sequence()
+    cache.set(_ENTRY_KEY % sequence, (tracked._meta.label, tracked.pk, timestamp), _entry_timeout())
+    state = cache.get_many([_FLUSHED_KEY, _FLUSHED_RECENTLY_KEY])
+    if sequence - state.get(_FLUSHED_KEY, 0) >= FLUSH_BATCH_SIZE or _FLUSHED_RECENTLY_KEY not in state:
+        # The scheduled task is lagging behind or not running
+        flush_last_logins()
+
+
+def _write_batch(entries):
+    """
+    :return: the (model label, pk) of the updated users
+    """
+    latest = {}
+    for label, pk, timestamp in entries:
+        if (label, pk) not in latest or latest[(label, pk)] < timestamp:
+            latest[(label, pk)] = timestamp
+    per_model = {}
+    for (label, pk), timestamp in latest.items():
+        per_model.setdefault(label, []).append((pk, timestamp))
+    for label, rows in per_model.items():
+        model = apps.get_model(label)
+        model.objects.bulk_update(
+            [model(pk=pk, last_login=timestamp) for pk, timestamp in rows], ["last_login"],
+            batch_size=FLUSH_BATCH_SIZE)
+    return latest.keys()
+
+
+def _read_batch(flushed, last, seen):
+    """
+    :return: (the entries of the sequences after flushed, up to last or to the first one that may still be being
+             written, the last sequence read or skipped)
+    """
+    sequences = range(flushed + 1, last + 1)
+    found = cache.get_many([_ENTRY_KEY % seq for seq in sequences])
+    entries = []
+    for seq in sequences:
+        entry = found.get(_ENTRY_KEY % seq)
+        if entry is None and seq > seen:
+            # Taken since the previous flush, its login may not have stored it yet
+            break
+        if entry is not None:
+            entries.append(entry)
+        flushed = seq
+    return entries, flushed
+
+
+def flush_last_logins():
+    """
+    Writes the buffered logins to the database, FLUSH_BATCH_SIZE at a time. Only one flush runs at a time.
+    :return: the number of updated users, None if another flush was already running
+    """
+    if not cache.add(_FLUSH_LOCK_KEY, True, _FLUSH_LOCK_TIMEOUT):
+        return None
+    try:
+        flushed = cache.get(_FLUSHED_KEY, 0)
+        seen = cache.get(_SEEN_KEY, 0)
+        current = cache.get(_SEQUENCE_KEY, 0)
+        if current < max(flushed, seen):
+            # The sequence was evicted and restarted
+            flushed, seen = 0, 0
+        updated = set()
+        while flushed < current:
+            entries, last = _read_batch(flushed, min(flushed + FLUSH_BATCH_SIZE, current), seen)
+            if last == flushed:
+                break
+            updated.update(_write_batch(entries))
+            cache.delete_many([_ENTRY_KEY % seq for seq in range(flushed + 1, last + 1)])
+            cache.set(_FLUSHED_KEY, last, None)
+            flushed = last
+        cache.set(_SEEN_KEY, current, None)
+        cache.set(_FLUSHED_RECENTLY_KEY, True, CoreConfig.last_login_flush_interval * 2)
+        if updated:
+            logger.debug("Flushed the last login of %s users", len(updated))
+        return len(updated)
+    finally:
+        cache.delete(_FLUSH_LOCK_KEY)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.mutation_archive import ARCHIVE_BATCH_SIZE, archive_mutation_logs
+
+
+class Command(BaseCommand):
+    help = "Moves the completed mutation logs older than the given age to the mutation log archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None,
+                            help="Age of the logs to archive, mutation_log_archive_days by default")
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE,
+                            help="Number of logs archived per batch")
+
+    def handle(self, *args, **options):
+        archived, deleted = archive_mutation_logs(days=options["days"], batch_size=options["batch_size"])
+        self.stdout.write(f"{archived} mutation logs archived, {deleted} deleted from the mutation log")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.last_login import flush_last_logins
+
+
+class Command(BaseCommand):
+    help = "Writes the buffered users' last login to the database."
+
+    def handle(self, *args, **options):
+        updated = flush_last_logins()
+        if updated is None:
+            self.stdout.write("Another flush is already running")
+        else:
+            self.stdout.write(f"Last login updated for {updated} users")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.exports import REAP_BATCH_SIZE, reap_expired_exports
+
+
+class Command(BaseCommand):
+    help = "Deletes the files of the expired query exports and flags them as deleted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=REAP_BATCH_SIZE,
+                            help="Number of exports deleted per batch")
+
+    def handle(self, *args, **options):
+        reaped, reclaimed = reap_expired_exports(batch_size=options["batch_size"])
+        self.stdout.write(f"{reaped} expired exports deleted, {reclaimed} bytes reclaimed")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.rights_cache import warm_rights_cache
+
+
+class Command(BaseCommand):
+    help = "Computes the rights of all active interactive users and stores them in the rights cache."
+
+    def handle(self, *args, **options):
+        nb_users = warm_rights_cache()
+        self.stdout.write(f"Rights cached for {nb_users} users")
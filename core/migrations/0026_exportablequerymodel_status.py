@@ -0,0 +1,38 @@
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_mutationlog_json_ext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportablequerymodel',
+            name='status',
+            field=models.SmallIntegerField(
+                choices=[(0, 'Pending'), (1, 'Running'), (2, 'Ready'), (3, 'Failed')], default=2),
+        ),
+        migrations.AddField(
+            model_name='exportablequerymodel',
+            name='rows_written',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='exportablequerymodel',
+            name='bytes_written',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='exportablequerymodel',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='exportablequerymodel',
+            name='content',
+            field=models.FileField(blank=True, upload_to=core.models._query_export_path),
+        ),
+    ]
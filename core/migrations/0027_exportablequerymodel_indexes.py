@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_exportablequerymodel_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exportablequerymodel',
+            index=models.Index(fields=['name'], name='core_export_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportablequerymodel',
+            index=models.Index(fields=['expire_date', 'is_deleted'], name='core_export_expire_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_exportablequerymodel_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportablequerymodel',
+            name='format',
+            field=models.CharField(default='csv', max_length=16),
+        ),
+    ]
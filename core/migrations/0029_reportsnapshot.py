@@ -0,0 +1,34 @@
+import datetime
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_exportablequerymodel_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('params_key', models.CharField(max_length=40)),
+                ('params', models.TextField()),
+                ('payload', models.TextField()),
+                ('computed_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('checked_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('served_at', models.DateTimeField(default=datetime.datetime.now)),
+            ],
+            options={
+                'db_table': 'core_ReportSnapshot',
+                'unique_together': {('name', 'params_key')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reportsnapshot',
+            index=models.Index(fields=['served_at'], name='core_snapshot_served_idx'),
+        ),
+    ]
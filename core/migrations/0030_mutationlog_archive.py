@@ -0,0 +1,58 @@
+import datetime
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_reportsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mutationlog',
+            index=models.Index(fields=['client_mutation_id', 'user', 'request_date_time'],
+                               name='core_mutlog_client_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mutationlog',
+            index=models.Index(fields=['user', 'request_date_time'], name='core_mutlog_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mutationlog',
+            index=models.Index(fields=['status', 'request_date_time'], name='core_mutlog_status_date_idx'),
+        ),
+        migrations.CreateModel(
+            name='MutationLogArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('json_content', models.BinaryField()),
+                ('request_date_time', models.DateTimeField()),
+                ('client_mutation_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('client_mutation_label', models.CharField(blank=True, max_length=255, null=True)),
+                ('client_mutation_details', models.TextField(blank=True, null=True)),
+                ('status', models.IntegerField(choices=[(0, 'Received'), (1, 'Error'), (2, 'Success')])),
+                ('error', models.TextField(blank=True, null=True)),
+                ('json_ext', models.JSONField(blank=True, db_column='JsonExt', null=True)),
+                ('archived_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING,
+                                           related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'core_Mutation_Log_Archive',
+                'managed': True,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mutationlogarchive',
+            index=models.Index(fields=['client_mutation_id', 'user', 'request_date_time'],
+                               name='core_mutarch_client_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mutationlogarchive',
+            index=models.Index(fields=['request_date_time'], name='core_mutarch_date_idx'),
+        ),
+    ]
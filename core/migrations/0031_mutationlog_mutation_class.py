@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_mutationlog_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mutationlog',
+            name='mutation_module',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='mutationlog',
+            name='mutation_class',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_mutationlog_mutation_class'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportablequerymodel',
+            name='query_args',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+def delete_pickled_snapshots(apps, schema_editor):
+    # The snapshots were pickled, they are recomputed on their next request
+    apps.get_model("core", "ReportSnapshot").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_exportablequerymodel_query_args'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_pickled_snapshots, migrations.RunPython.noop),
+    ]
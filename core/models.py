@@ -2,9 +2,14 @@ import json
 import logging
 import os
 import sys
+import tempfile
+import threading
+import time
 import uuid
-from copy import copy
-from datetime import datetime as py_datetime, timedelta
+import zlib
+from copy import copy, deepcopy
+from datetime import date as py_date, datetime as py_datetime, time as py_time, timedelta
+from decimal import Decimal
 from django.core.cache import cache
 from cached_property import cached_property
 from dirtyfields import DirtyFieldsMixin
@@ -12,12 +17,14 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, Group
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied, ValidationError
-from django.core.files.base import ContentFile
-from django.db import models
-from django.db.models import Q, DO_NOTHING, F, JSONField
+from django.core.files.base import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import DO_NOTHING, F, JSONField, Case, Value, When
+from django.utils import timezone
 from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
 from graphql import ResolveInfo
-from pandas import DataFrame
 from simple_history.models import HistoricalRecords
 
 import core
@@ -25,6 +32,7 @@ from django.conf import settings
 
 from .apps import CoreConfig
 from .fields import DateTimeField
+from .rights_cache import CompiledPermissions, get_user_rights
 from .utils import filter_validity
 
 logger = logging.getLogger(__name__)
@@ -104,6 +112,20 @@ class ExtendableModel(models.Model):
         abstract = True
 
 
+MODULE_CONFIGURATION_VERSION_CHECK_INTERVAL = 5
+# Reloaded at least that often, whatever the version: a per-process cache (LocMemCache) doesn't share it
+MODULE_CONFIGURATION_MAX_AGE = 300
+_MODULE_CONFIGURATION_VERSION_KEY = "module_configuration_version"
+
+
+def _is_enabled(disabled_until):
+    if disabled_until is None:
+        return True
+    # can't use core config here...
+    now = timezone.now() if timezone.is_aware(disabled_until) else py_datetime.now()
+    return disabled_until < now
+
+
 class ModuleConfiguration(UUIDModel):
     """
     Generic entity to save every modules' configuration (json format)
@@ -126,6 +148,13 @@ class ModuleConfiguration(UUIDModel):
         null=True
     )
 
+    # Parsed configurations of this process, keyed by (module, layer), reloaded when the shared version changes
+    _registry = None
+    _registry_version = None
+    _registry_checked_at = 0.0
+    _registry_loaded_at = 0.0
+    _registry_lock = threading.Lock()
+
     @classmethod
     def get_or_default(cls, module, default, layer='be'):
         if bool(os.environ.get('NO_DATABASE', False)):
@@ -133,13 +162,17 @@ class ModuleConfiguration(UUIDModel):
             return default
 
         try:
-            now = py_datetime.now()  # can't use core config here...
-            db_configuration = cls.objects.get(
-                Q(is_disabled_until=None) | Q(is_disabled_until__lt=now),
-                layer=layer,
-                module=module
-            )._cfg
-            return {**default, **db_configuration}
+            candidates = [
+                cfg for disabled_until, cfg in cls._get_registry().get((module, layer), [])
+                if _is_enabled(disabled_until)
+            ]
+            if not candidates:
+                raise ModuleConfiguration.DoesNotExist()
+            if len(candidates) > 1:
+                raise ModuleConfiguration.MultipleObjectsReturned(
+                    "%s configurations enabled for %s (%s)" % (len(candidates), module, layer))
+            # Deep copy so that callers cannot alter the cached configuration
+            return {**default, **deepcopy(candidates[0])}
         except ModuleConfiguration.DoesNotExist:
             logger.info('No %s configuration, using default!' % module)
             return default
@@ -148,6 +181,58 @@ class ModuleConfiguration(UUIDModel):
                 module, sys.exc_info()[0].__name__, sys.exc_info()[1]))
             return default
 
+    @classmethod
+    def _get_registry(cls):
+        """
+        All configurations, loaded and parsed in a single query. The shared version is only looked up every
+        MODULE_CONFIGURATION_VERSION_CHECK_INTERVAL seconds, saves from this process are visible once committed.
+        Saves from other processes are only seen through the version if the Django cache is shared by the processes
+        (redis, memcached...), otherwise after MODULE_CONFIGURATION_MAX_AGE seconds at most.
+        """
+        now = time.monotonic()
+        registry = cls._registry
+        if registry is not None and now - cls._registry_checked_at < MODULE_CONFIGURATION_VERSION_CHECK_INTERVAL:
+            return registry
+        with cls._registry_lock:
+            version = cache.get(_MODULE_CONFIGURATION_VERSION_KEY)
+            if cls._registry is None or version != cls._registry_version \
+                    or now - cls._registry_loaded_at >= MODULE_CONFIGURATION_MAX_AGE:
+                registry = {}
+                for configuration in cls.objects.only("module", "layer", "config", "is_disabled_until"):
+                    try:
+                        parsed = configuration._cfg
+                    except ValueError:
+                        # Leaves this module on its defaults, as get_or_default always did
+                        logger.error('Invalid %s configuration, ignoring it!', configuration.module, exc_info=True)
+                        continue
+                    registry.setdefault((configuration.module, configuration.layer), []) \
+                        .append((configuration.is_disabled_until, parsed))
+                cls._registry = registry
+                cls._registry_version = version
+                cls._registry_loaded_at = now
+            cls._registry_checked_at = now
+            return cls._registry
+
+    @classmethod
+    def invalidate_registry(cls):
+        """
+        Makes every process reload the configurations. Called once save/delete is committed, to be called explicitly
+        (after the commit) following bulk updates of the table.
+        """
+        cache.set(_MODULE_CONFIGURATION_VERSION_KEY, uuid.uuid4().hex, None)
+        with cls._registry_lock:
+            cls._registry = None
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Other processes mustn't reload before the change is visible to them, nor for a rolled back change
+        transaction.on_commit(ModuleConfiguration.invalidate_registry)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        transaction.on_commit(ModuleConfiguration.invalidate_registry)
+        return result
+
     @cached_property
     def _cfg(self):
         import collections
@@ -184,6 +269,15 @@ class Language(models.Model):
 
 
 class UserManager(BaseUserManager):
+    # The concrete users behind a User, joined in a single query instead of being loaded one by one through _u
+    IDENTITY_RELATIONS = ("i_user__language", "officer", "claim_admin", "t_user")
+
+    def with_identity(self):
+        return self.get_queryset().select_related(*self.IDENTITY_RELATIONS)
+
+    def get_by_natural_key(self, username):
+        # Used by the authentication backends and graphql_jwt to load the request user
+        return self.with_identity().get(**{self.model.USERNAME_FIELD: username})
 
     def _create_core_user(self, **fields):
         user = User(**fields)
@@ -226,7 +320,7 @@ class UserManager(BaseUserManager):
 
     def get_or_create(self, **kwargs):
         try:
-            user = User.objects.get(**kwargs)
+            user = self.with_identity().get(**kwargs)
             return user, False
         except User.DoesNotExist:
             return self.auto_provision_user(**kwargs)
@@ -363,6 +457,9 @@ class InteractiveUser(VersionedModel):
     )
     role_id = models.IntegerField(db_column="RoleID", null=False)
 
+    # Set by set_password until the new private key is saved
+    _signing_key_changed = False
+
     @property
     def id_for_audit(self):
         return id
@@ -401,18 +498,11 @@ class InteractiveUser(VersionedModel):
 
     @property
     def rights(self):
-        rights =  [rr.right_id for rr in RoleRight.filter_queryset().filter(
-                role_id__in=[r.role_id for r in UserRole.filter_queryset().filter(
-                    user_id=self.id)]).distinct()]
-        return rights
+        return list(get_user_rights(self.id))
 
     @property
     def rights_str(self):
-        rights = cache.get('rights_'+str(self.id))
-        if rights is None:
-            rights =  [str(r) for r in self.rights]
-            cache.set('rights_'+str(self.id),rights,600)
-        return rights
+        return [str(r) for r in get_user_rights(self.id)]
 
     @cached_property
     def health_facility(self):
@@ -462,6 +552,16 @@ class InteractiveUser(VersionedModel):
         self.password = (
             pwd_hash.hexdigest().upper()
         )  # Legacy requires this to be uppercase
+        # Tokens are signed with the private key, the cached one is dropped once the new one is committed
+        self._signing_key_changed = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self._signing_key_changed:
+            from core.jwt import signing_key_cache
+            self._signing_key_changed = False
+            login_name = self.login_name
+            transaction.on_commit(lambda: signing_key_cache.invalidate(login_name))
 
     def check_password(self, raw_password):
         from hashlib import sha256
@@ -540,8 +640,21 @@ class User(UUIDModel, PermissionsMixin, UUIDVersionedModel):
     def _u(self):
         return self.i_user or self.officer or self.claim_admin or self.t_user
 
+    @property
+    def compiled_permissions(self):
+        """
+        Admin flag, superuser flag and rights of this user, computed on first access and then kept on the instance,
+        which lives for a single request: role changes are picked up by the next request, through the rights cache.
+        """
+        # Looked up in __dict__ as __getattr__ would otherwise forward the miss to the underlying user
+        compiled = self.__dict__.get("_compiled_permissions")
+        if compiled is None:
+            compiled = CompiledPermissions.for_interactive_user(self.i_user)
+            self.__dict__["_compiled_permissions"] = compiled
+        return compiled
+
     def has_perms(self, perm_list, obj=None):
-        if self.is_imis_admin:
+        if self.compiled_permissions.is_imis_admin:
             return True
         else:
             return super().has_perms( perm_list, obj)
@@ -578,12 +691,8 @@ class User(UUIDModel, PermissionsMixin, UUIDVersionedModel):
 
     @property
     def is_imis_admin(self):
-        # 64 is system number for IMIS Administrator
-        user = self._u
-        if isinstance(user, InteractiveUser):
-            return user.is_imis_admin
-        else:
-            return False
+        # 64 is system number for IMIS Administrator, only interactive users can hold it
+        return self.compiled_permissions.is_imis_admin
 
     @property
     def is_active(self):
@@ -598,11 +707,12 @@ class User(UUIDModel, PermissionsMixin, UUIDVersionedModel):
         return True
 
     def has_perm(self, perm, obj=None):
-        i_user = self.i_user if obj is None else obj.i_user
-        if i_user is not None and (i_user.is_superuser or perm in i_user.rights_str):
+        if obj is None:
+            if self.compiled_permissions.has_perm(perm):
+                return True
+        elif obj.i_user is not None and (perm in obj.i_user.rights_str or obj.i_user.is_superuser):
             return True
-        else:
-            return super(User, self).has_perm(perm, obj)
+        return super(User, self).has_perm(perm, obj)
 
     @property
     def rights(self):
@@ -823,30 +933,151 @@ class MutationLog(UUIDModel, ExtendableModel):
     client_mutation_details = models.TextField(blank=True, null=True)
     status = models.IntegerField(choices=STATUS_CHOICES, default=RECEIVED)
     error = models.TextField(blank=True, null=True)
+    # Set when the mutation is queued for a worker that may run it in a batch (see core.mutation_executor)
+    mutation_module = models.CharField(max_length=255, blank=True, null=True)
+    mutation_class = models.CharField(max_length=255, blank=True, null=True)
 
     class Meta:
         managed = True
         db_table = "core_Mutation_Log"
+        indexes = [
+            # ObjectMutation.object_mutated
+            models.Index(fields=["client_mutation_id", "user", "request_date_time"],
+                         name="core_mutlog_client_id_idx"),
+            # mutation_logs query of a user
+            models.Index(fields=["user", "request_date_time"], name="core_mutlog_user_date_idx"),
+            # mutation_logs status filter and archival
+            models.Index(fields=["status", "request_date_time"], name="core_mutlog_status_date_idx"),
+        ]
+
+    @staticmethod
+    def create_log(data_json, **kwargs):
+        """
+        Creates the log of a mutation, with its JSON payload compressed or stored in a file according to its size
+        (see core.mutation_payload).
+        """
+        from .mutation_payload import encode_json_content, save_json_content_file
+        mutation_id = uuid.uuid4()
+        json_content, file_content = encode_json_content(data_json, mutation_id)
+        mutation_log = MutationLog.objects.create(id=mutation_id, json_content=json_content, **kwargs)
+        if file_content is not None:
+            # Written with the log: a rolled back log leaves no file behind
+            transaction.on_commit(lambda: save_json_content_file(json_content, file_content))
+        return mutation_log
+
+    def get_json_content(self):
+        from .mutation_payload import decode_json_content
+        return decode_json_content(self.json_content)
+
+    def load_json_content(self):
+        from .mutation_payload import load_json_content
+        return load_json_content(self.json_content)
+
+    # Ids per UPDATE of the bulk methods, well below the 2100 parameters of SQL Server
+    BULK_STATUS_BATCH_SIZE = 500
+
+    def _transition(self, only_from=None, **values):
+        """
+        Updates the given fields of this log in the database only (see below) and mirrors them on the instance, without
+        reading the row back (its json_content can be huge).
+        :param only_from: status the log must still be in for the update to happen
+        :return: the number of updated rows
+        """
+        queryset = MutationLog.objects.filter(id=self.id)
+        if only_from is not None:
+            queryset = queryset.filter(status=only_from)
+        affected_rows = queryset.update(**values)
+        if affected_rows:
+            for field, value in values.items():
+                setattr(self, field, self._meta.get_field(field).to_python(value))
+        return affected_rows
 
     def mark_as_successful(self):
         """
         Do not alter the mutation_log and then save it as it might override changes from another process. This
         method will only set the mutation_log as successful if it is in RECEIVED status.
-        :return True if the status was updated, False if it was in ERROR or already in SUCCESS status
+        :return the number of updated rows: 1 if the status was updated, 0 if it was in ERROR or already in SUCCESS
+                status (the instance is then left as is)
         """
-        affected_rows = MutationLog.objects.filter(id=self.id) \
-            .filter(status=MutationLog.RECEIVED).update(status=MutationLog.SUCCESS)
-        self.refresh_from_db()
-        return affected_rows > 0
+        return self._transition(only_from=MutationLog.RECEIVED, status=MutationLog.SUCCESS)
 
     def mark_as_failed(self, error):
         """
         Do not alter the mutation_log and then save it as it might override changes from another process.
         This method will force the status to ERROR and set its error accordingly.
+        :return the number of updated rows
+        """
+        return self._transition(status=MutationLog.ERROR, error=error)
+
+    def queue(self, mutation_module, mutation_class):
+        """
+        Records the mutation class, for any worker to run the mutation in a batch (see core.mutation_executor).
         """
-        MutationLog.objects.filter(id=self.id) \
-            .update(status=MutationLog.ERROR, error=error)
-        self.refresh_from_db()
+        return self._transition(only_from=MutationLog.RECEIVED, mutation_module=mutation_module,
+                                mutation_class=mutation_class)
+
+    @staticmethod
+    def bulk_mark_as_successful(mutation_ids):
+        """
+        mark_as_successful for many logs, in one UPDATE per BULK_STATUS_BATCH_SIZE ids.
+        :return the number of updated rows
+        """
+        mutation_ids = list(mutation_ids)
+        affected_rows = 0
+        for start in range(0, len(mutation_ids), MutationLog.BULK_STATUS_BATCH_SIZE):
+            affected_rows += MutationLog.objects \
+                .filter(id__in=mutation_ids[start:start + MutationLog.BULK_STATUS_BATCH_SIZE],
+                        status=MutationLog.RECEIVED) \
+                .update(status=MutationLog.SUCCESS)
+        return affected_rows
+
+    @staticmethod
+    def bulk_mark_as_failed(errors):
+        """
+        mark_as_failed for many logs, in one UPDATE per BULK_STATUS_BATCH_SIZE logs.
+        :param errors: dict of the error of each mutation id
+        :return the number of updated rows
+        """
+        errors = list(errors.items())
+        affected_rows = 0
+        for start in range(0, len(errors), MutationLog.BULK_STATUS_BATCH_SIZE):
+            batch = errors[start:start + MutationLog.BULK_STATUS_BATCH_SIZE]
+            affected_rows += MutationLog.objects \
+                .filter(id__in=[mutation_id for mutation_id, _ in batch]) \
+                .update(status=MutationLog.ERROR,
+                        error=Case(*[When(id=mutation_id, then=Value(str(error))) for mutation_id, error in batch],
+                                   output_field=models.TextField()))
+        return affected_rows
+
+
+class MutationLogArchive(models.Model):
+    """
+    Completed MutationLog moved out of core_Mutation_Log by core.mutation_archive, with its json_content compressed.
+    The id is the one of the original MutationLog.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    json_content = models.BinaryField()
+    user = models.ForeignKey(User, on_delete=DO_NOTHING, blank=True, null=True, related_name="+")
+    request_date_time = models.DateTimeField()
+    client_mutation_id = models.CharField(max_length=255, blank=True, null=True)
+    client_mutation_label = models.CharField(max_length=255, blank=True, null=True)
+    client_mutation_details = models.TextField(blank=True, null=True)
+    status = models.IntegerField(choices=MutationLog.STATUS_CHOICES)
+    error = models.TextField(blank=True, null=True)
+    json_ext = JSONField(db_column='JsonExt', blank=True, null=True)
+    archived_at = models.DateTimeField(default=py_datetime.now)
+
+    class Meta:
+        managed = True
+        db_table = "core_Mutation_Log_Archive"
+        indexes = [
+            models.Index(fields=["client_mutation_id", "user", "request_date_time"],
+                         name="core_mutarch_client_id_idx"),
+            models.Index(fields=["request_date_time"], name="core_mutarch_date_idx"),
+        ]
+
+    def get_json_content(self):
+        return zlib.decompress(bytes(self.json_content)).decode("utf-8")
 
 
 class ObjectMutation:
@@ -1104,10 +1335,56 @@ def _query_export_path(instance, filename):
     return F'query_exports/user_{instance.user.uuid}/{filename}'
 
 
+# Types of the SQL parameters of an asynchronous export query that JSON would turn into strings
+_QUERY_PARAM_ENCODERS = (
+    (py_datetime, "datetime", lambda value: value.isoformat()),
+    (py_date, "date", lambda value: value.isoformat()),
+    (py_time, "time", lambda value: value.isoformat()),
+    (Decimal, "decimal", str),
+    (uuid.UUID, "uuid", str),
+)
+_QUERY_PARAM_DECODERS = {
+    "datetime": py_datetime.fromisoformat,
+    "date": py_date.fromisoformat,
+    "time": py_time.fromisoformat,
+    "decimal": Decimal,
+    "uuid": uuid.UUID,
+}
+
+
+def _encode_query_param(value):
+    """
+    :return: the parameter as [type tag, text], the tag being None for the types JSON keeps, None if it can't be
+    stored at all
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return [None, value]
+    for param_type, tag, encode in _QUERY_PARAM_ENCODERS:
+        if isinstance(value, param_type):
+            return [tag, encode(value)]
+    return None
+
+
+def _decode_query_param(encoded):
+    tag, value = encoded
+    return value if tag is None else _QUERY_PARAM_DECODERS[tag](value)
+
+
 class ExportableQueryModel(models.Model):
+    PENDING = 0
+    RUNNING = 1
+    READY = 2
+    FAILED = 3
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (READY, "Ready"),
+        (FAILED, "Failed"),
+    )
+
     name = models.CharField(max_length=255)
     model = models.CharField(max_length=255)
-    content = models.FileField(upload_to=_query_export_path)
+    content = models.FileField(upload_to=_query_export_path, blank=True)
 
     user = models.ForeignKey(
         User, db_column="User", related_name='data_exports',
@@ -1117,27 +1394,185 @@ class ExportableQueryModel(models.Model):
     create_date = DateTimeField(db_column='DateCreated', default=py_datetime.now)
     expire_date = DateTimeField(db_column='DateExpiring', default=_get_default_expire_date)
     is_deleted = models.BooleanField(default=False)
+    status = models.SmallIntegerField(choices=STATUS_CHOICES, default=READY)
+    rows_written = models.IntegerField(default=0)
+    bytes_written = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    format = models.CharField(max_length=16, default="csv")
+    # Primary key query of an asynchronous export, see create_async_export
+    query_args = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["name"], name="core_export_name_idx"),
+            models.Index(fields=["expire_date", "is_deleted"], name="core_export_expire_idx"),
+        ]
+
+    @property
+    def writer_class(self):
+        from .exports import get_export_writer
+        return get_export_writer(self.format)
+
+    @property
+    def is_compressed(self):
+        return self.writer_class.gzipped
 
     @staticmethod
-    def create_csv_export(qs, values, user, column_names=None,
-                          patches=None):
-        if patches is None:
-            patches = []
-        sql = qs.query.sql_with_params()
-        content = DataFrame.from_records(qs.values_list(*values))
-        content.columns = values
-        for patch in patches:
-            content = patch(content)
-
-        content.columns = [column_names.get(column) or column for column in content.columns]
-        filename = F"{uuid.uuid4()}.csv"
-        content = ContentFile(content.to_csv(), filename)
-        export = ExportableQueryModel(
-            name=filename,
+    def _new_export(qs, user, export_format="csv", status=READY):
+        from .exports import get_export_writer
+        return ExportableQueryModel(
+            name=F"{uuid.uuid4()}.{get_export_writer(export_format).extension}",
             model=qs.model,
-            content=content,
             user=user,
-            sql_query=sql,
+            sql_query=qs.query.sql_with_params(),
+            status=status,
+            format=export_format,
         )
+
+    def write_export(self, qs, values, column_names=None, patches=None, chunk_size=None):
+        """
+        Streams the export to the storage chunk by chunk (see core.exports) and saves it as READY. If the export is
+        already saved (i.e. asynchronous), its rows_written and bytes_written are updated after each chunk.
+        """
+        from .exports import write_export
+        target = tempfile.TemporaryFile()
+
+        def save_progress(rows_written):
+            # Only what already reached the temporary file, the last buffered block is counted at the end
+            ExportableQueryModel.objects.filter(id=self.id) \
+                .update(rows_written=rows_written, bytes_written=target.tell())
+
+        try:
+            self.rows_written = write_export(qs, values, self.writer_class(target), column_names=column_names,
+                                             patches=patches, chunk_size=chunk_size,
+                                             on_chunk=save_progress if self.id else None)
+            target.seek(0)
+            self.content.save(self.name, File(target), save=False)
+            self.bytes_written = self.content.size
+            self.status = ExportableQueryModel.READY
+            self.save()
+        finally:
+            target.close()
+
+    def mark_as_running(self):
+        ExportableQueryModel.objects.filter(id=self.id).update(status=ExportableQueryModel.RUNNING)
+        self.status = ExportableQueryModel.RUNNING
+
+    def mark_as_failed(self, error):
+        ExportableQueryModel.objects.filter(id=self.id).update(status=ExportableQueryModel.FAILED, error=error)
+        self.status = ExportableQueryModel.FAILED
+        self.error = error
+
+    @staticmethod
+    def create_export(qs, values, user, column_names=None, patches=None, chunk_size=None, export_format="csv"):
+        """
+        Builds the export synchronously in the given format (csv, csv.gz, jsonl, parquet or any registered with
+        core.exports.register_export_writer).
+        """
+        export = ExportableQueryModel._new_export(qs, user, export_format)
+        export.write_export(qs, values, column_names=column_names, patches=patches, chunk_size=chunk_size)
+        return export
+
+    @staticmethod
+    def create_csv_export(qs, values, user, column_names=None,
+                          patches=None, chunk_size=None, compress=False):
+        """
+        Builds the export synchronously, compress gives a gzipped .csv.gz file.
+        """
+        return ExportableQueryModel.create_export(
+            qs, values, user, column_names=column_names, patches=patches, chunk_size=chunk_size,
+            export_format="csv.gz" if compress else "csv")
+
+    @staticmethod
+    def create_async_export(qs, values, user, column_names=None, patches_ref=None, export_format="csv"):
+        """
+        Saves the export as PENDING and leaves it to a Celery worker. The name of the returned export is the handle
+        to poll (exportStatus query, fetch_export answers 202 until the file is ready).
+        The worker only receives JSON parameters: it rebuilds the queryset from the primary key query stored in
+        query_args. Exports of annotated values, which that queryset wouldn't have, or whose query has parameters of
+        a type that can't be stored, are built synchronously.
+        :param patches_ref: (dotted path of the ExportableQueryMixin class, exported field) to retrieve the patches
+                            in the worker, as callables can't be sent through the queue
+        """
+        from .tasks import openimis_export_async
+        query_args = ExportableQueryModel._query_args(qs)
+        if query_args is None or {value.split("__")[0] for value in values} & set(qs.query.annotations):
+            patches = None
+            if patches_ref:
+                query_class, field_name = patches_ref
+                patches = import_string(query_class).get_patches_for_field(field_name)
+            return ExportableQueryModel.create_export(qs, values, user, column_names=column_names, patches=patches,
+                                                      export_format=export_format)
+        export = ExportableQueryModel._new_export(qs, user, export_format, status=ExportableQueryModel.PENDING)
+        export.query_args = query_args
         export.save()
+        values = list(values)
+        patches_ref = list(patches_ref) if patches_ref else None
+        # The worker must find the export, even if the request runs in a transaction
+        transaction.on_commit(
+            lambda: openimis_export_async.delay(export.id, values, column_names, patches_ref))
         return export
+
+    @staticmethod
+    def _query_args(qs):
+        """
+        :return: the JSON description of the queryset for rebuild_queryset, None if its parameters can't be stored
+        """
+        pk_sql, params = qs.order_by().values("pk").query.sql_with_params()
+        encoded_params = [_encode_query_param(param) for param in params]
+        if None in encoded_params:
+            return None
+        return {
+            "model": qs.model._meta.label,
+            "pk_sql": pk_sql,
+            # With their type, a date bound as a string could compare differently
+            "params": encoded_params,
+            # Expressions can't be stored, the rows are then exported in primary key order
+            "ordering": [field for field in qs.query.order_by if isinstance(field, str)],
+        }
+
+    def rebuild_queryset(self):
+        """
+        :return: the exported queryset, from the query_args stored by create_async_export
+        """
+        from django.db.models.expressions import RawSQL
+        query_args = self.query_args
+        model = apps.get_model(query_args["model"])
+        params = [_decode_query_param(param) for param in query_args["params"]]
+        return model._default_manager \
+            .filter(pk__in=RawSQL(query_args["pk_sql"], params)) \
+            .order_by(*(query_args["ordering"] or ["pk"]))
+
+
+class ReportSnapshot(models.Model):
+    """
+    Computed payload of a report definition (core.report) for a set of parameters, see core.report_snapshots.
+    """
+    name = models.CharField(max_length=255)
+    params_key = models.CharField(max_length=40)
+    params = models.TextField()
+    # JSON payload, see core.report_snapshots.encode_payload
+    payload = models.TextField()
+    # Bookkeeping only, plain datetimes rather than calendar aware ones
+    computed_at = models.DateTimeField(default=py_datetime.now)
+    # Time from which the changes of the source tables are still to be checked
+    checked_at = models.DateTimeField(default=py_datetime.now)
+    served_at = models.DateTimeField(default=py_datetime.now)
+
+    class Meta:
+        db_table = "core_ReportSnapshot"
+        unique_together = ("name", "params_key")
+        indexes = [
+            models.Index(fields=["served_at"], name="core_snapshot_served_idx"),
+        ]
+
+    def get_payload(self):
+        from .report_snapshots import decode_payload
+        return decode_payload(self.payload)
+
+    def set_payload(self, payload):
+        from .report_snapshots import encode_payload
+        self.payload = encode_payload(payload)
+
+    def get_params(self):
+        return json.loads(self.params)
@@ -0,0 +1,80 @@
+"""
+Permissions (*_perms configuration entries) of every installed openIMIS module, as exposed by the modulesPermissions
+GraphQL query. They are computed on first use and kept as tuples until a ModuleConfiguration changes.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from .models import ModuleConfiguration
+from .utils import flatten_dict
+
+logger = logging.getLogger(__name__)
+
+EXCLUDED_APPS = [
+    "health_check.cache", "health_check", "health_check.db",
+    "test_without_migrations", "test_without_migrations",
+    "rules", "graphene_django", "rest_framework",
+    "health_check.storage", "channels", "graphql_jwt.refresh_token.apps.RefreshTokenConfig"
+]
+
+_lock = threading.Lock()
+# ((module_name, ((perms_name, perms_value), ...)), ...) and the configuration registry it was computed from
+_modules_permissions = None
+_source_registry = None
+
+
+def _module_default_config(app):
+    apps_module = __import__(f"{app}.apps").apps
+    if hasattr(apps_module, 'DEFAULT_CONFIG'):
+        return apps_module.DEFAULT_CONFIG
+    return getattr(apps_module, 'DEFAULT_CFG', None)
+
+
+def _compute_modules_permissions():
+    all_apps = [app for app in settings.INSTALLED_APPS if not app.startswith("django") and app not in EXCLUDED_APPS]
+    modules = []
+    for app in all_apps:
+        default_config = _module_default_config(app)
+        if default_config is None:
+            continue
+        config_dict = flatten_dict(ModuleConfiguration.get_or_default(f"{app}", default_config))
+        permissions = tuple(
+            (key, val)
+            for key, value in config_dict.items() if key.endswith("_perms") and isinstance(value, list)
+            for val in value
+        )
+        modules.append((app, permissions))
+    return tuple(modules)
+
+
+def _current_registry():
+    if bool(os.environ.get('NO_DATABASE', False)):
+        return None
+    try:
+        return ModuleConfiguration._get_registry()
+    except Exception:
+        logger.warning("Failed to load module configurations, modules permissions may be outdated", exc_info=True)
+        return None
+
+
+def get_modules_permissions(module_name=None):
+    """
+    :param module_name: only return the permissions of that module
+    :return: tuple of (module_name, ((perms_name, perms_value), ...))
+    """
+    global _modules_permissions, _source_registry
+    registry = _current_registry()
+    modules_permissions = _modules_permissions
+    if modules_permissions is None or registry is not _source_registry:
+        with _lock:
+            if _modules_permissions is None or registry is not _source_registry:
+                _modules_permissions = _compute_modules_permissions()
+                _source_registry = registry
+                logger.debug("Modules permissions computed for %s modules", len(_modules_permissions))
+            modules_permissions = _modules_permissions
+    if module_name is not None:
+        return tuple(module for module in modules_permissions if module[0] == module_name)
+    return modules_permissions
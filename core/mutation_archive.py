@@ -0,0 +1,85 @@
+"""
+Archival of the completed MutationLogs, which otherwise stay forever in core_Mutation_Log with their full payload.
+
+Logs in SUCCESS or ERROR status requested more than `mutation_log_archive_days` days ago are copied, with their
+json_content zlib compressed, into core_Mutation_Log_Archive (MutationLogArchive) batch by batch, each batch in its own
+transaction. Logs that are still linked to an object through an xxxMutation table (see ObjectMutation) keep their row,
+so that the mutations of the objects can still be listed, but their json_content is emptied. The others are deleted.
+
+Run by the core scheduled tasks (daily) and the `archivemutationlogs` command.
+"""
+import logging
+import zlib
+from datetime import datetime as py_datetime, timedelta
+
+from django.apps import apps
+from django.db import transaction
+
+from core.apps import CoreConfig
+from core.mutation_payload import decode_json_content, delete_json_content
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+_ARCHIVED_FIELDS = ("id", "json_content", "user_id", "request_date_time", "client_mutation_id",
+                    "client_mutation_label", "client_mutation_details", "status", "error", "json_ext")
+
+
+def _linked_ids(mutation_log_model, ids):
+    """
+    :return: the ids among the given ones that an xxxMutation table (of any module) refers to
+    """
+    linked = set()
+    for relation in mutation_log_model._meta.related_objects:
+        if relation.many_to_many or relation.one_to_one:
+            continue
+        column = relation.field.attname
+        linked.update(relation.related_model.objects
+                      .filter(**{f"{column}__in": ids})
+                      .values_list(column, flat=True))
+    return linked
+
+
+def _delete_payload_files(payloads):
+    for payload in payloads:
+        delete_json_content(payload)
+
+
+def archive_mutation_logs(days=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    :param days: age (in days) of the logs to archive, `mutation_log_archive_days` by default, 0 to not archive
+    :return: (number of archived logs, number of logs deleted from core_Mutation_Log)
+    """
+    days = CoreConfig.mutation_log_archive_days if days is None else days
+    if days <= 0:
+        return 0, 0
+    mutation_log_model = apps.get_model("core", "MutationLog")
+    archive_model = apps.get_model("core", "MutationLogArchive")
+    cutoff = py_datetime.now() - timedelta(days=days)
+    candidates = mutation_log_model.objects \
+        .filter(status__in=[mutation_log_model.SUCCESS, mutation_log_model.ERROR], request_date_time__lt=cutoff) \
+        .exclude(json_content="") \
+        .order_by("request_date_time", "id")
+    archived, deleted = 0, 0
+    while True:
+        batch = list(candidates.values(*_ARCHIVED_FIELDS)[:batch_size])
+        if not batch:
+            break
+        ids = [row["id"] for row in batch]
+        with transaction.atomic():
+            linked = _linked_ids(mutation_log_model, ids)
+            archive_model.objects.bulk_create([
+                archive_model(**{**row, "json_content": zlib.compress(
+                    decode_json_content(row["json_content"]).encode("utf-8"))})
+                for row in batch
+            ], ignore_conflicts=True)
+            if linked:
+                mutation_log_model.objects.filter(id__in=linked).update(json_content="")
+            deleted += mutation_log_model.objects.filter(id__in=[i for i in ids if i not in linked]).delete()[0]
+            # The payload files are only deleted once the batch is committed
+            payloads = [row["json_content"] for row in batch]
+            transaction.on_commit(lambda payloads=payloads: _delete_payload_files(payloads))
+        archived += len(batch)
+    if archived:
+        logger.info("Archived %s mutation logs, %s of them deleted", archived, deleted)
+    return archived, deleted
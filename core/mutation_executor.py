@@ -0,0 +1,141 @@
+"""
+Worker side of the asynchronous mutations (see openimis_mutation_async).
+
+Each task runs the mutation it was queued for. With `mutation_batch_size` above 1, the task then also claims up to
+that many other queued mutations with SELECT ... FOR UPDATE SKIP LOCKED and runs them, each in its own savepoint, so
+that a burst of mutations needs fewer tasks. The rows stay locked until the batch is over: the tasks of the claimed
+mutations, or other workers, skip them, and they are RECEIVED no more once the batch is committed. A task that can't
+claim its mutation while it's still RECEIVED (locked by a batch, or not committed yet) is retried every
+CLAIM_RETRY_COUNTDOWN seconds, so that the mutation still runs if that batch is rolled back.
+"""
+import functools
+import json
+import logging
+from importlib import import_module
+
+from django.db import connection, transaction
+from django.utils import translation
+
+from core.apps import CoreConfig
+from core.models import Language, MutationLog
+
+logger = logging.getLogger(__name__)
+
+CLAIM_RETRY_COUNTDOWN = 10
+CLAIM_MAX_RETRIES = 30
+
+# What async_mutate needs of the user and its language, in the same query as the log
+MUTATION_SELECT_RELATED = ("user", "user__i_user__language", "user__officer", "user__claim_admin", "user__t_user")
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_mutation_class(module, class_name):
+    """
+    :return: the OpenIMISMutation class of the module's schema, imported once per worker
+    """
+    return getattr(import_module(f"{module}.schema"), class_name)
+
+
+def _activate_language(user):
+    if user and user.language:
+        lang = user.language
+        if isinstance(lang, Language):
+            translation.activate(lang.code)
+        else:
+            translation.activate(lang)
+
+
+def execute_mutation(mutation, module, class_name, savepoint=False):
+    """
+    Runs the async_mutate of the mutation class and records the outcome in the mutation log.
+    :param savepoint: run async_mutate in a savepoint, rolled back if it raises
+    :raises: what async_mutate raised, once the log is marked as failed
+    """
+    try:
+        mutation_class = resolve_mutation_class(module, class_name)
+        _activate_language(mutation.user)
+        if savepoint:
+            with transaction.atomic():
+                error_messages = mutation_class.async_mutate(mutation.user, **mutation.load_json_content())
+        else:
+            error_messages = mutation_class.async_mutate(mutation.user, **mutation.load_json_content())
+    except Exception:
+        logger.warning("Exception while processing mutation id %s", mutation.id, exc_info=True)
+        raise
+    if not error_messages:
+        mutation.mark_as_successful()
+    else:
+        mutation.mark_as_failed(json.dumps(error_messages))
+
+
+def _claimable():
+    """
+    :return: the queryset locking the RECEIVED mutations it returns and skipping those already locked, None if the
+    database can't skip locked rows
+    """
+    features = connection.features
+    if not features.has_select_for_update or not features.has_select_for_update_skip_locked:
+        return None
+    # Only the log is locked, the users are just read (and can't be locked through an outer join on PostgreSQL)
+    of = ("self",) if features.has_select_for_update_of else ()
+    return MutationLog.objects.select_related(*MUTATION_SELECT_RELATED) \
+        .select_for_update(skip_locked=True, of=of) \
+        .filter(status=MutationLog.RECEIVED)
+
+
+def run_queued_mutation(mutation_id, module, class_name):
+    """
+    Runs the mutation a task was queued for.
+    :return: False if the mutation is still to run but couldn't be claimed, the task has to try again later
+    """
+    if CoreConfig.mutation_batch_size <= 1 or _claimable() is None:
+        mutation = MutationLog.objects.select_related(*MUTATION_SELECT_RELATED).get(id=mutation_id)
+        try:
+            execute_mutation(mutation, module, class_name)
+        except Exception as exc:
+            mutation.mark_as_failed(str(exc))
+            raise
+        return True
+    error = None
+    with transaction.atomic():
+        mutation = _claimable().filter(id=mutation_id).first()
+        if mutation is None:
+            # Read without lock: done by a batch, or still RECEIVED (locked by a batch, not committed yet)
+            status = MutationLog.objects.filter(id=mutation_id).values_list("status", flat=True).first()
+            if status is None or status == MutationLog.RECEIVED:
+                logger.debug("Mutation %s can't be claimed yet", mutation_id)
+                return False
+            logger.debug("Mutation %s already run by a batch", mutation_id)
+            return True
+        try:
+            execute_mutation(mutation, module, class_name, savepoint=True)
+        except Exception as exc:
+            # Raising here would roll back the failure with the rest of the transaction
+            error = exc
+            mutation.mark_as_failed(str(exc))
+    if error is not None:
+        raise error
+    return True
+
+
+def run_mutation_batch(batch_size=None):
+    """
+    Claims up to batch_size queued mutations (in request order) and runs them, a failing mutation doesn't stop the
+    batch.
+    :return: the number of mutations run
+    """
+    batch_size = batch_size or CoreConfig.mutation_batch_size
+    claimable = _claimable()
+    if claimable is None:
+        return 0
+    with transaction.atomic():
+        mutations = list(claimable.filter(mutation_module__isnull=False, mutation_class__isnull=False)
+                         .order_by("request_date_time")[:batch_size])
+        for mutation in mutations:
+            try:
+                execute_mutation(mutation, mutation.mutation_module, mutation.mutation_class, savepoint=True)
+            except Exception as exc:
+                mutation.mark_as_failed(str(exc))
+    if mutations:
+        logger.debug("Mutation batch: %s mutations run", len(mutations))
+    return len(mutations)
@@ -0,0 +1,123 @@
+"""
+Storage of MutationLog.json_content.
+
+Payloads of at least `mutation_payload_compress_threshold` bytes are stored zlib compressed (and base64 encoded) behind
+a "zlib:" marker, those of at least `mutation_payload_file_threshold` bytes are stored compressed in the default file
+storage and the row only keeps a "file:" marker with the file name. A JSON payload starts with { or [, it can't be
+mistaken for a marker. Use MutationLog.get_json_content() / load_json_content() rather than reading the field.
+
+The file is only written once the log is committed, a rolled back log leaves no file behind.
+"""
+import base64
+import io
+import json
+import logging
+import zlib
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from core.apps import CoreConfig
+
+logger = logging.getLogger(__name__)
+
+ZLIB_MARKER = "zlib:"
+FILE_MARKER = "file:"
+PAYLOAD_DIRECTORY = "mutation_payloads"
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def encode_json_content(json_content, mutation_id):
+    """
+    :return: (what to store in MutationLog.json_content for that payload, the content of its file to write with
+              save_json_content_file or None if it's stored in the row)
+    """
+    data = json_content.encode("utf-8")
+    file_threshold = CoreConfig.mutation_payload_file_threshold
+    if file_threshold and len(data) >= file_threshold:
+        # Named after the (unique) mutation id, the storage keeps that name
+        return f"{FILE_MARKER}{PAYLOAD_DIRECTORY}/{mutation_id}.json.z", zlib.compress(data)
+    compress_threshold = CoreConfig.mutation_payload_compress_threshold
+    if compress_threshold and len(data) >= compress_threshold:
+        return ZLIB_MARKER + base64.b64encode(zlib.compress(data)).decode("ascii"), None
+    return json_content, None
+
+
+def save_json_content_file(stored, content):
+    name = default_storage.save(stored[len(FILE_MARKER):], ContentFile(content))
+    if FILE_MARKER + name != stored:
+        logger.error("The mutation payload file %s was saved as %s", stored[len(FILE_MARKER):], name)
+
+
+class _DecompressingReader(io.RawIOBase):
+    """
+    Decompresses a zlib stream block by block, without reading it in full.
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self.decompressor = zlib.decompressobj()
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self.pending:
+            block = self.source.read(STREAM_BLOCK_SIZE)
+            if not block:
+                self.pending = self.decompressor.flush()
+                if not self.pending:
+                    return 0
+                break
+            self.pending = self.decompressor.decompress(block)
+        size = min(len(target), len(self.pending))
+        target[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        self.source.close()
+        super().close()
+
+
+def open_json_content(stored):
+    """
+    :return: binary stream of the payload (UTF-8 JSON), to close after use
+    """
+    if stored.startswith(FILE_MARKER):
+        source = default_storage.open(stored[len(FILE_MARKER):], "rb")
+        return io.BufferedReader(_DecompressingReader(source), buffer_size=STREAM_BLOCK_SIZE)
+    if stored.startswith(ZLIB_MARKER):
+        return io.BytesIO(zlib.decompress(base64.b64decode(stored[len(ZLIB_MARKER):])))
+    return io.BytesIO(stored.encode("utf-8"))
+
+
+def decode_json_content(stored):
+    if not stored.startswith((FILE_MARKER, ZLIB_MARKER)):
+        return stored
+    with open_json_content(stored) as stream:
+        return stream.read().decode("utf-8")
+
+
+def load_json_content(stored):
+    """
+    :return: the parsed payload, read from a stream when it's stored in a file
+    """
+    if not stored.startswith((FILE_MARKER, ZLIB_MARKER)):
+        return json.loads(stored)
+    with open_json_content(stored) as stream:
+        return json.load(io.TextIOWrapper(stream, encoding="utf-8"))
+
+
+def delete_json_content(stored):
+    """
+    Deletes the file of the payload, if it's stored in a file.
+    """
+    if stored.startswith(FILE_MARKER):
+        name = stored[len(FILE_MARKER):]
+        try:
+            default_storage.delete(name)
+        except Exception as exc:
+            logger.warning("Could not delete the mutation payload file %s: %s", name, exc)
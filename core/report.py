@@ -1,3 +1,4 @@
+from core.report_snapshots import snapshot_query
 from core.reports import user_activity, registers_status
 
 report_definitions = [
@@ -7,7 +8,9 @@ report_definitions = [
         "default_report": user_activity.template,
         "description": "User activity",
         "module": "core",
-        "python_query": user_activity.user_activity_query,
+        "python_query": snapshot_query("user_activity", user_activity.user_activity_query,
+                                       changed_parts=user_activity.changed_entities,
+                                       refresh_parts=user_activity.refresh_entities),
         "permission": ["131207"],
     },
     {
@@ -16,7 +19,8 @@ report_definitions = [
         "default_report": registers_status.template,
         "description": "Registers status",
         "module": "core",
-        "python_query": registers_status.registers_status_query,
+        "python_query": snapshot_query("registers_status", registers_status.registers_status_query,
+                                       changed_parts=registers_status.changed_since),
         "permission": ["131209"],
     },
 ]
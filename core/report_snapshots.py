@@ -0,0 +1,209 @@
+"""
+Snapshots of the reports of core.report.
+
+With `report_snapshots` enabled, the payload computed by the python_query of a report definition is stored in
+ReportSnapshot, keyed by the report name and its normalized parameters, and served as is for `report_snapshot_ttl`
+seconds. The scheduled refresh (and a request on an outdated snapshot) first asks the report which parts of the
+snapshot are affected by the rows changed since the last check, and only recomputes those:
+
+    register_snapshot_source(
+        "registers_status",
+        registers_status.registers_status_query,
+        # [] if nothing changed, None to recompute everything, or the list of parts to recompute
+        changed_parts=registers_status.changed_since,
+        # payload with the given parts recomputed, only needed if changed_parts returns parts
+        refresh_parts=None,
+    )
+
+Snapshots are fully recomputed once older than `report_snapshot_max_age` seconds, and deleted once not served for as
+long. Payloads are stored as JSON (SnapshotJSONEncoder), their dates, datetimes and decimals tagged so that they are
+served with the same types as computed.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+from datetime import datetime as py_datetime, timedelta
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
+
+from core.apps import CoreConfig
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SOURCES = {}
+
+_TYPE_KEY = "__snapshot_type__"
+# datetime before date, which it extends
+_TAGGED_TYPES = (
+    (datetime.datetime, "datetime", datetime.datetime.fromisoformat),
+    (datetime.date, "date", datetime.date.fromisoformat),
+    (decimal.Decimal, "decimal", decimal.Decimal),
+)
+_DECODERS = {tag: decode for _, tag, decode in _TAGGED_TYPES}
+
+
+class SnapshotJSONEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder keeping the dates, datetimes (with their microseconds) and decimals of a payload as tagged
+    objects, turned back into their type by decode_payload.
+    """
+
+    def default(self, o):
+        for value_type, tag, _ in _TAGGED_TYPES:
+            if isinstance(o, value_type):
+                return {_TYPE_KEY: tag, "value": str(o) if tag == "decimal" else o.isoformat()}
+        return super().default(o)
+
+
+def _decode_tagged(obj):
+    tag = obj.get(_TYPE_KEY)
+    return _DECODERS[tag](obj["value"]) if tag in _DECODERS else obj
+
+
+def encode_payload(payload):
+    return json.dumps(payload, cls=SnapshotJSONEncoder)
+
+
+def decode_payload(stored):
+    return json.loads(stored, object_hook=_decode_tagged)
+
+
+def register_snapshot_source(name, query, changed_parts=None, refresh_parts=None):
+    """
+    :param changed_parts: callable(since, **params), without it the snapshots are recomputed on every refresh
+    :param refresh_parts: callable(payload, parts, **params)
+    """
+    SNAPSHOT_SOURCES[name] = {"query": query, "changed_parts": changed_parts, "refresh_parts": refresh_parts}
+
+
+def snapshot_query(name, query, changed_parts=None, refresh_parts=None):
+    """
+    Registers the report as a snapshot source and returns the python_query to use in its report definition.
+    """
+    register_snapshot_source(name, query, changed_parts, refresh_parts)
+
+    def snapshot_python_query(user, **params):
+        if not CoreConfig.report_snapshots:
+            return query(user, **params)
+        return get_report_payload(name, user, params)
+
+    return snapshot_python_query
+
+
+def normalize_params(params):
+    # The parameters come from the request, the same report can be asked with 12 or "12"
+    return {key: str(value) for key, value in sorted(params.items()) if value is not None}
+
+
+def params_key(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _snapshot_model():
+    return apps.get_model("core", "ReportSnapshot")
+
+
+def _is_snapshotable(payload):
+    # Parameter errors are cheap to recompute and mustn't stick
+    return isinstance(payload, dict) and "error" not in payload
+
+
+def get_report_payload(name, user, params):
+    """
+    Payload of the report, from its snapshot if it's fresh, refreshed if it's outdated, computed (and stored) if there
+    is no snapshot yet.
+    """
+    snapshot_model = _snapshot_model()
+    params = normalize_params(params)
+    key = params_key(params)
+    now = py_datetime.now()
+    snapshot = snapshot_model.objects.filter(name=name, params_key=key).first()
+    if snapshot is None:
+        payload = SNAPSHOT_SOURCES[name]["query"](user, **params)
+        if _is_snapshotable(payload):
+            snapshot = snapshot_model(name=name, params_key=key, params=json.dumps(params),
+                                      computed_at=now, checked_at=now, served_at=now)
+            snapshot.set_payload(payload)
+            try:
+                snapshot.save()
+            except IntegrityError:
+                # Computed concurrently by another request, either snapshot will do
+                pass
+        return payload
+    if snapshot.checked_at < now - timedelta(seconds=CoreConfig.report_snapshot_ttl):
+        refresh_snapshot(snapshot, user)
+    if snapshot.served_at < now - timedelta(seconds=CoreConfig.report_snapshot_ttl):
+        # Only to tell the snapshots still in use, no need to write it on every hit
+        snapshot_model.objects.filter(id=snapshot.id).update(served_at=now)
+    return snapshot.get_payload()
+
+
+def refresh_snapshot(snapshot, user=None):
+    """
+    Recomputes what changed since the snapshot was last checked.
+    :return: False if the snapshot was up to date
+    """
+    source = SNAPSHOT_SOURCES[snapshot.name]
+    params = snapshot.get_params()
+    # Rows written while refreshing are caught by the next check
+    started = py_datetime.now()
+    full = snapshot.computed_at < started - timedelta(seconds=CoreConfig.report_snapshot_max_age)
+    parts = None if full or source["changed_parts"] is None \
+        else source["changed_parts"](snapshot.checked_at, **params)
+    updates = {"checked_at": started}
+    if parts is None or (parts and source["refresh_parts"] is None):
+        payload = source["query"](user, **params)
+    elif parts:
+        payload = source["refresh_parts"](snapshot.get_payload(), parts, **params)
+    else:
+        payload = None
+    if payload is not None:
+        if not _is_snapshotable(payload):
+            # e.g. the location of a registers status snapshot was deleted
+            snapshot.set_payload(payload)
+            snapshot.delete()
+            return True
+        snapshot.set_payload(payload)
+        updates["payload"] = snapshot.payload
+        if parts is None:
+            updates["computed_at"] = started
+    _snapshot_model().objects.filter(id=snapshot.id).update(**updates)
+    for field, value in updates.items():
+        setattr(snapshot, field, value)
+    return payload is not None
+
+
+def refresh_report_snapshots():
+    """
+    Scheduled refresh of the snapshots that are still in use, the others are deleted.
+    :return: (number of refreshed snapshots, number of deleted snapshots)
+    """
+    if not CoreConfig.report_snapshots:
+        return 0, 0
+    # Registers the snapshot sources of the core reports
+    import core.report  # noqa: F401
+    snapshot_model = _snapshot_model()
+    now = py_datetime.now()
+    deleted, _ = snapshot_model.objects \
+        .filter(served_at__lt=now - timedelta(seconds=CoreConfig.report_snapshot_max_age)) \
+        .delete()
+    refreshed = 0
+    # Half the TTL, so that the snapshots in use are refreshed here rather than by a request
+    outdated = snapshot_model.objects \
+        .filter(checked_at__lt=now - timedelta(seconds=CoreConfig.report_snapshot_ttl // 2)) \
+        .order_by("checked_at")
+    for snapshot in outdated.iterator():
+        if snapshot.name not in SNAPSHOT_SOURCES:
+            continue
+        try:
+            if refresh_snapshot(snapshot):
+                refreshed += 1
+        except Exception as exc:
+            logger.warning("Could not refresh the %s report snapshot %s: %s", snapshot.name, snapshot.params, exc)
+    if refreshed or deleted:
+        logger.info("Report snapshots: %s refreshed, %s deleted", refreshed, deleted)
+    return refreshed, deleted
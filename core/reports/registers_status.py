@@ -1,9 +1,12 @@
 import datetime
 
-from django.db.models import Q, Count, F, Manager, QuerySet
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q, Count, F, Manager, QuerySet, Case, When, Value, IntegerField
 from django.db.models.functions import Coalesce
 
 from core import filter_validity
+from core.apps import CoreConfig
 from core.models import Officer, InteractiveUser
 from location.models import Location, UserDistrict, HealthFacility
 from medical_pricelist.models import ServicesPricelist, ItemsPricelist, ServicesPricelistDetail, ItemsPricelistDetail
@@ -4471,6 +4474,161 @@ def prepare_totals_and_locations(active_locations: QuerySet, location_ids_mappin
         generate_other_subtotals(totals)
 
 
+ROLLUP_DATABASE = "database"
+ROLLUP_PYTHON = "python"
+ACTIVE_LOCATIONS_TIMEOUT = 300
+_ACTIVE_LOCATIONS_KEY = "registers_status_locations_%s_%s"
+LEVEL_LOCATION = "L"
+LEVEL_REGION = "R"
+LEVEL_GLOBAL = "G"
+# Database backends with native GROUPING SETS, the others get a UNION ALL of the three groupings
+GROUPING_SETS_VENDORS = ("postgresql", "microsoft")
+
+
+def fetch_active_locations(active_location_filters: Q, region_id: int, district_id: int):
+    """
+    Active regions/districts of the report, kept in the cache between runs as locations rarely change.
+    """
+    key = _ACTIVE_LOCATIONS_KEY % (region_id, district_id)
+    active_locations = cache.get(key)
+    if active_locations is None:
+        active_locations = list(Location.objects.filter(active_location_filters)
+                                .values("id", "code", "name", "type", "parent_id")
+                                .order_by("-type", "code"))
+        cache.set(key, active_locations, ACTIVE_LOCATIONS_TIMEOUT)
+    return active_locations
+
+
+def annotate_location_buckets(queryset: QuerySet, location_path: str):
+    """
+    Adds what dispatch_results computes in Python as columns: the location line (the location itself if it's an active
+    region/district, FAKE_LOCATION_ID for national data, FAKE_ARCHIVED_ID otherwise) and the region it rolls up to.
+    """
+    national = Q(**{f"{location_path}__isnull": True})
+    active = Q(**{f"{location_path}__validity_to__isnull": True,
+                  f"{location_path}__type__in": [LOCATION_TYPE_REGION, LOCATION_TYPE_DISTRICT]})
+    return queryset.annotate(
+        bucket_location=Case(
+            When(national, then=Value(FAKE_LOCATION_ID)),
+            When(active, then=F(location_path)),
+            default=Value(FAKE_ARCHIVED_ID),
+            output_field=IntegerField(),
+        ),
+        bucket_region=Case(
+            When(national, then=Value(FAKE_REGION_ID)),
+            When(active & Q(**{f"{location_path}__type": LOCATION_TYPE_REGION}), then=F(location_path)),
+            When(active, then=Coalesce(F(f"{location_path}__parent_id"), Value(FAKE_REGION_ID))),
+            default=Value(FAKE_REGION_ID),
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def rollup_counts(queryset: QuerySet, location_path: str = "location"):
+    """
+    Counts the rows of the queryset by location line, by region and in total, in a single query.
+    :return: list of (level, bucket, count), level being LEVEL_LOCATION, LEVEL_REGION or LEVEL_GLOBAL
+    """
+    buckets = annotate_location_buckets(queryset, location_path).values("bucket_location", "bucket_region").order_by()
+    inner_sql, params = buckets.query.sql_with_params()
+    connection = connections[buckets.db]
+    if connection.vendor in GROUPING_SETS_VENDORS:
+        sql = f"""
+            SELECT CASE WHEN GROUPING(b.bucket_location) = 0 THEN '{LEVEL_LOCATION}'
+                        WHEN GROUPING(b.bucket_region) = 0 THEN '{LEVEL_REGION}'
+                        ELSE '{LEVEL_GLOBAL}' END,
+                   COALESCE(b.bucket_location, b.bucket_region), COUNT(*)
+            FROM ({inner_sql}) b
+            GROUP BY GROUPING SETS ((b.bucket_location), (b.bucket_region), ())
+        """
+    else:
+        sql = f"""
+            SELECT '{LEVEL_LOCATION}', b.bucket_location, COUNT(*) FROM ({inner_sql}) b GROUP BY b.bucket_location
+            UNION ALL
+            SELECT '{LEVEL_REGION}', b.bucket_region, COUNT(*) FROM ({inner_sql}) b GROUP BY b.bucket_region
+            UNION ALL
+            SELECT '{LEVEL_GLOBAL}', NULL, COUNT(*) FROM ({inner_sql}) b
+        """
+        params = tuple(params) * 3
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def dispatch_rollup(rows: list, category: str, totals: dict):
+    """
+    Stores the counts rolled up by the database. Lines that the report doesn't show (e.g. archived locations when a
+    region is selected) are only part of the global total.
+    """
+    levels = {LEVEL_LOCATION: totals["by_location"], LEVEL_REGION: totals["by_region"]}
+    for level, bucket, count in rows:
+        if level == LEVEL_GLOBAL:
+            totals["global"][category] += count
+        elif bucket in levels[level]:
+            levels[level][bucket][category] += count
+
+
+def location_scope(location_path: str, region_id: int, district_id: int):
+    # Rows of the selected district, or of the selected region and its districts
+    if district_id != ALL_DISTRICTS:
+        return Q(**{f"{location_path}_id": district_id})
+    if region_id != ALL_REGIONS:
+        return Q(**{f"{location_path}__parent_id": region_id}) | Q(**{f"{location_path}_id": region_id})
+    return Q()
+
+
+def changed_since(since: datetime.datetime,
+                  requested_region_id: int = ALL_REGIONS,
+                  requested_district_id: int = ALL_DISTRICTS,
+                  **kwargs):
+    """
+    Tells the report snapshots whether the report of a region/district has to be recomputed: only if rows of its
+    locations have been written (created, updated or archived) since the given time.
+    :return: [] if nothing changed, None otherwise
+    """
+    if since.date() != datetime.date.today():
+        # Officers become inactive with the date
+        return None
+    region_id, district_id = int(requested_region_id), int(requested_district_id)
+    written = Q(validity_from__gt=since) | Q(validity_to__gt=since)
+    if Location.objects.filter(written).exists():
+        return None
+    scope = location_scope("location", region_id, district_id)
+    for manager in (Officer.objects, UserDistrict.objects, Product.objects, HealthFacility.objects,
+                    ServicesPricelist.objects, ItemsPricelist.objects, Payer.objects):
+        if manager.filter(scope & written).exists():
+            return None
+    if ServicesPricelistDetail.objects.filter(
+            location_scope("services_pricelist__location", region_id, district_id) & written).exists():
+        return None
+    if ItemsPricelistDetail.objects.filter(
+            location_scope("items_pricelist__location", region_id, district_id) & written).exists():
+        return None
+    return []
+
+
+def category_sources(search_filters: Q, service_details_filters: Q, item_details_filters: Q):
+    """
+    :return: list of (category, queryset, path to the location) of the report
+    """
+    today = datetime.date.today()
+    return [
+        (CATEGORY_ACTIVE_EO,
+         Officer.objects.filter(search_filters & (Q(works_to__isnull=True) | Q(works_to__gt=today))), "location"),
+        (CATEGORY_INACTIVE_EO, Officer.objects.filter(search_filters & Q(works_to__lte=today)), "location"),
+        (CATEGORY_USERS, UserDistrict.objects.filter(search_filters), "location"),
+        (CATEGORY_PRODUCTS, Product.objects.filter(search_filters), "location"),
+        (CATEGORY_HFS, HealthFacility.objects.filter(search_filters), "location"),
+        (CATEGORY_SERVICE_PLS, ServicesPricelist.objects.filter(search_filters), "location"),
+        (CATEGORY_ITEM_PLS, ItemsPricelist.objects.filter(search_filters), "location"),
+        (CATEGORY_PAYERS, Payer.objects.filter(search_filters), "location"),
+        (CATEGORY_SERVICE_PL_DETAILS, ServicesPricelistDetail.objects.filter(service_details_filters),
+         "services_pricelist__location"),
+        (CATEGORY_ITEM_PL_DETAILS, ItemsPricelistDetail.objects.filter(item_details_filters),
+         "items_pricelist__location"),
+    ]
+
+
 def registers_status_query(user,
                            requested_region_id: int = ALL_REGIONS,
                            requested_district_id: int = ALL_DISTRICTS,
@@ -4529,9 +4687,7 @@ def registers_status_query(user,
         active_location_filters &= Q(type__in=['R', 'D'])
 
     # Preparing the list of locations & totals
-    active_locations = Location.objects.filter(active_location_filters) \
-                                       .values("id", "code", "name", "type", "parent_id") \
-                                       .order_by("-type", "code")
+    active_locations = fetch_active_locations(active_location_filters, region_id, district_id)
     location_ids_mapping = {}
     totals = {
         "global": generate_subtotals_dict(),
@@ -4541,43 +4697,30 @@ def registers_status_query(user,
     prepare_totals_and_locations(active_locations, location_ids_mapping, totals, region_id, district_id)
 
     # Prepare the location filters
-    search_filters = Q(validity_to__isnull=True)
-    if district_id != ALL_DISTRICTS:
-        search_filters &= Q(location_id=district_id)
-    elif region_id != ALL_REGIONS:
-        search_filters &= (Q(location__parent_id=region_id) | Q(location_id=region_id))
-
-    # Fetch every data type
-    fetch_active_officers(location_ids_mapping, search_filters, totals)
-    fetch_inactive_officers(location_ids_mapping, search_filters, totals)
-    fetch_users(location_ids_mapping, search_filters, totals)
-    fetch_products(location_ids_mapping, search_filters, totals)
-    fetch_health_facilities(location_ids_mapping, search_filters, totals)
-    fetch_service_pricelists(location_ids_mapping, search_filters, totals)
-    fetch_item_pricelists(location_ids_mapping, search_filters, totals)
-    fetch_payers(location_ids_mapping, search_filters, totals)
-
-    # Special filter as location is not directly stored in the object
-    service_details_filters = Q(validity_to__isnull=True)
-    if district_id != ALL_DISTRICTS:
-        service_details_filters &= Q(services_pricelist__location_id=district_id)
-    elif region_id != ALL_REGIONS:
-        service_details_filters &= (
-                Q(services_pricelist__location__parent_id=region_id)
-                | Q(services_pricelist__location_id=region_id)
-        )
-    fetch_service_pricelist_details(location_ids_mapping, service_details_filters, totals)
+    search_filters = Q(validity_to__isnull=True) & location_scope("location", region_id, district_id)
+    # Special filters as location is not directly stored in the object
+    service_details_filters = Q(validity_to__isnull=True) \
+        & location_scope("services_pricelist__location", region_id, district_id)
+    item_details_filters = Q(validity_to__isnull=True) \
+        & location_scope("items_pricelist__location", region_id, district_id)
 
-    # Special filter as location is not directly stored in the object
-    item_details_filters = Q(validity_to__isnull=True)
-    if district_id != ALL_DISTRICTS:
-        item_details_filters &= Q(items_pricelist__location_id=district_id)
-    elif region_id != ALL_REGIONS:
-        item_details_filters &= (
-                Q(items_pricelist__location__parent_id=region_id)
-                | Q(items_pricelist__location_id=region_id)
-        )
-    fetch_item_pricelist_details(location_ids_mapping, item_details_filters, totals)
+    if CoreConfig.registers_status_rollup == ROLLUP_DATABASE:
+        # One query per category, rolled up to the regions and the global total by the database
+        for category, queryset, location_path in category_sources(search_filters, service_details_filters,
+                                                                  item_details_filters):
+            dispatch_rollup(rollup_counts(queryset, location_path), category, totals)
+    else:
+        # Fetch every data type
+        fetch_active_officers(location_ids_mapping, search_filters, totals)
+        fetch_inactive_officers(location_ids_mapping, search_filters, totals)
+        fetch_users(location_ids_mapping, search_filters, totals)
+        fetch_products(location_ids_mapping, search_filters, totals)
+        fetch_health_facilities(location_ids_mapping, search_filters, totals)
+        fetch_service_pricelists(location_ids_mapping, search_filters, totals)
+        fetch_item_pricelists(location_ids_mapping, search_filters, totals)
+        fetch_payers(location_ids_mapping, search_filters, totals)
+        fetch_service_pricelist_details(location_ids_mapping, service_details_filters, totals)
+        fetch_item_pricelist_details(location_ids_mapping, item_details_filters, totals)
 
     # Format the fetched data to match what is required in the report
     format_global_totals(report_data, totals)
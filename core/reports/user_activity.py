@@ -1,11 +1,21 @@
+import heapq
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from django.apps import apps
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import F, Q
+from django.db import connections
+from django.db.models import F, OuterRef, Q, Subquery
 from django.db.models.functions import Coalesce
 
+from core.apps import CoreConfig
 from core.models import InteractiveUser, Officer
+from core.user_names import get_user_display_names
 from payer.models import Payer
 
+logger = logging.getLogger(__name__)
+
 # If manually pasting from reportbro and you have test data, search and replace \" with '
 template = """
 {
@@ -3072,81 +3082,163 @@ def determine_action_type(element_id: int, validity_to: str, legacy_id: str, kno
                 return ACTION_INSERT
 
 
-def determine_description(entity, element):
+def _location_string(row, default):
+    return f"{row['location__name']} ({row['location__code']})" if row["location_id"] else default
+
+
+def _payer_type(payer_type):
+    return dict(Payer.PAYER_TYPE_CHOICES).get(payer_type, "Unknown")
+
+
+def _feedback_officer_annotations():
+    # Feedback.officer_id is not a foreign key, the officer's name is fetched with subqueries in the same query
+    officer = Officer.objects.filter(id=OuterRef("officer_id"))
+    return {
+        "officer_other_names": Subquery(officer.values("other_names")[:1]),
+        "officer_last_name": Subquery(officer.values("last_name")[:1]),
+    }
+
+
+def _feedback_description(row):
+    officer_name = f"{row['officer_other_names']} {row['officer_last_name']}" \
+        if row["officer_last_name"] is not None else "unknown Officer"
+    claim_name = f"Claim {row['claim__code']}" if row["claim_id"] else "unknown Claim"
+    return f"Feedback entered on {row['feedback_date']} by {officer_name} for {claim_name}"
+
+
+# Fields fetched by values() for each entity, as base fields plus "fields" (following the foreign keys in the same
+# query) and "annotations" (factory of the annotations for what can't be reached through a foreign key), and the
+# description built from the fetched row.
+BASE_FIELDS = ("id", "legacy_id", "validity_from", "validity_to", "audit_user_id")
+LOCATION_FIELDS = ["location_id", "location__name", "location__code"]
+ENTITY_SPECS = {
+    ENTITY_CLAIM: {
+        "fields": ["code", "health_facility__code"],
+        "description": lambda row: f"Claim {row['code']} for Health Facility {row['health_facility__code']}",
+    },
+    ENTITY_BATCH_RUN: {
+        "fields": ["run_month", "run_year", *LOCATION_FIELDS],
+        "description": lambda row: f"Batch run for period {row['run_month']}/{row['run_year']} in "
+                                   f"{_location_string(row, 'all regions & districts')}",
+    },
+    ENTITY_CLAIM_ADMIN: {
+        "fields": ["code", "other_names", "last_name"],
+        "description": lambda row: f"Claim admin {row['code']} - {row['other_names']} {row['last_name']}",
+    },
+    ENTITY_EXTRACT: {
+        "fields": ["date", "direction", "type"],
+        "description": lambda row: f"Extract done on {row['date']} - "
+                                   f"{EXTRACT_DIRECTIONS.get(row['direction'], 'Unknown')} - {row['type']}",
+    },
+    ENTITY_FAMILY: {
+        "fields": ["head_insuree__chf_id", *LOCATION_FIELDS],
+        "description": lambda row: f"Family - Head number {row['head_insuree__chf_id']} - "
+                                   f"{_location_string(row, 'without any location')}",
+    },
+    ENTITY_FEEDBACK: {
+        "fields": ["feedback_date", "claim_id", "claim__code"],
+        "annotations": _feedback_officer_annotations,
+        "description": _feedback_description,
+    },
+    ENTITY_LOC_HF: {
+        "fields": ["code", "name", "location__name", "location__code"],
+        "description": lambda row: f"Health Facility {row['code']} - {row['name']} in {row['location__name']} "
+                                   f"({row['location__code']})",
+    },
+    ENTITY_INSUREE: {
+        "fields": ["chf_id", "other_names", "last_name"],
+        "description": lambda row: f"Insuree {row['chf_id']} - {row['other_names']} {row['last_name']}",
+    },
+    ENTITY_ITEM: {
+        "fields": ["code", "name"],
+        "description": lambda row: f"Item {row['code']} - {row['name']}",
+    },
+    ENTITY_OFFICER: {
+        "fields": ["code", "other_names", "last_name"],
+        "description": lambda row: f"Enrollment Officer {row['code']} - {row['other_names']} {row['last_name']}",
+    },
+    ENTITY_PAYER: {
+        "fields": ["name", "type"],
+        "description": lambda row: f"Payer {row['name']} - type {_payer_type(row['type'])}",
+    },
+    ENTITY_PHOTO: {
+        "fields": ["insuree__chf_id"],
+        "description": lambda row: f"Insuree Picture for Insuree {row['insuree__chf_id']}",
+    },
+    ENTITY_PL_ITEM: {
+        "fields": ["name", *LOCATION_FIELDS],
+        "description": lambda row: f"Item Pricelist - {row['name']} - "
+                                   f"{_location_string(row, 'without specific location')}",
+    },
+    ENTITY_PL_SERVICE: {
+        "fields": ["name", *LOCATION_FIELDS],
+        "description": lambda row: f"Service Pricelist - {row['name']} - "
+                                   f"{_location_string(row, 'without specific location')}",
+    },
+    ENTITY_PL_ITEM_DETAILS: {
+        "fields": ["item__code", "item__name", "items_pricelist__name"],
+        "description": lambda row: f"Item {row['item__code']} - {row['item__name']} - in the Price List "
+                                   f"\"{row['items_pricelist__name']}\"",
+    },
+    ENTITY_PL_SERVICE_DETAILS: {
+        "fields": ["service__code", "service__name", "services_pricelist__name"],
+        "description": lambda row: f"Service {row['service__code']} - {row['service__name']} - in the Price List "
+                                   f"\"{row['services_pricelist__name']}\"",
+    },
+    ENTITY_POLICY: {
+        "fields": ["family__head_insuree__chf_id"],
+        "description": lambda row: f"Policy to Family - Head number {row['family__head_insuree__chf_id']}",
+    },
+    ENTITY_PREMIUM: {
+        "fields": ["amount", "policy__family__head_insuree__chf_id", "policy__start_date"],
+        "description": lambda row: f"Premium of {row['amount']} - Family Head "
+                                   f"{row['policy__family__head_insuree__chf_id']} - Policy start on "
+                                   f"{row['policy__start_date']}",
+    },
+    ENTITY_PRODUCT: {
+        "fields": ["code", "name"],
+        "description": lambda row: f"Product {row['code']} - {row['name']}",
+    },
+    ENTITY_PRODUCT_ITEM: {
+        "fields": ["item__code", "product__code"],
+        "description": lambda row: f"Item {row['item__code']} in Product {row['product__code']}",
+    },
+    ENTITY_PRODUCT_SERVICE: {
+        "fields": ["service__code", "product__code"],
+        "description": lambda row: f"Service {row['service__code']} in Product {row['product__code']}",
+    },
+    ENTITY_RELATIVE_DISTRIBUTION: {
+        "fields": ["product__code", "product__name"],
+        "description": lambda row: f"Relative distribution in Product {row['product__code']} - "
+                                   f"{row['product__name']}",
+    },
+    ENTITY_SERVICE: {
+        "fields": ["code", "name"],
+        "description": lambda row: f"Service {row['code']} - {row['name']}",
+    },
+    ENTITY_USER: {
+        "fields": ["other_names", "last_name", "login_name"],
+        "description": lambda row: f"User {row['other_names']} {row['last_name']} - login {row['login_name']}",
+    },
+    ENTITY_USER_DISTRICT: {
+        "fields": ["user__login_name", "location__code", "location__name"],
+        "description": lambda row: f"User {row['user__login_name']} assigned to District {row['location__code']} "
+                                   f"{row['location__name']}",
+    },
+    ENTITY_LOCATION: {
+        "fields": ["type", "code", "name"],
+        "description": lambda row: f"{LOCATION_TYPES[row['type']]} {row['code']} - {row['name']} ",
+    },
+}
+
+
+def determine_description(entity, row):
     # Determines the description string that must be generated, based on the element's nature
-    if entity == ENTITY_CLAIM:
-        hf_code = element.health_facility.code
-        return f"Claim {element.code} for Health Facility {hf_code}"
-    if entity == ENTITY_BATCH_RUN:
-        location = element.location
-        location_string = f"{location.name} ({location.code})" if location else "all regions & districts"
-        return f"Batch run for period {element.run_month}/{element.run_year} in {location_string}"
-    if entity == ENTITY_CLAIM_ADMIN:
-        return f"Claim admin {element.code} - {element.other_names} {element.last_name}"
-    if entity == ENTITY_EXTRACT:
-        direction = EXTRACT_DIRECTIONS.get(element.direction, "Unknown")
-        return f"Extract done on {element.date} - {direction} - {element.type}"
-    if entity == ENTITY_FAMILY:
-        location = element.location
-        location_string = f"{location.name} ({location.code})" if location else "without any location"
-        return f"Family - Head number {element.head_insuree.chf_id} - {location_string}"
-    if entity == ENTITY_FEEDBACK:
-        officer = Officer.objects.filter(id=element.officer_id).first()
-        officer_name = f"{officer.other_names} {officer.last_name}" if officer else "unknown Officer"
-        claim_name = f"Claim {element.claim.code}" if element.claim else "unknown Claim"
-        return f"Feedback entered on {element.feedback_date} by {officer_name} for {claim_name}"
-    if entity == ENTITY_LOC_HF:
-        return f"Health Facility {element.code} - {element.name} in {element.location.name} ({element.location.code})"
-    if entity == ENTITY_INSUREE:
-        return f"Insuree {element.chf_id} - {element.other_names} {element.last_name}"
-    if entity == ENTITY_ITEM:
-        return f"Item {element.code} - {element.name}"
-    if entity == ENTITY_OFFICER:
-        return f"Enrollment Officer {element.code} - {element.other_names} {element.last_name}"
-    if entity == ENTITY_PAYER:
-        displayed_type = "Unknown"
-        for payer_type in Payer.PAYER_TYPE_CHOICES:
-            if payer_type[0] == element.type:
-                displayed_type = payer_type[1]
-                break
-        return f"Payer {element.name} - type {displayed_type}"
-    if entity == ENTITY_PHOTO:
-        return f"Insuree Picture for Insuree {element.insuree.chf_id}"
-    if entity == ENTITY_PL_ITEM:
-        location = element.location
-        location_string = f"{location.name} ({location.code})" if location else "without specific location"
-        return f"Item Pricelist - {element.name} - {location_string}"
-    if entity == ENTITY_PL_SERVICE:
-        location = element.location
-        location_string = f"{location.name} ({location.code})" if location else "without specific location"
-        return f"Service Pricelist - {element.name} - {location_string}"
-    if entity == ENTITY_PL_ITEM_DETAILS:
-        return f"Item {element.item.code} - {element.item.name} - in the Price List \"{element.items_pricelist.name}\""
-    if entity == ENTITY_PL_SERVICE_DETAILS:
-        return f"Service {element.service.code} - {element.service.name} - in the Price List \"{element.services_pricelist.name}\""
-    if entity == ENTITY_POLICY:
-        return f"Policy to Family - Head number {element.family.head_insuree.chf_id}"
-    if entity == ENTITY_PREMIUM:
-        return f"Premium of {element.amount} - Family Head {element.policy.family.head_insuree.chf_id} - Policy start on {element.policy.start_date}"
-    if entity == ENTITY_PRODUCT:
-        return f"Product {element.code} - {element.name}"
-    if entity == ENTITY_PRODUCT_ITEM:
-        return f"Item {element.item.code} in Product {element.product.code}"
-    if entity == ENTITY_PRODUCT_SERVICE:
-        return f"Service {element.service.code} in Product {element.product.code}"
-    if entity == ENTITY_RELATIVE_DISTRIBUTION:
-        return f"Relative distribution in Product {element.product.code} - {element.product.name}"
-    if entity == ENTITY_SERVICE:
-        return f"Service {element.code} - {element.name}"
-    if entity == ENTITY_USER:
-        return f"User {element.other_names} {element.last_name} - login {element.login_name}"
-    if entity == ENTITY_USER_DISTRICT:
-        return f"User {element.user.login_name} assigned to District {element.location.code} {element.location.name}"
-    if entity == ENTITY_LOCATION:
-        return f"{LOCATION_TYPES[element.type]} {element.code} - {element.name} "
-    else:
-        # This should not happen, but just in case
-        return f"{element.id} - {element.legacy_id} - from {element.validity_from} - to {element.validity_to}"
+    spec = ENTITY_SPECS.get(entity)
+    if spec:
+        return spec["description"](row)
+    # This should not happen, but just in case
+    return f"{row['id']} - {row['legacy_id']} - from {row['validity_from']} - to {row['validity_to']}"
 
 
 def determine_datetime(validity_to, validity_from, action_type):
@@ -3156,59 +3248,73 @@ def determine_datetime(validity_to, validity_from, action_type):
     return validity_to if validity_to else validity_from
 
 
+def report_sort_key(data_element):
+    return data_element["user_name"], data_element["datetime"]
+
+
+def iter_entity_rows(requested_entity: str, report_params: dict, user_id: int):
+    """
+    Streams the rows of an entity changed during the report period, in a single query: values() of the fields listed
+    in ENTITY_SPECS, ordered for the action type state machine.
+    :raises LookupError: if the module of the entity is not installed
+    """
+    manager = apps.get_model(MODULE_MAPPING[requested_entity], requested_entity)
+    spec = ENTITY_SPECS.get(requested_entity, {})
+    filters = (
+                      Q(validity_to__lte=report_params["date_to"])
+                      & Q(validity_to__gte=report_params["date_from"])
+              ) | (
+                      Q(validity_to__isnull=True)
+                      & Q(validity_from__lte=report_params["date_to"])
+                      & Q(validity_from__gte=report_params["date_from"])
+              )
+    if user_id != ALL_USERS:
+        filters &= Q(audit_user_id=user_id)
+    annotations = spec["annotations"]() if "annotations" in spec else {}
+    return manager.objects.filter(filters) \
+        .annotate(order_date=Coalesce("validity_to", "validity_from"), **annotations) \
+        .order_by("order_date", "-id") \
+        .values(*BASE_FIELDS, *spec.get("fields", ()), *annotations) \
+        .iterator()
+
+
 def fetch_entity_data(requested_entity: str,
                       report_params: dict,
                       user_id: int,
                       user_names_mapping: dict,
                       trigger_missing_entity_error=True):
+    """
+    :return: (success, data elements of the entity sorted by user name and datetime)
+    """
     data = []
     try:
-        manager = apps.get_model(MODULE_MAPPING[requested_entity], requested_entity)
-        # TODO : prepare a mapping of the list of fields that are needed for each entity -> use .only(list) ?
-        filters = (
-                          Q(validity_to__lte=report_params["date_to"])
-                          & Q(validity_to__gte=report_params["date_from"])
-                  ) | (
-                          Q(validity_to__isnull=True)
-                          & Q(validity_from__lte=report_params["date_to"])
-                          & Q(validity_from__gte=report_params["date_from"])
-                  )
-        if user_id != ALL_USERS:
-            filters &= Q(audit_user_id=user_id)
-        elements = manager.objects.filter(filters) \
-                                  .annotate(order_date=Coalesce("validity_to", "validity_from")) \
-                                  .order_by("order_date", "-id")
-
+        rows = iter_entity_rows(requested_entity, report_params, user_id)
         known_legacy_ids = set()
-
-        for element in elements:
-
-            action_type = determine_action_type(element.id, element.validity_to, element.legacy_id, known_legacy_ids)
+        for row in rows:
+            action_type = determine_action_type(row["id"], row["validity_to"], row["legacy_id"], known_legacy_ids)
             if action_type != report_params["action"] and report_params["action"] != ACTION_ALL:
                 continue
 
             new_data_element = {
                 "entity": requested_entity,
                 "action": action_type,
-                "description": determine_description(requested_entity, element),
-                "datetime": determine_datetime(element.validity_to, element.validity_from, action_type),
-                "user_name": user_names_mapping.get(element.audit_user_id, "openIMIS"),
+                "description": determine_description(requested_entity, row),
+                "datetime": determine_datetime(row["validity_to"], row["validity_from"], action_type),
+                "user_name": user_names_mapping.get(row["audit_user_id"], "openIMIS"),
             }
             data.append(new_data_element)
 
+        data.sort(key=report_sort_key)
         return True, data
 
     except LookupError:
         if trigger_missing_entity_error:
             return False, data
+        return True, data
 
 
 def map_user_ids_to_user_names():
-    mapping = {}
-    users = InteractiveUser.objects.order_by("id").all()
-    for user in users:
-        mapping[user.id] = f"{user.other_names} {user.last_name}"
-    return mapping
+    return get_user_display_names()
 
 
 def user_activity_query(user,
@@ -3252,7 +3358,6 @@ def user_activity_query(user,
         fetch_success, entity_data = fetch_entity_data(entity, header, user_id, user_names_mapping)
 
         if fetch_success:
-            entity_data.sort(key=lambda x: (x["user_name"], x["datetime"]))
             report_data["data"] = entity_data
         else:
             report_data["error"] = "Error - the module requested is not installed"
@@ -3260,17 +3365,92 @@ def user_activity_query(user,
         return report_data
 
     else:
-        # Fetching data for all available entities that are installed in the current instance
-        fetched_data = []
-        for current_entity in AVAILABLE_ENTITIES:
-            fetch_success, entity_data = fetch_entity_data(current_entity,
-                                                           header,
-                                                           user_id,
-                                                           user_names_mapping,
-                                                           trigger_missing_entity_error=False)
-            fetched_data.extend(entity_data)
-
-        fetched_data.sort(key=lambda x: (x["user_name"], x["datetime"]))
-        report_data["data"] = fetched_data
+        # Fetching data for all available entities that are installed in the current instance. Each entity is already
+        # sorted, they only need to be merged (ties keep the order of AVAILABLE_ENTITIES, as the former global sort)
+        entities_data = fetch_all_entities_data(header, user_id, user_names_mapping)
+        report_data["data"] = list(heapq.merge(*entities_data, key=report_sort_key))
 
         return report_data
+
+
+def _timed_fetch_entity_data(entity, report_params, user_id, user_names_mapping):
+    start = time.perf_counter()
+    _, entity_data = fetch_entity_data(entity, report_params, user_id, user_names_mapping,
+                                       trigger_missing_entity_error=False)
+    logger.debug("User activity report: %s rows of %s fetched in %.3fs",
+                 len(entity_data), entity, time.perf_counter() - start)
+    return entity_data
+
+
+def _threaded_fetch_entity_data(*args):
+    try:
+        return _timed_fetch_entity_data(*args)
+    finally:
+        # Each worker thread opened its own connection
+        connections.close_all()
+
+
+def fetch_all_entities_data(report_params, user_id, user_names_mapping):
+    """
+    Fetches the data of every entity of AVAILABLE_ENTITIES, concurrently in up to
+    CoreConfig.user_activity_report_concurrency threads (each with its own database connection).
+    :return: the sorted data of each entity, in the order of AVAILABLE_ENTITIES
+    """
+    start = time.perf_counter()
+    concurrency = min(CoreConfig.user_activity_report_concurrency, len(AVAILABLE_ENTITIES))
+    fetch_args = [(entity, report_params, user_id, user_names_mapping) for entity in AVAILABLE_ENTITIES]
+    if concurrency <= 1:
+        entities_data = [_timed_fetch_entity_data(*args) for args in fetch_args]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="user_activity") as executor:
+            entities_data = list(executor.map(lambda args: _threaded_fetch_entity_data(*args), fetch_args))
+    logger.debug("User activity report: %s entities fetched in %.3fs with %s threads",
+                 len(AVAILABLE_ENTITIES), time.perf_counter() - start, max(concurrency, 1))
+    return entities_data
+
+
+def changed_entities(since, date_start: str, date_end: str, requested_user_id: int = ALL_USERS,
+                     action: str = ACTION_ALL, entity: str = ENTITY_ALL, **kwargs):
+    """
+    Tells the report snapshots which entities of the report have to be recomputed: those with rows written (created,
+    updated or archived) since the given time. An update can move a row out of a past period (its validity_from is
+    reset), so the period of the report doesn't narrow it down.
+    :return: the changed entities, None if the whole report has to be recomputed
+    """
+    written = Q(validity_from__gt=since) | Q(validity_to__gt=since)
+    if InteractiveUser.objects.filter(written).exists():
+        # The user names are on every line
+        return None
+    user_id = int(requested_user_id)
+    if user_id != ALL_USERS:
+        written &= Q(audit_user_id=user_id)
+    changed = []
+    for requested_entity in (AVAILABLE_ENTITIES if entity == ENTITY_ALL else [entity]):
+        try:
+            manager = apps.get_model(MODULE_MAPPING[requested_entity], requested_entity)
+        except LookupError:
+            continue
+        if manager.objects.filter(written).exists():
+            changed.append(requested_entity)
+    return changed
+
+
+def refresh_entities(payload: dict, entities: list, date_start: str, date_end: str,
+                     requested_user_id: int = ALL_USERS, action: str = ACTION_ALL, entity: str = ENTITY_ALL,
+                     **kwargs):
+    """
+    Recomputes the lines of the given entities in a report snapshot, the lines of the other entities are kept.
+    """
+    if entity != ENTITY_ALL:
+        return user_activity_query(None, date_start, date_end, requested_user_id, action, entity)
+    user_id = int(requested_user_id)
+    user_names_mapping = map_user_ids_to_user_names()
+    entities_data = {requested_entity: [] for requested_entity in AVAILABLE_ENTITIES}
+    for element in payload["data"]:
+        # Still sorted within each entity
+        entities_data[element["entity"]].append(element)
+    for requested_entity in entities:
+        entities_data[requested_entity] = _timed_fetch_entity_data(requested_entity, payload["header"][0], user_id,
+                                                                   user_names_mapping)
+    payload["data"] = list(heapq.merge(*entities_data.values(), key=report_sort_key))
+    return payload
@@ -0,0 +1,175 @@
+"""
+Cache of the rights granted to interactive users through their roles.
+
+Every user entry records the version stamp of each of its roles at the time it was computed. Changing the rights of
+a role only bumps that role's stamp, which makes every entry built on the previous stamp stale without having to
+find the users holding that role. Changing the roles of a user simply drops the user's entry.
+"""
+import logging
+import threading
+import uuid
+
+from django.apps import apps
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+RIGHTS_CACHE_TIMEOUT = 600
+
+_USER_RIGHTS_KEY = "user_rights_%s"
+_ROLE_VERSION_KEY = "role_rights_version_%s"
+# Legacy key, still dropped on invalidation so that processes running older code don't serve stale rights
+_LEGACY_USER_RIGHTS_KEY = "rights_%s"
+_ADMIN_KEY = "is_admin_%s"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _count(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def rights_cache_stats():
+    """
+    :return: a copy of the hit/miss counters of this process since start or last reset
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_rights_cache_stats():
+    with _stats_lock:
+        for counter in _stats:
+            _stats[counter] = 0
+
+
+def _role_versions(role_ids):
+    keys = {role_id: _ROLE_VERSION_KEY % role_id for role_id in role_ids}
+    stored = cache.get_many(keys.values()) if keys else {}
+    return {role_id: stored.get(key) for role_id, key in keys.items()}
+
+
+def _fetch_role_ids(user_ids):
+    user_role_model = apps.get_model("core", "UserRole")
+    roles_per_user = {user_id: set() for user_id in user_ids}
+    for user_id, role_id in user_role_model.filter_queryset() \
+            .filter(user_id__in=user_ids) \
+            .values_list("user_id", "role_id"):
+        roles_per_user[user_id].add(role_id)
+    return roles_per_user
+
+
+def _fetch_role_rights(role_ids):
+    role_right_model = apps.get_model("core", "RoleRight")
+    rights_per_role = {role_id: set() for role_id in role_ids}
+    if role_ids:
+        for role_id, right_id in role_right_model.filter_queryset() \
+                .filter(role_id__in=role_ids) \
+                .values_list("role_id", "right_id"):
+            rights_per_role[role_id].add(right_id)
+    return rights_per_role
+
+
+def _build_entries(roles_per_user):
+    all_role_ids = set().union(*roles_per_user.values()) if roles_per_user else set()
+    # Versions first: a role changed in between leaves an entry stamped with its previous version, thus stale
+    versions = _role_versions(all_role_ids)
+    rights_per_role = _fetch_role_rights(all_role_ids)
+    entries = {}
+    for user_id, role_ids in roles_per_user.items():
+        rights = set()
+        for role_id in role_ids:
+            rights |= rights_per_role[role_id]
+        entries[user_id] = {
+            "roles": {role_id: versions[role_id] for role_id in role_ids},
+            "rights": sorted(rights),
+        }
+    return entries
+
+
+def get_user_rights(user_id):
+    """
+    Rights (as RightID integers) granted to an interactive user through its currently valid roles.
+    A warm entry costs two cache reads and no database query.
+    """
+    entry = cache.get(_USER_RIGHTS_KEY % user_id)
+    if entry is not None and _role_versions(entry["roles"].keys()) == entry["roles"]:
+        _count("hits")
+        return entry["rights"]
+    _count("misses")
+    entry = _build_entries(_fetch_role_ids([user_id]))[user_id]
+    cache.set(_USER_RIGHTS_KEY % user_id, entry, RIGHTS_CACHE_TIMEOUT)
+    return entry["rights"]
+
+
+def invalidate_user_rights(user_id):
+    """
+    To be called whenever the UserRole of an interactive user change.
+    """
+    cache.delete_many([
+        _USER_RIGHTS_KEY % user_id,
+        _LEGACY_USER_RIGHTS_KEY % user_id,
+        _ADMIN_KEY % user_id,
+    ])
+
+
+def invalidate_role_rights(role_id):
+    """
+    To be called whenever the RoleRight of a role change (or the role itself is deleted). All cached entries of users
+    holding that role become stale at once.
+    """
+    cache.set(_ROLE_VERSION_KEY % role_id, uuid.uuid4().hex, None)
+    user_role_model = apps.get_model("core", "UserRole")
+    # The admin flag is cheap to recompute and keyed by user, no stamp for it
+    cache.delete_many([
+        _ADMIN_KEY % user_id for user_id in user_role_model.filter_queryset()
+        .filter(role_id=role_id).values_list("user_id", flat=True)
+    ])
+
+
+def warm_rights_cache(user_ids=None):
+    """
+    Computes and stores the rights of all active interactive users (or only the given ones) in bulk: one query for the
+    user roles, one for the role rights and a single cache write.
+    :return: the number of cached users
+    """
+    if user_ids is None:
+        # Kept as a queryset so that the user roles are filtered with a subquery rather than a huge IN list
+        interactive_user_model = apps.get_model("core", "InteractiveUser")
+        user_ids = interactive_user_model.filter_queryset().values_list("id", flat=True)
+    entries = _build_entries(_fetch_role_ids(user_ids))
+    cache.set_many({_USER_RIGHTS_KEY % user_id: entry for user_id, entry in entries.items()}, RIGHTS_CACHE_TIMEOUT)
+    logger.info("Rights cache warmed for %s users", len(entries))
+    return len(entries)
+
+
+class CompiledPermissions:
+    """
+    Snapshot of what a user is allowed to do, computed once and memoized on the User instance (i.e. once per request
+    for info.context.user / request.user) so that permission checks are set lookups without any query.
+    """
+    __slots__ = ("is_imis_admin", "is_superuser", "rights")
+
+    def __init__(self, is_imis_admin=False, is_superuser=False, rights=frozenset()):
+        self.is_imis_admin = is_imis_admin
+        self.is_superuser = is_superuser
+        self.rights = frozenset(rights)
+
+    @classmethod
+    def for_interactive_user(cls, i_user):
+        if i_user is None:
+            return cls()
+        return cls(
+            is_imis_admin=i_user.is_imis_admin,
+            is_superuser=i_user.is_superuser,
+            rights=(str(right) for right in get_user_rights(i_user.id)),
+        )
+
+    def has_perm(self, perm):
+        return self.is_superuser or perm in self.rights
+
+    def __repr__(self):
+        return "CompiledPermissions(admin=%s, superuser=%s, %s rights)" % (
+            self.is_imis_admin, self.is_superuser, len(self.rights))
@@ -0,0 +1,49 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from core.apps import CoreConfig
+from core.exports import reap_expired_exports
+from core.last_login import flush_last_logins
+from core.mutation_archive import archive_mutation_logs
+from core.report_snapshots import refresh_report_snapshots
+from core.rights_cache import RIGHTS_CACHE_TIMEOUT, warm_rights_cache
+
+
+def schedule_tasks(scheduler: BackgroundScheduler):
+    scheduler.add_job(
+        warm_rights_cache,
+        # Refresh before the entries expire so that has_perm keeps hitting the cache
+        trigger=IntervalTrigger(seconds=RIGHTS_CACHE_TIMEOUT // 2),
+        id="core_warm_rights_cache",
+        max_instances=1,
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        flush_last_logins,
+        trigger=IntervalTrigger(seconds=CoreConfig.last_login_flush_interval),
+        id="core_flush_last_logins",
+        max_instances=1,
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        reap_expired_exports,
+        trigger=IntervalTrigger(hours=1),
+        id="core_reap_expired_exports",
+        max_instances=1,
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        refresh_report_snapshots,
+        # Snapshots are refreshed once outdated by half their TTL
+        trigger=IntervalTrigger(seconds=max(CoreConfig.report_snapshot_ttl // 2, 60)),
+        id="core_refresh_report_snapshots",
+        max_instances=1,
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        archive_mutation_logs,
+        trigger=IntervalTrigger(days=1),
+        id="core_archive_mutation_logs",
+        max_instances=1,
+        replace_existing=True,
+    )
@@ -25,26 +25,34 @@ from core.services import (
 )
 from core.tasks import openimis_mutation_async
 from core import filter_validity
-from django import dispatch
+from core.signals import MutationSignal, MutationSignalRegistry
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
-from django.db.models import Q, Count
+from django.db.models import Q, Count, QuerySet
 from django.db.models.expressions import RawSQL
 from django.http import HttpRequest
 from django.utils import translation
 from graphene.utils.str_converters import to_snake_case, to_camel_case
 from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql_relay.connection.arrayconnection import connection_from_list_slice, cursor_to_offset, \
+    get_offset_with_default, offset_to_cursor
 import graphql_jwt
 from typing import Optional, List, Dict, Any
 
 from .apps import CoreConfig
 from .custom_filters import CustomFilterWizardStorage
+from .gql.keyset_pagination import annotate_keyset, decode_cursor, keyset_filter, keyset_ordering, order_by_keyset, \
+    row_cursor
+from .gql.total_count import count_queryset, COUNT_EXACT
 from .gql_queries import *
-from .utils import flatten_dict
-from .models import ModuleConfiguration, FieldControl, MutationLog, Language, RoleMutation, UserMutation
+from .models import ModuleConfiguration, FieldControl, MutationLog, Language, RoleMutation, UserMutation, \
+    ExportableQueryModel
+from .modules_permissions import get_modules_permissions
+from .rights_cache import invalidate_role_rights
 from .services.roleServices import check_role_unique_name
 from .services.userServices import check_user_unique_email
 from .validation.obligatoryFieldValidation import validate_payload_for_obligatory_fields
@@ -150,16 +158,14 @@ class OpenIMISJSONEncoder(DjangoJSONEncoder):
 
 _mutation_signal_params = ["user", "mutation_module",
                            "mutation_class", "mutation_log_id", "data"]
-signal_mutation = dispatch.Signal(providing_args=_mutation_signal_params)
-signal_mutation_module_validate = {}
-signal_mutation_module_before_mutating = {}
-signal_mutation_module_after_mutating = {}
-
-for module in sys.modules:
-    signal_mutation_module_validate[module] = dispatch.Signal(providing_args=_mutation_signal_params)
-    signal_mutation_module_before_mutating[module] = dispatch.Signal(providing_args=_mutation_signal_params)
-    signal_mutation_module_after_mutating[module] = \
-        dispatch.Signal(providing_args=_mutation_signal_params + ["error_messages"])
+signal_mutation = MutationSignal("signal_mutation", providing_args=_mutation_signal_params)
+# Signals of each module, created on first access
+signal_mutation_module_validate = MutationSignalRegistry(
+    "signal_mutation_module_validate", _mutation_signal_params)
+signal_mutation_module_before_mutating = MutationSignalRegistry(
+    "signal_mutation_module_before_mutating", _mutation_signal_params)
+signal_mutation_module_after_mutating = MutationSignalRegistry(
+    "signal_mutation_module_after_mutating", _mutation_signal_params + ["error_messages"])
 
 
 class OpenIMISMutation(graphene.relay.ClientIDMutation):
@@ -192,8 +198,8 @@ class OpenIMISMutation(graphene.relay.ClientIDMutation):
 
     @classmethod
     def mutate_and_get_payload(cls, root, info, **data):
-        mutation_log = MutationLog.objects.create(
-            json_content=json.dumps(data, cls=OpenIMISJSONEncoder),
+        mutation_log = MutationLog.create_log(
+            json.dumps(data, cls=OpenIMISJSONEncoder),
             user_id=info.context.user.id if info.context.user else None,
             client_mutation_id=data.get("client_mutation_id"),
             client_mutation_label=data.get("client_mutation_label"),
@@ -257,6 +263,9 @@ class OpenIMISMutation(graphene.relay.ClientIDMutation):
             logger.debug("[OpenIMISMutation %s] before mutate signal sent", mutation_log.id)
             if core.async_mutations:
                 logger.debug("[OpenIMISMutation %s] Sending async mutation", mutation_log.id)
+                if CoreConfig.mutation_batch_size > 1:
+                    # Only now that it's ready to run, it can be claimed by the batch of any worker
+                    mutation_log.queue(cls._mutation_module, cls._mutation_class)
                 openimis_mutation_async.delay(
                     mutation_log.id, cls._mutation_module, cls._mutation_class)
             else:
@@ -368,6 +377,130 @@ class OrderedDjangoFilterConnectionField(DjangoFilterConnectionField):
 
         return OrderedDjangoFilterConnectionField.orderBy(qs, args)
 
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        """
+        Same pagination as graphene-django but without counting the whole queryset up front: forward pages fetch one
+        extra row to know if there is a next page and the count only happens if total_count is requested. Backward
+        pages (last/before) need the count, it goes through the cached counting strategy.
+        """
+        iterable = maybe_queryset(iterable)
+        if not isinstance(iterable, QuerySet):
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit)
+
+        offset = args.pop("offset", None)
+        after = args.get("after")
+        if offset:
+            if after:
+                offset += cursor_to_offset(after) + 1
+            args["after"] = offset_to_cursor(offset - 1)
+        if max_limit is not None and args.get("first") is None and args.get("last") is None:
+            args["first"] = max_limit
+
+        if args.get("last") is not None or args.get("before") is not None:
+            list_length = count_queryset(iterable, mode=getattr(connection, "total_count_mode", COUNT_EXACT))
+            list_slice_length = min(max_limit, list_length) if max_limit is not None else list_length
+            start = min(get_offset_with_default(args.get("after"), -1) + 1, list_length)
+            if max_limit is not None and args.get("first") is None:
+                start = max(list_length - args["last"], start)
+            resolved = connection_from_list_slice(
+                iterable[start:], args, slice_start=start, list_length=list_length,
+                list_slice_length=list_slice_length, connection_type=connection, edge_type=connection.Edge,
+                pageinfo_type=graphene.relay.PageInfo)
+            resolved.iterable = iterable
+            resolved.length = list_length
+            return resolved
+
+        start = get_offset_with_default(args.get("after"), -1) + 1
+        first = args.get("first")
+        if first is None:
+            rows = list(iterable[start:])
+            has_next_page = False
+        else:
+            rows = list(iterable[start:start + first + 1])
+            has_next_page = len(rows) > first
+            rows = rows[:first]
+        edges = [
+            connection.Edge(node=node, cursor=offset_to_cursor(start + index))
+            for index, node in enumerate(rows)
+        ]
+        resolved = connection(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=False,
+                has_next_page=has_next_page,
+            ),
+        )
+        resolved.iterable = iterable
+        # Unless this is the last page, left to ExtendedConnection.resolve_total_count: only counted if requested
+        resolved.length = start + len(rows) if not has_next_page and (rows or start == 0) else None
+        return resolved
+
+
+class KeysetDjangoFilterConnectionField(OrderedDjangoFilterConnectionField):
+    """
+    Opt-in keyset pagination for OrderedDjangoFilterConnectionField: the cursors hold the ordering values of the rows
+    (the sanitized orderBy, completed by the primary key) instead of their offset, so that deep pages don't turn into
+    OFFSET scans. As its cursors differ, expose it as a field of its own next to the offset paginated one:
+    ```
+    mutation_logs_keyset = KeysetDjangoFilterConnectionField(MutationLogGQLType,
+        orderBy=graphene.List(of_type=graphene.String))
+    ```
+    Lists ordered randomly, by an expression or through a multi-valued relation, or requested with an offset, are
+    paginated by offset as before.
+
+    Finding out whether rows precede the `after` cursor would cost another query: as allowed by the Relay specification,
+    hasPreviousPage is simply true when paginating forward from a cursor (and hasNextPage when paginating backward from
+    one).
+    """
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        iterable = maybe_queryset(iterable)
+        keys = keyset_ordering(iterable) if isinstance(iterable, QuerySet) else None
+        if keys is None or args.get("offset"):
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit)
+
+        first, last = args.get("first"), args.get("last")
+        after, before = args.get("after"), args.get("before")
+        if max_limit is not None and first is None and last is None:
+            first = max_limit
+        backward = first is None and last is not None
+
+        qs = iterable
+        if after:
+            qs = qs.filter(keyset_filter(keys, decode_cursor(after)))
+        if before:
+            qs = qs.filter(keyset_filter(keys, decode_cursor(before), reverse=True))
+        qs = order_by_keyset(annotate_keyset(qs, keys), keys, reverse=backward)
+        limit = last if backward else first
+        if limit is None:
+            rows = list(qs)
+            has_more = False
+        else:
+            rows = list(qs[:limit + 1])
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        if backward:
+            rows.reverse()
+
+        edges = [connection.Edge(node=row, cursor=row_cursor(row, keys)) for row in rows]
+        resolved = connection(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_more if backward else bool(after),
+                has_next_page=bool(before) if backward else has_more,
+            ),
+        )
+        resolved.iterable = iterable
+        # Counted by ExtendedConnection.resolve_total_count if requested, unless the whole list fits in the page
+        resolved.length = len(rows) if not (has_more or after or before) else None
+        return resolved
+
 
 class MutationLogGQLType(DjangoObjectType):
     """
@@ -391,6 +524,10 @@ class MutationLogGQLType(DjangoObjectType):
 
     status = graphene.Field(graphene.Int,
                             description=", ".join([f"{pair[0]}: {pair[1]}" for pair in MutationLog.STATUS_CHOICES]))
+    json_content = graphene.String()
+
+    def resolve_json_content(self, info):
+        return self.get_json_content()
 
     @classmethod
     def get_queryset(cls, queryset, info):
@@ -403,6 +540,20 @@ class MutationLogGQLType(DjangoObjectType):
         return queryset
 
 
+class ExportableQueryGQLType(DjangoObjectType):
+    """
+    Status of a query export, to poll while an asynchronous export is being built.
+    """
+
+    class Meta:
+        model = ExportableQueryModel
+        fields = ("name", "model", "format", "create_date", "expire_date", "is_deleted", "rows_written",
+                  "bytes_written")
+
+    status = graphene.Field(graphene.Int, description=", ".join(
+        [f"{pair[0]}: {pair[1]}" for pair in ExportableQueryModel.STATUS_CHOICES]))
+
+
 UT_INTERACTIVE = "INTERACTIVE"
 UT_TECHNICAL = "TECHNICAL"
 UT_OFFICER = "OFFICER"
@@ -416,6 +567,36 @@ UserTypeEnum = graphene.Enum("UserTypes", [
 ])
 
 
+def _users_arguments():
+    # Fresh argument instances for each of the users fields
+    return dict(
+        orderBy=graphene.List(of_type=graphene.String),
+        validity=graphene.Date(),
+        client_mutation_id=graphene.String(),
+        last_name=graphene.String(description="partial match, case insensitive"),
+        other_names=graphene.String(description="partial match, case insensitive"),
+        phone=graphene.String(description="exact match on phone number"),
+        email=graphene.String(description="exact match on email address"),
+        role_id=graphene.Int(),
+        roles=graphene.List(of_type=graphene.Int),
+        health_facility_id=graphene.Int(description="Base health facility ID (not UUID!)"),
+        region_id=graphene.Int(),
+        region_ids=graphene.List(of_type=graphene.Int),
+        district_id=graphene.Int(),
+        municipality_id=graphene.Int(),
+        village_id=graphene.Int(),
+        birth_date_from=graphene.Date(),
+        birth_date_to=graphene.Date(),
+        user_types=graphene.List(of_type=UserTypeEnum),
+        language=graphene.String(),
+        showHistory=graphene.Boolean(),
+        showDeleted=graphene.Boolean(),
+        str=graphene.String(description="text search that will check username, last name, other names and email"),
+        parent_location=graphene.String(),
+        parent_location_level=graphene.Int(),
+    )
+
+
 class Query(graphene.ObjectType):
     module_configurations = graphene.List(
         ModuleConfigurationGQLType,
@@ -427,6 +608,10 @@ class Query(graphene.ObjectType):
 
     mutation_logs = OrderedDjangoFilterConnectionField(
         MutationLogGQLType, orderBy=graphene.List(of_type=graphene.String))
+    mutation_logs_keyset = KeysetDjangoFilterConnectionField(
+        MutationLogGQLType, orderBy=graphene.List(of_type=graphene.String),
+        description="The mutationLogs query, paginated by keyset: the cursors hold the ordering values of the rows "
+                    "rather than their offset")
 
     role = OrderedDjangoFilterConnectionField(
         RoleGQLType,
@@ -450,37 +635,20 @@ class Query(graphene.ObjectType):
 
     users = OrderedDjangoFilterConnectionField(
         UserGQLType,
-        orderBy=graphene.List(of_type=graphene.String),
-        validity=graphene.Date(),
-        client_mutation_id=graphene.String(),
-        last_name=graphene.String(description="partial match, case insensitive"),
-        other_names=graphene.String(description="partial match, case insensitive"),
-        phone=graphene.String(description="exact match on phone number"),
-        email=graphene.String(description="exact match on email address"),
-        role_id=graphene.Int(),
-        roles=graphene.List(of_type=graphene.Int),
-        health_facility_id=graphene.Int(description="Base health facility ID (not UUID!)"),
-        region_id=graphene.Int(),
-        region_ids=graphene.List(of_type=graphene.Int),
-        district_id=graphene.Int(),
-        municipality_id=graphene.Int(),
-        village_id=graphene.Int(),
-        birth_date_from=graphene.Date(),
-        birth_date_to=graphene.Date(),
-        user_types=graphene.List(of_type=UserTypeEnum),
-        language=graphene.String(),
-        showHistory=graphene.Boolean(),
-        showDeleted=graphene.Boolean(),
-        str=graphene.String(description="text search that will check username, last name, other names and email"),
+        **_users_arguments(),
         description="This interface provides access to the various types of users in openIMIS. The main resource"
                     "is limited to a username and refers either to a TechnicalUser or InteractiveUser. Only the latter"
                     "is exposed in GraphQL. There are also optional links to ClaimAdministrator and Officer depending"
                     "on the setup. BEWARE, fetching these links is costly as there is no direct database link between"
                     "these entities and there are retrieved one by one. Do not fetch them for large lists if you can"
                     "avoid it. The showHistory is acting on the InteractiveUser, avoid mixing with Officer or "
-                    "ClaimAdmin.",
-        parent_location=graphene.String(),
-        parent_location_level=graphene.Int()
+                    "ClaimAdmin."
+    )
+    users_keyset = KeysetDjangoFilterConnectionField(
+        UserGQLType,
+        **_users_arguments(),
+        description="The users query, paginated by keyset: the cursors hold the ordering values of the rows rather "
+                    "than their offset",
     )
 
     user = graphene.Field(UserGQLType)
@@ -508,6 +676,7 @@ class Query(graphene.ObjectType):
 
     modules_permissions = graphene.Field(
         ModulePermissionsListGQLType,
+        module_name=graphene.String(required=False, description="Only return the permissions of this module"),
     )
 
     custom_filters = graphene.Field(
@@ -520,6 +689,11 @@ class Query(graphene.ObjectType):
 
     languages = graphene.List(LanguageGQLType)
 
+    export_status = graphene.Field(
+        ExportableQueryGQLType,
+        name=graphene.String(required=True, description="Name returned by an *Export query"),
+    )
+
     validate_username = graphene.Field(
         graphene.Boolean,
         username=graphene.String(required=True),
@@ -638,6 +812,11 @@ class Query(graphene.ObjectType):
             return info.context.user
         return None
 
+    def resolve_export_status(self, info, name):
+        if not info.context.user.is_authenticated:
+            raise PermissionDenied(_("unauthorized"))
+        return ExportableQueryModel.objects.filter(name=name, user=info.context.user).first()
+
     def resolve_user_obligatory_fields(self, info):
         if info.context.user.is_authenticated:
             return CoreConfig.fields_controls_user
@@ -752,8 +931,12 @@ class Query(graphene.ObjectType):
 
         # Do NOT use the query optimizer here ! It would make the t_user, officer etc as deferred fields if they are not
         # explicitly requested in the GraphQL response. However, this prevents the dynamic remapping of the User object.
+        # Distinct as the role and location filters join multi-valued relations, the keyset pagination of usersKeyset
+        # relies on it to have a single row (and cursor) per user, its ordering ending with the pk
         return user_query.filter(*user_filters).distinct()
 
+    resolve_users_keyset = resolve_users
+
     def resolve_role(self, info, **kwargs):
         if not info.context.user.has_perms(CoreConfig.gql_query_roles_perms):
             raise PermissionError("Unauthorized")
@@ -799,41 +982,19 @@ class Query(graphene.ObjectType):
         else:
             return gql_optimizer.query(RoleRight.objects.filter(validity_to__isnull=True), info)
 
-    def resolve_modules_permissions(self, info, **kwargs):
+    def resolve_modules_permissions(self, info, module_name=None, **kwargs):
         if not info.context.user.has_perms(CoreConfig.gql_query_roles_perms):
             raise PermissionError("Unauthorized")
-        excluded_app = [
-            "health_check.cache", "health_check", "health_check.db",
-            "test_without_migrations", "test_without_migrations",
-            "rules", "graphene_django", "rest_framework",
-            "health_check.storage", "channels", "graphql_jwt.refresh_token.apps.RefreshTokenConfig"
-        ]
-        all_apps = [app for app in settings.INSTALLED_APPS if not app.startswith("django") and app not in excluded_app]
-        config = []
-        for app in all_apps:
-            apps = __import__(f"{app}.apps")
-            is_default_cfg = hasattr(apps.apps, 'DEFAULT_CFG')
-            is_defaulf_config = hasattr(apps.apps, 'DEFAULT_CONFIG')
-            if is_default_cfg or is_defaulf_config:
-                if is_defaulf_config:
-                    config_dict = ModuleConfiguration.get_or_default(f"{app}", apps.apps.DEFAULT_CONFIG)
-                else:
-                    config_dict = ModuleConfiguration.get_or_default(f"{app}", apps.apps.DEFAULT_CFG)
-                permission = []
-                config_dict = flatten_dict(config_dict)
-                for key, value in config_dict.items():
-                    if key.endswith("_perms"):
-                        if isinstance(value, list):
-                            for val in value:
-                                permission.append(PermissionOpenImisGQLType(
-                                    perms_name=key,
-                                    perms_value=val,
-                                ))
-                config.append(ModulePermissionGQLType(
-                    module_name=app,
-                    permissions=permission,
-                ))
-        return ModulePermissionsListGQLType(list(config))
+        return ModulePermissionsListGQLType([
+            ModulePermissionGQLType(
+                module_name=name,
+                permissions=[
+                    PermissionOpenImisGQLType(perms_name=perms_name, perms_value=perms_value)
+                    for perms_name, perms_value in permissions
+                ],
+            )
+            for name, permissions in get_modules_permissions(module_name)
+        ])
 
     def resolve_custom_filters(self, info, **kwargs):
         user = info.context.user
@@ -965,6 +1126,7 @@ def update_or_create_role(data, user):
                     role_right = RoleRight.objects.get(Q(role_id=role.id, right_id=right_id))
                     role_right.validity_to = None
                     role_right.save()
+            invalidate_role_rights(role.id)
     else:
         role = Role.objects.create(**data)
         # create role rights for that role if they were passed to mutation
@@ -1032,6 +1194,7 @@ def duplicate_role(data, user):
                 "validity_from": now,
             }
         ) for role_right in role_rights_currently_assigned]
+    invalidate_role_rights(duplicated_role.id)
 
     if client_mutation_id:
         RoleMutation.object_mutated(user, role=duplicated_role, client_mutation_id=client_mutation_id)
@@ -1106,6 +1269,7 @@ class UpdateRoleMutation(OpenIMISMutation):
 def set_role_deleted(role):
     try:
         role.delete_history()
+        invalidate_role_rights(role.id)
         return []
     except Exception as exc:
         return {
@@ -11,6 +11,7 @@ from django.utils.http import urlencode
 from django.core.cache import cache
 from core.apps import CoreConfig
 from core.models import User, InteractiveUser, Officer, UserRole
+from core.rights_cache import invalidate_user_rights
 from core.validation.obligatoryFieldValidation import validate_payload_for_obligatory_fields
 
 logger = logging.getLogger(__file__)
@@ -72,8 +73,7 @@ def create_or_update_user_roles(i_user, role_ids, audit_user_id):
         UserRole.objects.create(
             user=i_user, role_id=role_id, audit_user_id=audit_user_id
         )
-    cache.delete('rights_'+str(i_user.id))
-    cache.delete('is_admin_'+str(i_user.id))
+    invalidate_user_rights(i_user.id)
 
 
 # TODO move to location module ?
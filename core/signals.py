@@ -1,11 +1,19 @@
 from django.dispatch import Signal as BaseSignal
-from django.dispatch.dispatcher import _make_id
+from django.dispatch.dispatcher import _make_id, NO_RECEIVERS
 import functools
+import logging
+import time
+import weakref
 
 from typing import Callable, Dict
 
 from core.service_signals import RegisteredServiceSignal, ServiceSignalBindType
 
+logger = logging.getLogger(__name__)
+
+# Receivers of mutation signals taking longer than this are logged as warnings
+SLOW_RECEIVER_SECONDS = 1.0
+
 
 class Signal(BaseSignal):
 
@@ -106,3 +114,72 @@ def bind_service_signal(signal_name: str, func: Callable,
 
     signal = REGISTERED_SERVICE_SIGNALS[signal_name]
     signal.connect_signal(func, bind_type)
+
+
+class _SenderReceiversCache(weakref.WeakKeyDictionary):
+    """
+    Receivers per sender of a MutationSignal. Senders that can't be weakly referenced (None, strings...) are simply not
+    cached, their receivers are resolved on each send.
+    """
+
+    def get(self, key, default=None):
+        try:
+            return super().get(key, default)
+        except TypeError:
+            return default
+
+    def __setitem__(self, key, value):
+        try:
+            super().__setitem__(key, value)
+        except TypeError:
+            pass
+
+
+def _receiver_name(receiver):
+    # functools.partial and callable objects have no __qualname__
+    qualname = getattr(receiver, "__qualname__", None)
+    return f"{receiver.__module__}.{qualname}" if qualname else repr(receiver)
+
+
+class MutationSignal(BaseSignal):
+    """
+    Signal sent for each mutation (see OpenIMISMutation). The receivers of each sender are resolved once and cached
+    (unless the sender can't be weakly referenced, e.g. None), the send is skipped at once when nobody listens, and
+    each receiver is timed: logged at debug level, as a warning above SLOW_RECEIVER_SECONDS.
+    """
+
+    def __init__(self, name, providing_args=None):
+        super().__init__(providing_args=providing_args, use_caching=True)
+        self.sender_receivers_cache = _SenderReceiversCache()
+        self.name = name
+
+    def send(self, sender, **named):
+        if not self.receivers or self.sender_receivers_cache.get(sender) is NO_RECEIVERS:
+            return []
+        responses = []
+        for receiver in self._live_receivers(sender):
+            start = time.perf_counter()
+            response = receiver(signal=self, sender=sender, **named)
+            elapsed = time.perf_counter() - start
+            if elapsed >= SLOW_RECEIVER_SECONDS:
+                logger.warning("Mutation signal %s: %s took %.3fs", self.name, _receiver_name(receiver), elapsed)
+            else:
+                logger.debug("Mutation signal %s: %s took %.3fs", self.name, _receiver_name(receiver), elapsed)
+            responses.append((receiver, response))
+        return responses
+
+
+class MutationSignalRegistry(dict):
+    """
+    The MutationSignal of each module, created the first time the module is looked up:
+    signal_mutation_module_validate["insuree"].connect(...)
+    """
+
+    def __init__(self, name, providing_args):
+        super().__init__()
+        self.name = name
+        self.providing_args = providing_args
+
+    def __missing__(self, module):
+        # setdefault, so that two threads looking up a new module end up with the same signal
+        return self.setdefault(module, MutationSignal(f"{self.name}[{module}]", self.providing_args))
@@ -1,46 +1,61 @@
 from __future__ import absolute_import, unicode_literals
-import json
 import logging
 
 from celery import shared_task
-from core.models import MutationLog, Language
-from django.utils import translation
+from core.apps import CoreConfig
+from core.models import ExportableQueryModel
+from core.mutation_executor import CLAIM_MAX_RETRIES, CLAIM_RETRY_COUNTDOWN, run_mutation_batch, run_queued_mutation
+from django.utils.module_loading import import_string
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def openimis_mutation_async(mutation_id, module, class_name):
+@shared_task(bind=True, max_retries=CLAIM_MAX_RETRIES)
+def openimis_mutation_async(self, mutation_id, module, class_name):
     """
     This method is called by the OpenIMISMutation, directly or asynchronously to call the async_mutate method.
+    With mutation_batch_size above 1, the task then also runs a batch of the other queued mutations
+    (see core.mutation_executor).
     :param mutation_id: ID of the mutation object. We're not passing the whole object because an async call would have
                         to serialize it into the queue.
     :param module: "claim", "insuree"...
     :param class_name: Name of the OpenIMISMutation class whose async_mutate() will be called
     :return: unused, returns "OK"
     """
-    mutation = None
+    if not run_queued_mutation(mutation_id, module, class_name):
+        # Locked by the batch of another worker, in case that batch is rolled back
+        raise self.retry(countdown=CLAIM_RETRY_COUNTDOWN)
+    if CoreConfig.mutation_batch_size > 1:
+        run_mutation_batch(CoreConfig.mutation_batch_size - 1)
+    return "OK"
+
+
+@shared_task
+def openimis_export_async(export_id, values, column_names=None, patches_ref=None):
+    """
+    Builds an export saved as PENDING by ExportableQueryModel.create_async_export. Only JSON parameters go through
+    the queue, the queryset is rebuilt from the query_args stored on the export.
+    :param export_id: ID of the ExportableQueryModel
+    :param values: exported fields
+    :param column_names: mapping field -> column name
+    :param patches_ref: (dotted path of the ExportableQueryMixin class, exported field) holding the export patches
+    :return: unused, returns "OK"
+    """
+    export = None
     try:
-        mutation = MutationLog.objects.get(id=mutation_id)
-        # __import__ needs to import the module with .schema to force .schema to load, then .schema.TheRealMutation
-        mutation_class = getattr(__import__(f"{module}.schema").schema, class_name)
-
-        if mutation.user and mutation.user.language:
-            lang = mutation.user.language
-            if isinstance(lang, Language):
-                translation.activate(lang.code)
-            else:
-                translation.activate(lang)
-        error_messages = mutation_class.async_mutate(mutation.user, **json.loads(mutation.json_content))
-        if not error_messages:
-            mutation.mark_as_successful()
-        else:
-            mutation.mark_as_failed(json.dumps(error_messages))
+        export = ExportableQueryModel.objects.get(id=export_id, status=ExportableQueryModel.PENDING)
+        export.mark_as_running()
+        qs = export.rebuild_queryset()
+        patches = None
+        if patches_ref:
+            query_class, field_name = patches_ref
+            patches = import_string(query_class).get_patches_for_field(field_name)
+        export.write_export(qs, values, column_names=column_names, patches=patches)
         return "OK"
     except Exception as exc:
-        if mutation:
-            mutation.mark_as_failed(str(exc))
-        logger.warning(f"Exception while processing mutation id {mutation_id}", exc_info=True)
+        if export:
+            export.mark_as_failed(str(exc))
+        logger.warning(f"Exception while processing export id {export_id}", exc_info=True)
         raise exc
 
 
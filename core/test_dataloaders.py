@@ -0,0 +1,48 @@
+import graphene
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.schema import Query
+from core.test_helpers import create_test_interactive_user
+
+_USERS_QUERY = """
+{
+  users(first: %s, userTypes: [INTERACTIVE], orderBy: ["id"]) {
+    edges {
+      node {
+        username
+        clientMutationId
+        iUser { id roles { id name } healthFacility { id } }
+      }
+    }
+  }
+}
+"""
+
+
+class UserDataLoadersTest(TestCase):
+    _USERS = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_test_interactive_user(username="tstdataloadadmin")
+        for i in range(cls._USERS):
+            create_test_interactive_user(username=f"tstdataload{i}", roles=[1, 2])
+        cls.schema = graphene.Schema(query=Query)
+
+    def _execute(self, page_size):
+        request = RequestFactory().post("/graphql")
+        request.user = self.admin
+        with CaptureQueriesContext(connection) as queries:
+            result = self.schema.execute(_USERS_QUERY % page_size, context_value=request)
+        self.assertIsNone(result.errors)
+        self.assertEquals(len(result.data["users"]["edges"]), page_size)
+        return len(queries)
+
+    def test_users_page_queries_do_not_grow_with_page_size(self):
+        small_page = self._execute(10)
+        full_page = self._execute(self._USERS)
+        # Without batching, each row triggered its own roles and pending mutation queries
+        self.assertEquals(small_page, full_page)
+        self.assertLess(full_page, 20)
@@ -0,0 +1,198 @@
+import datetime
+import gzip
+import importlib.util
+import json
+from unittest import mock, skipUnless
+
+from django.test import TestCase
+from pandas import DataFrame
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.exports import reap_expired_exports
+from core.models import ExportableQueryModel, Role
+from core.tasks import openimis_export_async
+from core.views import fetch_export
+from core.test_helpers import create_test_interactive_user
+
+
+def _upper_name(frame):
+    frame["name"] = frame["name"].str.upper()
+    return frame
+
+
+class StreamingExportTest(TestCase):
+    _VALUES = ["id", "name", "is_system"]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_test_interactive_user(username="tstexportuser")
+
+    def _expected_csv(self, qs):
+        # Previous implementation: the whole export in a single DataFrame
+        content = DataFrame.from_records(qs.values_list(*self._VALUES))
+        content.columns = self._VALUES
+        content = _upper_name(content)
+        content.columns = ["Id", "Name", "is_system"]
+        return content.to_csv()
+
+    def test_chunked_export_matches_single_frame(self):
+        qs = Role.objects.order_by("id")
+        export = ExportableQueryModel.create_csv_export(
+            qs, self._VALUES, self.user, column_names={"id": "Id", "name": "Name"}, patches=[_upper_name],
+            chunk_size=2)
+        with export.content.open("rb") as content:
+            self.assertEquals(content.read().decode("utf-8"), self._expected_csv(qs))
+
+    def test_compressed_export(self):
+        qs = Role.objects.order_by("id")
+        export = ExportableQueryModel.create_csv_export(
+            qs, self._VALUES, self.user, column_names={"id": "Id", "name": "Name"}, patches=[_upper_name],
+            chunk_size=3, compress=True)
+        self.assertTrue(export.name.endswith(".csv.gz"))
+        with export.content.open("rb") as content:
+            self.assertEquals(gzip.decompress(content.read()).decode("utf-8"), self._expected_csv(qs))
+
+    def test_async_export_task(self):
+        qs = Role.objects.filter(is_system=0).order_by("-id")
+        with mock.patch("core.tasks.openimis_export_async.delay") as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            export = ExportableQueryModel.create_async_export(
+                qs, self._VALUES, self.user, column_names={"id": "Id", "name": "Name"},
+                patches_ref=("core.test_exports.ExportPatches", "roles"))
+        self.assertEquals(export.status, ExportableQueryModel.PENDING)
+        # Only JSON goes through the queue
+        args = json.loads(json.dumps(delay.call_args.args))
+        openimis_export_async(*args)
+        export.refresh_from_db()
+        self.assertEquals(export.status, ExportableQueryModel.READY)
+        self.assertEquals(export.rows_written, qs.count())
+        self.assertEquals(export.bytes_written, export.content.size)
+        with export.content.open("rb") as content:
+            self.assertEquals(content.read().decode("utf-8"), self._expected_csv(qs))
+
+    def test_rebuilt_query_keeps_param_types(self):
+        qs = Role.objects.filter(validity_from__lte=datetime.datetime.now(), validity_to__isnull=True).order_by("id")
+        export = ExportableQueryModel(query_args=json.loads(json.dumps(ExportableQueryModel._query_args(qs))))
+        self.assertEquals(list(export.rebuild_queryset().values_list("id", flat=True)),
+                          list(qs.values_list("id", flat=True)))
+
+
+class ExportPatches:
+    @classmethod
+    def get_patches_for_field(cls, field_name):
+        return [_upper_name]
+
+
+class FetchExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_test_interactive_user(username="tstfetchexport")
+        qs = Role.objects.order_by("id")
+        cls.export = ExportableQueryModel.create_csv_export(qs, ["id", "name"], cls.user)
+        cls.gzip_export = ExportableQueryModel.create_csv_export(qs, ["id", "name"], cls.user, compress=True)
+        with cls.export.content.open("rb") as content:
+            cls.csv = content.read()
+
+    def _fetch(self, export, **headers):
+        request = APIRequestFactory().get("/fetch_export", {"export": export.name}, **headers)
+        force_authenticate(request, user=self.user)
+        return fetch_export(request)
+
+    def _assertAttachment(self, response):
+        self.assertRegex(response["Content-Disposition"], r'^attachment; filename="export_.+\.csv"$')
+
+    def test_full_and_partial_content(self):
+        response = self._fetch(self.export)
+        self.assertEquals(response.status_code, 200)
+        self._assertAttachment(response)
+        self.assertEquals(int(response["Content-Length"]), len(self.csv))
+        self.assertEquals(b"".join(response.streaming_content), self.csv)
+
+        response = self._fetch(self.export, HTTP_RANGE="bytes=5-14")
+        self.assertEquals(response.status_code, 206)
+        self._assertAttachment(response)
+        self.assertEquals(response["Content-Length"], "10")
+        self.assertEquals(response["Content-Range"], f"bytes 5-14/{len(self.csv)}")
+        self.assertEquals(b"".join(response.streaming_content), self.csv[5:15])
+
+        response = self._fetch(self.export, HTTP_RANGE=f"bytes={len(self.csv)}-")
+        self.assertEquals(response.status_code, 416)
+
+    def test_failed_export(self):
+        failed = ExportableQueryModel.create_csv_export(Role.objects.all(), ["id"], self.user)
+        failed.mark_as_failed("Traceback: database password in a connection string")
+        response = self._fetch(failed)
+        self.assertEquals(response.status_code, 409)
+        self.assertNotIn("Traceback", json.dumps(response.data))
+
+    def test_conditional_request(self):
+        etag = self._fetch(self.export)["ETag"]
+        self.assertEquals(self._fetch(self.export, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_gzip_export(self):
+        response = self._fetch(self.gzip_export, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEquals(response["Content-Encoding"], "gzip")
+        self.assertEquals(gzip.decompress(b"".join(response.streaming_content)), self.csv)
+
+        response = self._fetch(self.gzip_export)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertFalse(response.has_header("Content-Length"))
+        self._assertAttachment(response)
+        self.assertEquals(b"".join(response.streaming_content), self.csv)
+
+
+class ReapExportsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_test_interactive_user(username="tstreapexports")
+
+    def test_expired_exports_are_reaped(self):
+        qs = Role.objects.order_by("id")
+        expired = [ExportableQueryModel.create_csv_export(qs, ["id", "name"], self.user) for _ in range(3)]
+        current = ExportableQueryModel.create_csv_export(qs, ["id", "name"], self.user)
+        ExportableQueryModel.objects.filter(id__in=[export.id for export in expired]) \
+            .update(expire_date=datetime.datetime.now() - datetime.timedelta(hours=1))
+
+        reaped, reclaimed = reap_expired_exports(batch_size=2)
+        self.assertEquals(reaped, 3)
+        self.assertEquals(reclaimed, sum(export.content.size for export in expired))
+        storage = current.content.storage
+        for export in expired:
+            export.refresh_from_db()
+            self.assertTrue(export.is_deleted)
+            self.assertFalse(storage.exists(export.content.name))
+        current.refresh_from_db()
+        self.assertFalse(current.is_deleted)
+        self.assertTrue(storage.exists(current.content.name))
+        self.assertEquals(reap_expired_exports(), (0, 0))
+
+
+class ExportFormatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_test_interactive_user(username="tstexportformats")
+
+    def test_jsonl_export(self):
+        qs = Role.objects.order_by("id")
+        export = ExportableQueryModel.create_export(
+            qs, ["id", "name"], self.user, column_names={"name": "Name"}, chunk_size=2, export_format="jsonl")
+        self.assertEquals(export.format, "jsonl")
+        self.assertTrue(export.name.endswith(".jsonl"))
+        with export.content.open("rb") as content:
+            records = [json.loads(line) for line in content.read().decode("utf-8").splitlines()]
+        self.assertEquals(records, [{"id": role_id, "Name": name} for role_id, name in qs.values_list("id", "name")])
+
+    @skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_parquet_export(self):
+        import pyarrow.parquet
+        qs = Role.objects.order_by("id")
+        export = ExportableQueryModel.create_export(
+            qs, ["id", "uuid", "name"], self.user, chunk_size=2, export_format="parquet")
+        with export.content.open("rb") as content:
+            table = pyarrow.parquet.read_table(content)
+        self.assertEquals(table.num_rows, qs.count())
+        self.assertEquals(table.column("uuid").to_pylist(), [str(value) for value in qs.values_list("uuid", flat=True)])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            ExportableQueryModel.create_export(Role.objects.all(), ["id"], self.user, export_format="xls")
@@ -0,0 +1,68 @@
+import jwt
+from django.apps import apps
+from django.test import TestCase
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.shortcuts import get_token
+
+from core.jwt import _MISSING, get_jwt_key, jwt_decode_user_key, signing_key_cache
+from core.test_helpers import create_test_interactive_user
+
+
+def _legacy_jwt_decode_user_key(token, context=None):
+    # Previous implementation, kept here as reference: decodes the token twice and queries the key each time
+    options = {
+        'verify_exp': jwt_settings.JWT_VERIFY_EXPIRATION,
+        'verify_aud': jwt_settings.JWT_AUDIENCE is not None,
+    }
+    decode_kwargs = dict(leeway=jwt_settings.JWT_LEEWAY, audience=jwt_settings.JWT_AUDIENCE,
+                         issuer=jwt_settings.JWT_ISSUER, algorithms=[jwt_settings.JWT_ALGORITHM])
+    not_validated = jwt.decode(token, get_jwt_key(encode=False, context=context),
+                               options={**options, 'verify_signature': False}, **decode_kwargs)
+    db_user = apps.get_model("core", "User").objects \
+        .filter(username=not_validated.get("username")).only("i_user__private_key").first()
+    key = db_user.private_key if db_user and db_user.private_key else get_jwt_key(encode=False)
+    return jwt.decode(token, key, options={**options, 'verify_signature': jwt_settings.JWT_VERIFY}, **decode_kwargs)
+
+
+class JWTDecodeTest(TestCase):
+    _TEST_USERNAME = "tstjwtdecode"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_test_interactive_user(username=cls._TEST_USERNAME)
+
+    def setUp(self):
+        signing_key_cache.invalidate()
+
+    def test_decode_uses_cached_key(self):
+        token = get_token(self.user)
+        self.assertEquals(jwt_decode_user_key(token)["username"], self._TEST_USERNAME)
+        with self.assertNumQueries(0):
+            self.assertEquals(jwt_decode_user_key(token)["username"], self._TEST_USERNAME)
+
+    def test_password_change_rotates_key(self):
+        old_token = get_token(self.user)
+        jwt_decode_user_key(old_token)
+        self.user.i_user.set_password("NewPassword1234")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.i_user.save()
+            # Until the commit, other requests still read the old key from the database
+            self.assertIsNot(signing_key_cache.get(self._TEST_USERNAME), _MISSING)
+        self.assertIs(signing_key_cache.get(self._TEST_USERNAME), _MISSING)
+        new_token = get_token(self.user)
+        self.assertEquals(jwt_decode_user_key(new_token)["username"], self._TEST_USERNAME)
+        with self.assertRaises(jwt.InvalidSignatureError):
+            jwt_decode_user_key(old_token)
+
+    def test_queries_against_legacy_decode(self):
+        token = get_token(self.user)
+        # Issuing the token cached the key
+        signing_key_cache.invalidate()
+        runs = 20
+        # The previous implementation looked the key up on every decode
+        with self.assertNumQueries(runs):
+            legacy = [_legacy_jwt_decode_user_key(token) for _ in range(runs)]
+        with self.assertNumQueries(1):
+            current = [jwt_decode_user_key(token) for _ in range(runs)]
+        self.assertEquals(current, legacy)
+        self.assertIsNot(signing_key_cache.get(self._TEST_USERNAME), _MISSING)
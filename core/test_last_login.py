@@ -0,0 +1,107 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from core import last_login
+from core.last_login import flush_last_logins, record_last_login
+from core.models import InteractiveUser
+from core.test_helpers import create_test_interactive_user
+
+
+class LastLoginTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_test_interactive_user(username=f"tstlastlogin{index}") for index in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        # The scheduled task flushed the buffer just now
+        cache.set(last_login._FLUSHED_RECENTLY_KEY, True)
+        patcher = mock.patch("core.last_login._is_buffered", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _last_login(self, user):
+        return InteractiveUser.objects.get(id=user.i_user.id).last_login
+
+    def test_record_does_not_write(self):
+        now = timezone.now()
+        with self.assertNumQueries(0):
+            record_last_login(self.users[0], now)
+        self.assertEquals(self.users[0].last_login, now)
+        self.assertIsNone(self._last_login(self.users[0]))
+
+    def test_flush(self):
+        now = timezone.now()
+        record_last_login(self.users[0], now - timedelta(minutes=1))
+        record_last_login(self.users[0], now)
+        record_last_login(self.users[1], now)
+        self.assertEquals(flush_last_logins(), 2)
+        self.assertEquals(self._last_login(self.users[0]), now)
+        self.assertEquals(self._last_login(self.users[1]), now)
+        self.assertIsNone(self._last_login(self.users[2]))
+        self.assertEquals(flush_last_logins(), 0)
+
+    def test_flush_in_batches(self):
+        now = timezone.now()
+        for index in range(5):
+            record_last_login(self.users[index % 3], now + timedelta(seconds=index))
+        with mock.patch("core.last_login.FLUSH_BATCH_SIZE", 2):
+            # 2 + 2 + 1 entries, user 0 and 1 are written twice but counted once
+            self.assertEquals(flush_last_logins(), 3)
+        self.assertEquals([self._last_login(user) for user in self.users],
+                          [now + timedelta(seconds=3), now + timedelta(seconds=4), now + timedelta(seconds=2)])
+
+    def test_flush_locked(self):
+        cache.add(last_login._FLUSH_LOCK_KEY, True)
+        self.assertIsNone(flush_last_logins())
+
+    def test_concurrent_gap(self):
+        now = timezone.now()
+        # A login took its sequence number but didn't store its entry yet
+        pending = last_login._next_sequence()
+        record_last_login(self.users[1], now)
+        self.assertEquals(flush_last_logins(), 0)
+        self.assertIsNone(self._last_login(self.users[1]))
+        # Once stored, the entry is written with the following ones
+        cache.set(last_login._ENTRY_KEY % pending, ("core.InteractiveUser", self.users[0].i_user.id, now))
+        self.assertEquals(flush_last_logins(), 2)
+        self.assertEquals(self._last_login(self.users[0]), now)
+        self.assertEquals(self._last_login(self.users[1]), now)
+
+    def test_lost_entry_skipped(self):
+        now = timezone.now()
+        last_login._next_sequence()
+        record_last_login(self.users[2], now)
+        self.assertEquals(flush_last_logins(), 0)
+        # Still missing at the next flush: lost, the flush goes past it
+        self.assertEquals(flush_last_logins(), 1)
+        self.assertEquals(self._last_login(self.users[2]), now)
+
+    def test_written_through_without_buffer(self):
+        now = timezone.now()
+        with mock.patch("core.last_login._is_buffered", return_value=False), self.assertNumQueries(1):
+            record_last_login(self.users[0], now)
+        self.assertEquals(self._last_login(self.users[0]), now)
+        self.assertEquals(flush_last_logins(), 0)
+
+    def test_flushed_by_login_when_scheduler_lags(self):
+        now = timezone.now()
+        cache.delete(last_login._FLUSHED_RECENTLY_KEY)
+        record_last_login(self.users[0], now)
+        self.assertEquals(self._last_login(self.users[0]), now)
+        # Flushed recently again, the next logins are buffered
+        record_last_login(self.users[1], now)
+        self.assertIsNone(self._last_login(self.users[1]))
+
+    def test_flushed_by_login_when_buffer_is_large(self):
+        now = timezone.now()
+        with mock.patch("core.last_login.FLUSH_BATCH_SIZE", 2):
+            record_last_login(self.users[0], now)
+            self.assertIsNone(self._last_login(self.users[0]))
+            record_last_login(self.users[1], now)
+        self.assertEquals(self._last_login(self.users[0]), now)
+        self.assertEquals(self._last_login(self.users[1]), now)
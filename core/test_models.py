@@ -1,5 +1,13 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
-from .models import User, TechnicalUser, InteractiveUser
+from django.utils import timezone
+
+from .models import User, TechnicalUser, InteractiveUser, ModuleConfiguration, \
+    MODULE_CONFIGURATION_MAX_AGE, MODULE_CONFIGURATION_VERSION_CHECK_INTERVAL
 
 
 class UserTestCase(TestCase):
@@ -35,3 +43,95 @@ class UserTestCase(TestCase):
                                   i_user=InteractiveUser(login_name='not_active_anymore',
                                                          validity_to=datetime.datetime.now()+datetimedelta(days=-1)))
         self.assertFalse(not_active_anymore.is_active)
+
+
+class UserIdentityTestCase(TestCase):
+    _TEST_USERNAME = "tstidentity"
+
+    @classmethod
+    def setUpTestData(cls):
+        from core.test_helpers import create_test_interactive_user
+        create_test_interactive_user(username=cls._TEST_USERNAME)
+
+    def test_natural_key_resolves_identity_in_one_query(self):
+        with self.assertNumQueries(1):
+            user = User.objects.get_by_natural_key(self._TEST_USERNAME)
+            self.assertTrue(user.is_active)
+            self.assertFalse(user.is_staff)
+            self.assertEquals(user.id_for_audit, user.i_user.id)
+            self.assertEquals(user.other_names, "Test Other Names")
+            self.assertEquals(user.language.code, "en")
+
+    def test_get_or_create_resolves_identity_in_one_query(self):
+        with self.assertNumQueries(1):
+            user, created = User.objects.get_or_create(username=self._TEST_USERNAME)
+            self.assertFalse(created)
+            self.assertTrue(user.is_active)
+            self.assertEquals(user.last_name, "TestLastName")
+
+
+class ModuleConfigurationTestCase(TestCase):
+    _DEFAULT = {"a": 0, "b": 0}
+
+    def setUp(self):
+        cache.clear()
+        ModuleConfiguration._registry = None
+
+    def _create(self, module, config, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ModuleConfiguration.objects.create(
+                module=module, layer="be", version="1", config=json.dumps(config), **kwargs)
+
+    def test_registry(self):
+        self._create("tstregistry", {"a": 1})
+        self._create("tstregistryoff", {"a": 1}, is_disabled_until=timezone.now() + timedelta(days=1))
+        self.assertEquals(ModuleConfiguration.get_or_default("tstregistry", self._DEFAULT), {"a": 1, "b": 0})
+        with self.assertNumQueries(0):
+            configuration = ModuleConfiguration.get_or_default("tstregistry", self._DEFAULT)
+            self.assertEquals(ModuleConfiguration.get_or_default("tstregistryoff", self._DEFAULT), self._DEFAULT)
+            self.assertEquals(ModuleConfiguration.get_or_default("tstregistry", self._DEFAULT, layer="fe"),
+                              self._DEFAULT)
+        # Callers get their own copy
+        configuration["a"] = 2
+        self.assertEquals(ModuleConfiguration.get_or_default("tstregistry", self._DEFAULT)["a"], 1)
+
+    def test_invalidated_on_commit(self):
+        configuration = self._create("tstinvalidate", {"a": 1})
+        self.assertEquals(ModuleConfiguration.get_or_default("tstinvalidate", self._DEFAULT)["a"], 1)
+        configuration.config = json.dumps({"a": 2})
+        with self.captureOnCommitCallbacks() as callbacks:
+            configuration.save()
+            # Not committed yet
+            self.assertEquals(ModuleConfiguration.get_or_default("tstinvalidate", self._DEFAULT)["a"], 1)
+        for callback in callbacks:
+            callback()
+        self.assertEquals(ModuleConfiguration.get_or_default("tstinvalidate", self._DEFAULT)["a"], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            configuration.delete()
+        self.assertEquals(ModuleConfiguration.get_or_default("tstinvalidate", self._DEFAULT), self._DEFAULT)
+
+    @mock.patch("core.models.time.monotonic")
+    def test_version_check_interval(self, monotonic):
+        monotonic.return_value = 1000.0
+        configuration = self._create("tstversion", {"a": 1})
+        self.assertEquals(ModuleConfiguration.get_or_default("tstversion", self._DEFAULT)["a"], 1)
+        # Changed by another process: the table is updated and the shared version bumped
+        ModuleConfiguration.objects.filter(id=configuration.id).update(config=json.dumps({"a": 2}))
+        cache.set("module_configuration_version", "changed elsewhere", None)
+        monotonic.return_value += MODULE_CONFIGURATION_VERSION_CHECK_INTERVAL - 1
+        with self.assertNumQueries(0):
+            self.assertEquals(ModuleConfiguration.get_or_default("tstversion", self._DEFAULT)["a"], 1)
+        monotonic.return_value += 2
+        self.assertEquals(ModuleConfiguration.get_or_default("tstversion", self._DEFAULT)["a"], 2)
+
+    @mock.patch("core.models.time.monotonic")
+    def test_max_age(self, monotonic):
+        monotonic.return_value = 1000.0
+        configuration = self._create("tstmaxage", {"a": 1})
+        self.assertEquals(ModuleConfiguration.get_or_default("tstmaxage", self._DEFAULT)["a"], 1)
+        # Changed by another process, without a shared cache to tell
+        ModuleConfiguration.objects.filter(id=configuration.id).update(config=json.dumps({"a": 2}))
+        monotonic.return_value += MODULE_CONFIGURATION_VERSION_CHECK_INTERVAL + 1
+        self.assertEquals(ModuleConfiguration.get_or_default("tstmaxage", self._DEFAULT)["a"], 1)
+        monotonic.return_value = 1000.0 + MODULE_CONFIGURATION_MAX_AGE
+        self.assertEquals(ModuleConfiguration.get_or_default("tstmaxage", self._DEFAULT)["a"], 2)
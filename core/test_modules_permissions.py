@@ -0,0 +1,47 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from core import modules_permissions
+from core.models import ModuleConfiguration
+from core.modules_permissions import get_modules_permissions
+
+
+class ModulesPermissionsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        ModuleConfiguration._registry = None
+        modules_permissions._modules_permissions = None
+        modules_permissions._source_registry = None
+        patcher = mock.patch("core.modules_permissions._compute_modules_permissions",
+                             wraps=modules_permissions._compute_modules_permissions)
+        self.compute = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lazy_build(self):
+        self.compute.assert_not_called()
+        permissions = get_modules_permissions()
+        self.assertEquals(self.compute.call_count, 1)
+        with self.assertNumQueries(0):
+            self.assertIs(get_modules_permissions(), permissions)
+        self.assertEquals(self.compute.call_count, 1)
+        self.assertIn(("gql_query_roles_perms", "122001"), dict(permissions)["core"])
+
+    def test_filter_by_module_name(self):
+        core_permissions = get_modules_permissions("core")
+        self.assertEquals([name for name, _ in core_permissions], ["core"])
+        self.assertEquals(core_permissions[0][1], dict(get_modules_permissions())["core"])
+        self.assertEquals(get_modules_permissions("tstunknownmodule"), ())
+        self.assertEquals(self.compute.call_count, 1)
+
+    def test_recomputed_after_configuration_change(self):
+        self.assertIn(("gql_query_roles_perms", "122001"), get_modules_permissions("core")[0][1])
+        with self.captureOnCommitCallbacks(execute=True):
+            ModuleConfiguration.objects.create(module="core", layer="be", version="1",
+                                               config=json.dumps({"gql_query_roles_perms": ["999901"]}))
+        permissions = get_modules_permissions("core")[0][1]
+        self.assertIn(("gql_query_roles_perms", "999901"), permissions)
+        self.assertNotIn(("gql_query_roles_perms", "122001"), permissions)
+        self.assertEquals(self.compute.call_count, 2)
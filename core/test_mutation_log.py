@@ -0,0 +1,279 @@
+import functools
+import uuid
+from datetime import datetime as py_datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase
+
+from core.models import MutationLog, MutationLogArchive, Role, RoleMutation
+from core.apps import CoreConfig
+from core.mutation_archive import archive_mutation_logs
+from core.mutation_executor import resolve_mutation_class, run_mutation_batch, run_queued_mutation
+from core.mutation_payload import FILE_MARKER, ZLIB_MARKER
+from core.schema import OpenIMISMutation, signal_mutation_module_validate
+from core.signals import MutationSignal
+
+
+class NoopMutation(OpenIMISMutation):
+    _mutation_module = "core"
+    _mutation_class = "NoopMutation"
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        return None
+
+
+class FailingMutation(OpenIMISMutation):
+    _mutation_module = "core"
+    _mutation_class = "FailingMutation"
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        Role.objects.create(name="TestFailingMutationRole", is_system=0, is_blocked=False, audit_user_id=-1)
+        raise ValueError("mutation failed")
+
+
+_TEST_MUTATIONS = {"NoopMutation": NoopMutation, "FailingMutation": FailingMutation}
+
+
+def _resolve_test_mutation(module, class_name):
+    return _TEST_MUTATIONS[class_name]
+
+
+def _legacy_mark_as_successful(mutation_log):
+    # Previous implementation, kept here as reference: reads the whole row back after the update
+    MutationLog.objects.filter(id=mutation_log.id, status=MutationLog.RECEIVED).update(status=MutationLog.SUCCESS)
+    mutation_log.refresh_from_db()
+
+
+class MutationLogTest(TestCase):
+    def _create_log(self, json_content="{}"):
+        return MutationLog.objects.create(json_content=json_content)
+
+    def test_transitions_without_reload(self):
+        mutation_log = self._create_log()
+        with self.assertNumQueries(1):
+            self.assertEquals(mutation_log.mark_as_successful(), 1)
+        self.assertEquals(mutation_log.status, MutationLog.SUCCESS)
+        with self.assertNumQueries(1):
+            self.assertEquals(mutation_log.mark_as_successful(), 0)
+        with self.assertNumQueries(1):
+            self.assertEquals(mutation_log.mark_as_failed(ValueError("boom")), 1)
+        self.assertEquals(mutation_log.status, MutationLog.ERROR)
+        self.assertEquals(mutation_log.error, "boom")
+        mutation_log = MutationLog.objects.get(id=mutation_log.id)
+        self.assertEquals((mutation_log.status, mutation_log.error), (MutationLog.ERROR, "boom"))
+
+    def test_bulk_status_updates(self):
+        logs = [self._create_log() for _ in range(6)]
+        with self.assertNumQueries(1):
+            self.assertEquals(MutationLog.bulk_mark_as_successful([log.id for log in logs[:3]]), 3)
+        with self.assertNumQueries(1):
+            self.assertEquals(MutationLog.bulk_mark_as_failed({log.id: f"error {i}" for i, log in enumerate(logs)}), 6)
+        errors = dict(MutationLog.objects.filter(id__in=[log.id for log in logs]).values_list("id", "error"))
+        self.assertEquals(errors, {log.id: f"error {i}" for i, log in enumerate(logs)})
+        self.assertFalse(MutationLog.objects.filter(id__in=[log.id for log in logs])
+                         .exclude(status=MutationLog.ERROR).exists())
+
+    def test_mutation_queries(self):
+        # One INSERT and one UPDATE per successful synchronous mutation
+        info = SimpleNamespace(context=SimpleNamespace(user=None))
+        with mock.patch("core.async_mutations", False), self.assertNumQueries(2):
+            NoopMutation.mutate_and_get_payload(None, info, client_mutation_label="noop")
+        self.assertEquals(MutationLog.objects.get(client_mutation_label="noop").status, MutationLog.SUCCESS)
+
+    def test_queries_against_refresh_from_db(self):
+        legacy_log, mutation_log = self._create_log(), self._create_log()
+        # The previous implementation read the whole row, payload included, back after the update
+        with self.assertNumQueries(2):
+            _legacy_mark_as_successful(legacy_log)
+        with self.assertNumQueries(1):
+            mutation_log.mark_as_successful()
+        self.assertEquals(mutation_log.status, legacy_log.status)
+
+
+class MutationLogArchiveTest(TestCase):
+    def test_archive_completed_logs(self):
+        old = py_datetime.now() - timedelta(days=40)
+        done, linked, pending, recent = [
+            MutationLog.objects.create(json_content='{"index": %s}' % index) for index in range(4)]
+        MutationLog.objects.filter(id__in=[done.id, linked.id, recent.id]).update(status=MutationLog.SUCCESS)
+        MutationLog.objects.filter(id__in=[done.id, linked.id, pending.id]).update(request_date_time=old)
+        role = Role.objects.create(name="TestArchiveRole", is_system=0, is_blocked=False, audit_user_id=-1)
+        RoleMutation.objects.create(role=role, mutation=linked)
+
+        self.assertEquals(archive_mutation_logs(days=30, batch_size=1), (2, 1))
+        self.assertFalse(MutationLog.objects.filter(id=done.id).exists())
+        self.assertEquals(MutationLog.objects.get(id=linked.id).json_content, "")
+        self.assertEquals(MutationLog.objects.get(id=pending.id).json_content, '{"index": 2}')
+        self.assertEquals(MutationLog.objects.get(id=recent.id).json_content, '{"index": 3}')
+        self.assertEquals(MutationLogArchive.objects.get(id=done.id).get_json_content(), '{"index": 0}')
+        self.assertEquals(MutationLogArchive.objects.get(id=linked.id).get_json_content(), '{"index": 1}')
+        # Nothing left to archive
+        self.assertEquals(archive_mutation_logs(days=30), (0, 0))
+
+
+class MutationPayloadTest(TestCase):
+    def setUp(self):
+        self.thresholds = (CoreConfig.mutation_payload_compress_threshold, CoreConfig.mutation_payload_file_threshold)
+
+    def tearDown(self):
+        CoreConfig.mutation_payload_compress_threshold, CoreConfig.mutation_payload_file_threshold = self.thresholds
+
+    def _payload(self, size):
+        return '{"uuids": [%s]}' % ",".join(['"%032d"' % index for index in range(size)])
+
+    def test_small_payload_stored_as_is(self):
+        CoreConfig.mutation_payload_compress_threshold = 1024
+        payload = self._payload(2)
+        mutation_log = MutationLog.create_log(payload)
+        self.assertEquals(MutationLog.objects.get(id=mutation_log.id).json_content, payload)
+
+    def test_compressed_payload(self):
+        CoreConfig.mutation_payload_compress_threshold = 1024
+        payload = self._payload(1000)
+        mutation_log = MutationLog.objects.get(id=MutationLog.create_log(payload).id)
+        self.assertTrue(mutation_log.json_content.startswith(ZLIB_MARKER))
+        self.assertLess(len(mutation_log.json_content), len(payload))
+        self.assertEquals(mutation_log.get_json_content(), payload)
+        self.assertEquals(len(mutation_log.load_json_content()["uuids"]), 1000)
+
+    def test_payload_in_file(self):
+        CoreConfig.mutation_payload_file_threshold = 1024
+        payload = self._payload(20000)
+        with self.captureOnCommitCallbacks(execute=True):
+            mutation_log = MutationLog.objects.get(id=MutationLog.create_log(payload).id)
+        self.assertTrue(mutation_log.json_content.startswith(FILE_MARKER))
+        self.assertEquals(mutation_log.load_json_content()["uuids"][-1], "%032d" % 19999)
+        self.assertEquals(mutation_log.get_json_content(), payload)
+        mutation_log.mark_as_successful()
+        MutationLog.objects.filter(id=mutation_log.id).update(request_date_time=py_datetime.now() - timedelta(days=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEquals(archive_mutation_logs(days=1), (1, 1))
+        self.assertEquals(MutationLogArchive.objects.get(id=mutation_log.id).get_json_content(), payload)
+
+    def test_no_payload_file_for_rolled_back_log(self):
+        CoreConfig.mutation_payload_file_threshold = 1024
+        with self.captureOnCommitCallbacks(execute=False):
+            mutation_log = MutationLog.create_log(self._payload(20000))
+        self.assertTrue(mutation_log.json_content.startswith(FILE_MARKER))
+        self.assertFalse(default_storage.exists(mutation_log.json_content[len(FILE_MARKER):]))
+
+
+class MutationSignalTest(TestCase):
+    def test_module_signals_created_on_first_access(self):
+        self.assertNotIn("test_lazy_module", signal_mutation_module_validate)
+        signal = signal_mutation_module_validate["test_lazy_module"]
+        self.assertIsInstance(signal, MutationSignal)
+        self.assertIs(signal_mutation_module_validate["test_lazy_module"], signal)
+
+    def test_send(self):
+        signal = signal_mutation_module_validate["test_send_module"]
+        self.assertEquals(signal.send(sender=NoopMutation, data={}), [])
+
+        def receiver(sender, **kwargs):
+            return ["error"]
+
+        signal.connect(receiver)
+        try:
+            self.assertEquals(signal.send(sender=NoopMutation, data={}), [(receiver, ["error"])])
+        finally:
+            signal.disconnect(receiver)
+        self.assertEquals(signal.send(sender=NoopMutation, data={}), [])
+
+    def test_send_without_cacheable_sender(self):
+        signal = signal_mutation_module_validate["test_uncached_module"]
+
+        class Receiver:
+            def __call__(self, sender, **kwargs):
+                return ["callable"]
+
+        receivers = [functools.partial(lambda prefix, sender, **kwargs: [prefix], "partial"), Receiver()]
+        for receiver in receivers:
+            signal.connect(receiver, weak=False)
+        try:
+            for sender in (None, "sender", NoopMutation):
+                with self.assertLogs("core.signals", level="DEBUG"):
+                    self.assertEquals([response for _, response in signal.send(sender=sender, data={})],
+                                      [["partial"], ["callable"]])
+        finally:
+            for receiver in receivers:
+                signal.disconnect(receiver)
+
+
+class MutationExecutorTest(TestCase):
+    def test_mutation_class_resolved_once(self):
+        resolve_mutation_class.cache_clear()
+        self.assertIs(resolve_mutation_class("core", "OpenIMISMutation"), OpenIMISMutation)
+        resolve_mutation_class("core", "OpenIMISMutation")
+        self.assertEquals(resolve_mutation_class.cache_info().hits, 1)
+
+    def test_queued_mutation_queries(self):
+        mutation_log = MutationLog.create_log('{"client_mutation_label": "queued"}')
+        with mock.patch("core.mutation_executor.resolve_mutation_class", return_value=NoopMutation), \
+                self.assertNumQueries(2):
+            # The log with its user, then its status
+            run_queued_mutation(mutation_log.id, "core", "NoopMutation")
+        self.assertEquals(MutationLog.objects.get(id=mutation_log.id).status, MutationLog.SUCCESS)
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, "Batches need SELECT ... FOR UPDATE SKIP LOCKED")
+class MutationBatchTest(TestCase):
+    def setUp(self):
+        self.batch_size = CoreConfig.mutation_batch_size
+        CoreConfig.mutation_batch_size = 10
+        patcher = mock.patch("core.mutation_executor.resolve_mutation_class", side_effect=_resolve_test_mutation)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        CoreConfig.mutation_batch_size = self.batch_size
+
+    def _queue(self, class_name, label):
+        mutation_log = MutationLog.create_log('{"client_mutation_label": "%s"}' % label)
+        mutation_log.queue("core", class_name)
+        return mutation_log
+
+    def _status(self, mutation_log):
+        return MutationLog.objects.get(id=mutation_log.id).status
+
+    def test_batch_claims_queued_mutations(self):
+        logs = [self._queue("NoopMutation", f"batch {index}") for index in range(3)]
+        not_queued = MutationLog.create_log("{}")
+        self.assertEquals(run_mutation_batch(batch_size=2), 2)
+        self.assertEquals(sorted(self._status(log) for log in logs),
+                          [MutationLog.RECEIVED, MutationLog.SUCCESS, MutationLog.SUCCESS])
+        self.assertEquals(run_mutation_batch(), 1)
+        self.assertEquals([self._status(log) for log in logs], [MutationLog.SUCCESS] * 3)
+        self.assertEquals(self._status(not_queued), MutationLog.RECEIVED)
+        self.assertEquals(run_mutation_batch(), 0)
+
+    def test_failing_mutation_in_batch(self):
+        before, failing, after = [self._queue(class_name, class_name) for class_name in
+                                  ("NoopMutation", "FailingMutation", "NoopMutation")]
+        self.assertEquals(run_mutation_batch(), 3)
+        self.assertEquals(self._status(before), MutationLog.SUCCESS)
+        self.assertEquals(self._status(after), MutationLog.SUCCESS)
+        failing = MutationLog.objects.get(id=failing.id)
+        self.assertEquals((failing.status, failing.error), (MutationLog.ERROR, "mutation failed"))
+        # What the failing mutation wrote is rolled back with its savepoint
+        self.assertFalse(Role.objects.filter(name="TestFailingMutationRole").exists())
+
+    def test_unclaimed_mutation(self):
+        done = self._queue("NoopMutation", "done")
+        done.mark_as_successful()
+        # Run by a batch already, nothing left to do
+        self.assertTrue(run_queued_mutation(done.id, "core", "NoopMutation"))
+        # Not committed yet (or locked by a batch): to be tried again
+        self.assertFalse(run_queued_mutation(uuid.uuid4(), "core", "NoopMutation"))
+
+    def test_failing_queued_mutation(self):
+        failing = self._queue("FailingMutation", "failing")
+        with self.assertRaises(ValueError):
+            run_queued_mutation(failing.id, "core", "FailingMutation")
+        failing = MutationLog.objects.get(id=failing.id)
+        self.assertEquals((failing.status, failing.error), (MutationLog.ERROR, "mutation failed"))
+        self.assertFalse(Role.objects.filter(name="TestFailingMutationRole").exists())
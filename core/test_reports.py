@@ -0,0 +1,117 @@
+import datetime
+import json
+from decimal import Decimal
+
+from django.test import TestCase, TransactionTestCase
+
+from core.apps import CoreConfig
+from core.models import ReportSnapshot
+from core.report import report_definitions
+from core.report_snapshots import refresh_snapshot
+from core.reports.registers_status import ROLLUP_DATABASE, ROLLUP_PYTHON, registers_status_query
+from core.reports.user_activity import ACTION_ALL, ACTION_INSERT, ALL_USERS, ENTITY_OFFICER, fetch_all_entities_data, \
+    fetch_entity_data
+from core.test_helpers import create_test_officer
+
+
+class UserActivityReportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(5):
+            create_test_officer(custom_props={"code": f"TSTUA{index}", "audit_user_id": index})
+
+    def test_entity_fetched_in_one_query(self):
+        today = datetime.date.today()
+        params = {"date_from": today - datetime.timedelta(days=1), "date_to": today + datetime.timedelta(days=1),
+                  "action": ACTION_ALL}
+        names = {index: f"User {index}" for index in range(5)}
+        with self.assertNumQueries(1):
+            success, data = fetch_entity_data(ENTITY_OFFICER, params, ALL_USERS, names)
+        self.assertTrue(success)
+        created = [element for element in data if element["description"].startswith("Enrollment Officer TSTUA")]
+        self.assertEquals(len(created), 5)
+        self.assertTrue(all(element["action"] == ACTION_INSERT for element in created))
+        self.assertEquals(data, sorted(data, key=lambda element: (element["user_name"], element["datetime"])))
+
+
+class UserActivityConcurrencyTest(TransactionTestCase):
+    # The worker threads have their own connections, they only see committed rows
+    serialized_rollback = True
+
+    def setUp(self):
+        self.concurrency = CoreConfig.user_activity_report_concurrency
+        for index in range(3):
+            create_test_officer(custom_props={"code": f"TSTUC{index}", "audit_user_id": index})
+
+    def tearDown(self):
+        CoreConfig.user_activity_report_concurrency = self.concurrency
+
+    def test_threaded_and_sequential_fetches_match(self):
+        today = datetime.date.today()
+        params = {"date_from": today - datetime.timedelta(days=1), "date_to": today + datetime.timedelta(days=1),
+                  "action": ACTION_ALL}
+        names = {index: f"User {index}" for index in range(3)}
+        CoreConfig.user_activity_report_concurrency = 1
+        sequential = fetch_all_entities_data(params, ALL_USERS, names)
+        CoreConfig.user_activity_report_concurrency = 4
+        threaded = fetch_all_entities_data(params, ALL_USERS, names)
+        self.assertEquals(threaded, sequential)
+        self.assertTrue(any(element["description"].startswith("Enrollment Officer TSTUC")
+                            for entity_data in sequential for element in entity_data))
+
+
+class RegistersStatusReportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_test_officer(custom_props={"code": "TSTRS1"})
+        create_test_officer(custom_props={"code": "TSTRS2", "works_to": datetime.date(2020, 1, 1)})
+
+    def _query(self, rollup):
+        previous = CoreConfig.registers_status_rollup
+        CoreConfig.registers_status_rollup = rollup
+        try:
+            return registers_status_query(None)
+        finally:
+            CoreConfig.registers_status_rollup = previous
+
+    def test_database_rollup_matches_python(self):
+        in_python = self._query(ROLLUP_PYTHON)
+        in_database = self._query(ROLLUP_DATABASE)
+        self.assertEquals(in_database, in_python)
+        self.assertGreaterEqual(in_database["total_active_eo"], 1)
+        self.assertGreaterEqual(in_database["total_inactive_eo"], 1)
+
+
+class ReportSnapshotTest(TestCase):
+    def setUp(self):
+        self.previous = CoreConfig.report_snapshots
+        CoreConfig.report_snapshots = True
+        self.query = next(definition["python_query"] for definition in report_definitions
+                          if definition["name"] == "registers_status")
+
+    def tearDown(self):
+        CoreConfig.report_snapshots = self.previous
+
+    def test_served_from_snapshot(self):
+        computed = self.query(None)
+        self.assertEquals(ReportSnapshot.objects.filter(name="registers_status").count(), 1)
+        with self.assertNumQueries(1):
+            served = self.query(None)
+        self.assertEquals(served, computed)
+
+    def test_payload_stored_as_json(self):
+        payload = {"header": [{"date_from": datetime.date(2024, 1, 31)}],
+                   "data": [{"datetime": datetime.datetime(2024, 1, 31, 12, 30, 15, 123456), "amount": Decimal("1.50"),
+                             "count": 3, "name": "name"}]}
+        snapshot = ReportSnapshot()
+        snapshot.set_payload(payload)
+        self.assertIsInstance(json.loads(snapshot.payload), dict)
+        self.assertEquals(snapshot.get_payload(), payload)
+
+    def test_refreshed_only_if_changed(self):
+        computed = self.query(None)
+        snapshot = ReportSnapshot.objects.get(name="registers_status")
+        self.assertFalse(refresh_snapshot(snapshot))
+        create_test_officer(custom_props={"code": "TSTRS3"})
+        self.assertTrue(refresh_snapshot(snapshot))
+        self.assertEquals(snapshot.get_payload()["total_active_eo"], computed["total_active_eo"] + 1)
@@ -0,0 +1,55 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from core import rights_cache
+from core.models import Role, RoleRight, User
+from core.rights_cache import get_user_rights, invalidate_role_rights, rights_cache_stats, reset_rights_cache_stats, \
+    warm_rights_cache
+from core.test_helpers import create_test_interactive_user
+
+
+class RightsCacheTest(TestCase):
+    _TEST_RIGHT_ID = 999901
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name="TestRightsCacheRole", is_system=0, is_blocked=False)
+        cls.user = create_test_interactive_user(username="tstrightscache", roles=[cls.role.id])
+
+    def test_role_right_change_is_visible(self):
+        self.assertNotIn(str(self._TEST_RIGHT_ID), self.user.i_user.rights_str)
+        RoleRight.objects.create(role=self.role, right_id=self._TEST_RIGHT_ID)
+        invalidate_role_rights(self.role.id)
+        self.assertIn(str(self._TEST_RIGHT_ID), self.user.i_user.rights_str)
+
+    def test_warm_cache_has_no_query(self):
+        warm_rights_cache([self.user.i_user.id])
+        reset_rights_cache_stats()
+        with self.assertNumQueries(0):
+            get_user_rights(self.user.i_user.id)
+        self.assertEquals(rights_cache_stats(), {"hits": 1, "misses": 0})
+
+    def test_role_changed_while_building(self):
+        fetch_role_rights = rights_cache._fetch_role_rights
+
+        def change_role_after_read(role_ids):
+            rights = fetch_role_rights(role_ids)
+            RoleRight.objects.create(role=self.role, right_id=self._TEST_RIGHT_ID)
+            invalidate_role_rights(self.role.id)
+            return rights
+
+        with mock.patch("core.rights_cache._fetch_role_rights", side_effect=change_role_after_read):
+            self.assertNotIn(self._TEST_RIGHT_ID, get_user_rights(self.user.i_user.id))
+        # Cached with the version read before the change: stale at once
+        self.assertIn(self._TEST_RIGHT_ID, get_user_rights(self.user.i_user.id))
+
+    def test_compiled_permissions_memoized(self):
+        RoleRight.objects.create(role=self.role, right_id=self._TEST_RIGHT_ID)
+        invalidate_role_rights(self.role.id)
+        user = User.objects.get(id=self.user.id)
+        self.assertTrue(user.has_perms([str(self._TEST_RIGHT_ID)]))
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm(str(self._TEST_RIGHT_ID)))
+            self.assertTrue(user.has_perms([str(self._TEST_RIGHT_ID)]))
+            self.assertFalse(user.is_imis_admin)
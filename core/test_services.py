@@ -1,12 +1,16 @@
 import importlib
 import logging
+from unittest import mock
 
+from django.core.cache import cache
 from django.db import connection
 from django.test.client import RequestFactory
 from django.apps import apps
 
 import core
 from core.models import InteractiveUser, Officer, UserRole
+from core.test_helpers import create_test_interactive_user
+from core.user_names import get_user_display_name, get_user_display_names
 from core.services import (
     create_or_update_interactive_user,
     create_or_update_core_user,
@@ -512,3 +516,48 @@ class UserServicesTest(TestCase):
             UserRole.objects.filter(user_id=core_user.id).delete()
         core_user.delete()
         i_user.delete()
+
+    def test_iuser_display_name_index(self):
+        username = "tstsvcnames"
+        # The cached names are dropped once the transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            i_user, _ = create_or_update_interactive_user(
+                user_id=None,
+                data=dict(username=username, last_name="Before", other_names="Name", roles=[11], language="en"),
+                audit_user_id=999,
+                connected=False,
+            )
+        self.assertEquals(get_user_display_names()[i_user.id], "Name Before")
+        with self.assertNumQueries(0):
+            get_user_display_names()
+            self.assertEquals(get_user_display_name(i_user.id), "Name Before")
+
+        core_user, _ = create_or_update_core_user(None, username, i_user=i_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_or_update_interactive_user(
+                user_id=core_user.id,
+                data=dict(username=username, last_name="After", other_names="Name", roles=[11], language="en"),
+                audit_user_id=999,
+                connected=False,
+            )
+        self.assertEquals(get_user_display_name(i_user.id), "Name After")
+
+        # Any save drops the cached name, not before the commit: a concurrent read would cache the old one again
+        i_user = InteractiveUser.objects.get(id=i_user.id)
+        i_user.other_names = "Saved"
+        with self.captureOnCommitCallbacks(execute=True):
+            i_user.save()
+            self.assertEquals(get_user_display_name(i_user.id), "Name After")
+        self.assertEquals(get_user_display_name(i_user.id), "Saved After")
+
+    def test_iuser_display_name_chunks(self):
+        users = [create_test_interactive_user(username=f"tstsvcchunk{index}") for index in range(5)]
+        cache.clear()
+        with mock.patch("core.user_names.USER_NAMES_CHUNK_SIZE", 2):
+            names = get_user_display_names()
+            for user in users:
+                self.assertEquals(names[user.i_user.id], f"{user.i_user.other_names} {user.i_user.last_name}")
+            # One cache entry per 2 ids
+            self.assertLessEqual(len(cache.get(f"user_display_names_{users[0].i_user.id // 2}")), 2)
+            with self.assertNumQueries(0):
+                self.assertEquals(get_user_display_names(), names)
@@ -0,0 +1,27 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from core.gql.total_count import count_queryset, COUNT_ESTIMATED
+from core.models import Role
+
+
+class TotalCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_count_is_cached_per_query(self):
+        queryset = Role.objects.filter(validity_to__isnull=True).select_related().order_by("-id")
+        expected = queryset.count()
+        self.assertEquals(count_queryset(queryset), expected)
+        with self.assertNumQueries(0):
+            self.assertEquals(count_queryset(queryset), expected)
+        with self.assertNumQueries(1):
+            count_queryset(queryset.filter(is_system=0))
+
+    def test_empty_queryset_is_not_counted(self):
+        with self.assertNumQueries(0):
+            self.assertEquals(count_queryset(Role.objects.none()), 0)
+
+    def test_estimated_mode_counts_small_results(self):
+        queryset = Role.objects.filter(validity_to__isnull=True)
+        self.assertEquals(count_queryset(queryset, mode=COUNT_ESTIMATED), queryset.count())
@@ -0,0 +1,100 @@
+"""
+Cached index of the display names ("other_names last_name") of interactive users by InteractiveUser id, which is what
+the audit_user_id of most tables refers to. Historical versions are included, as audit columns may point to them.
+
+The index is split into chunks of USER_NAMES_CHUNK_SIZE consecutive ids, each in its own cache entry (a single entry
+would exceed the 1MB item limit of memcached on large databases), the number of chunks being kept in another entry.
+Saving or deleting an InteractiveUser drops the chunk of its id once the transaction is committed. Reports and audit
+displays should use it rather than loading the users themselves.
+"""
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+USER_NAMES_TIMEOUT = 3600
+# About 50 bytes per name, well below 1MB per chunk
+USER_NAMES_CHUNK_SIZE = 5000
+
+_CHUNK_COUNT_KEY = "user_display_names_chunks"
+_CHUNK_KEY = "user_display_names_%s"
+
+
+def _chunk_of(user_id):
+    return user_id // USER_NAMES_CHUNK_SIZE
+
+
+def _load_chunks(chunks):
+    """
+    :return: dict chunk -> (dict InteractiveUser id -> display name) of the given chunks, in a single query
+    """
+    loaded = {chunk: {} for chunk in chunks}
+    if not chunks:
+        return loaded
+    interactive_user_model = apps.get_model("core", "InteractiveUser")
+    rows = interactive_user_model.objects \
+        .filter(id__gte=min(chunks) * USER_NAMES_CHUNK_SIZE, id__lt=(max(chunks) + 1) * USER_NAMES_CHUNK_SIZE) \
+        .order_by("id") \
+        .values_list("id", "other_names", "last_name")
+    for user_id, other_names, last_name in rows:
+        names = loaded.get(_chunk_of(user_id))
+        if names is not None:
+            names[user_id] = f"{other_names} {last_name}"
+    cache.set_many({_CHUNK_KEY % chunk: names for chunk, names in loaded.items()}, USER_NAMES_TIMEOUT)
+    return loaded
+
+
+def _chunk_count():
+    count = cache.get(_CHUNK_COUNT_KEY)
+    if count is None:
+        max_id = apps.get_model("core", "InteractiveUser").objects.aggregate(max_id=Max("id"))["max_id"]
+        count = 0 if max_id is None else _chunk_of(max_id) + 1
+        cache.set(_CHUNK_COUNT_KEY, count, USER_NAMES_TIMEOUT)
+    return count
+
+
+def get_user_display_names():
+    """
+    :return: dict InteractiveUser id -> display name
+    """
+    chunks = range(_chunk_count())
+    cached = cache.get_many([_CHUNK_KEY % chunk for chunk in chunks])
+    missing = [chunk for chunk in chunks if _CHUNK_KEY % chunk not in cached]
+    names = {}
+    for chunk_names in cached.values():
+        names.update(chunk_names)
+    for chunk_names in _load_chunks(missing).values():
+        names.update(chunk_names)
+    return names
+
+
+def get_user_display_name(user_id, default=None):
+    chunk = _chunk_of(user_id)
+    names = cache.get(_CHUNK_KEY % chunk)
+    if names is None:
+        names = _load_chunks([chunk])[chunk]
+    return names.get(user_id, default)
+
+
+def invalidate_user_display_name(user_id):
+    """
+    To be called whenever interactive users are written without save() (bulk updates...).
+    """
+    cache.delete_many([_CHUNK_KEY % _chunk_of(user_id), _CHUNK_COUNT_KEY])
+
+
+def invalidate_user_display_names():
+    """
+    Drops the whole index.
+    """
+    cache.delete_many([_CHUNK_KEY % chunk for chunk in range(cache.get(_CHUNK_COUNT_KEY) or 0)] + [_CHUNK_COUNT_KEY])
+
+
+@receiver(post_save, sender="core.InteractiveUser", dispatch_uid="core_user_names_save")
+@receiver(post_delete, sender="core.InteractiveUser", dispatch_uid="core_user_names_delete")
+def _on_interactive_user_written(sender, instance, **kwargs):
+    # After the commit, or a name read in between from the database would be cached again until the next write
+    user_id = instance.id
+    transaction.on_commit(lambda: invalidate_user_display_name(user_id))
@@ -204,11 +204,13 @@ class ExtendedConnection(graphene.Connection):
 
     total_count = graphene.Int()
     edge_count = graphene.Int()
+    # "exact" or "estimated", see core.gql.total_count
+    total_count_mode = "exact"
 
     def resolve_total_count(self, info, **kwargs):
         if not info.context.user.is_authenticated:
             raise PermissionDenied(_("unauthorized"))
-        return self.length
+        return resolve_connection_total_count(self, info)
 
     def resolve_edge_count(self, info, **kwargs):
         if not info.context.user.is_authenticated:
@@ -216,6 +218,25 @@ class ExtendedConnection(graphene.Connection):
         return len(self.edges)
 
 
+def resolve_connection_total_count(connection, info):
+    """
+    Total count of a connection: the length already known to the connection if any, otherwise a (cached) COUNT(*) of
+    its queryset rather than loading all its rows.
+    """
+    if getattr(connection, "length", None) is not None:
+        return connection.length
+    iterable = getattr(connection, "iterable", None)
+    if iterable is None:
+        return None
+    from django.db.models import QuerySet
+    if isinstance(iterable, QuerySet) and iterable._result_cache is None:
+        from core.gql.total_count import count_queryset
+        connection.length = count_queryset(iterable, info.context.user, connection.total_count_mode)
+    else:
+        connection.length = len(iterable)
+    return connection.length
+
+
 def get_scheduler_method_ref(name):
     """
     Use to retrieve the method reference from a str name. This is necessary when the module cannot be imported from
@@ -239,9 +260,11 @@ class ExtendedRelayConnection(graphene.relay.Connection):
 
     total_count = graphene.Int()
     edge_count = graphene.Int()
+    # "exact" or "estimated", see core.gql.total_count
+    total_count_mode = "exact"
 
     def resolve_total_count(self, info, **kwargs):
-        return len(self.iterable)
+        return resolve_connection_total_count(self, info)
 
     def resolve_edge_count(self, info, **kwargs):
         return len(self.edges)
@@ -1,6 +1,11 @@
 import csv
+import gzip
+import io
+import re
 
-from django.http import Http404, StreamingHttpResponse
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.views.decorators.http import require_GET
 from isodate import strftime
 from rest_framework import viewsets, status
@@ -15,7 +20,7 @@ from django.utils.translation import ugettext as _
 
 
 class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+    queryset = User.objects.with_identity()
     serializer_class = UserSerializer
     # If we don't specify the IsAuthenticated, the framework will look for the core.user_view permission and prevent
     # any access from non-admin users
@@ -38,13 +43,137 @@ def fetch_export(request):
         raise PermissionDenied({"message": _("Only user requesting export can fetch request")})
     elif export.is_deleted:
         return Response(data='Export csv file was removed from server.', status=status.HTTP_410_GONE)
+    elif export.status == ExportableQueryModel.FAILED:
+        # The error is logged by the worker, it may hold details that are not for the client
+        return Response(data={"status": export.status, "message": _("The export could not be built")},
+                        status=status.HTTP_409_CONFLICT)
+    elif export.status != ExportableQueryModel.READY:
+        # Asynchronous export still being built
+        return Response(data={"status": export.status, "rows_written": export.rows_written,
+                              "bytes_written": export.bytes_written},
+                        status=status.HTTP_202_ACCEPTED)
 
-    export_file_name = F"export_{export.model}_{strftime(export.create_date, '%d/%m/%Y')}.csv"
-    return StreamingHttpResponse(
-        (row for row in export.content.file.readlines()),
-        content_type="text/csv",
-        headers={'Content-Disposition': F'attachment; filename="{export_file_name}"'},
-    )
+    return _serve_export(request, export)
+
+
+EXPORT_BLOCK_SIZE = 64 * 1024
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _BlockReader(io.RawIOBase):
+    """
+    Reads the file up to length bytes, if given, and closes it with itself. It has no name: FileResponse doesn't take
+    the size of the file on disk as Content-Length.
+    """
+
+    def __init__(self, file, length=None):
+        super().__init__()
+        self.file = file
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        size = len(target) if self.remaining is None else min(len(target), self.remaining)
+        block = self.file.read(size)
+        target[:len(block)] = block
+        if self.remaining is not None:
+            self.remaining -= len(block)
+        return len(block)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class _ExportResponse(FileResponse):
+    block_size = EXPORT_BLOCK_SIZE
+
+
+def _parse_range(header, size):
+    """
+    :return: (start, end) of a single byte range, None to serve the whole file (no or multiple ranges),
+             False if unsatisfiable
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _open_export(export):
+    """
+    :return: the export file opened for binary reading, through its local path when there is one so that
+             FileResponse can use the server's sendfile
+    """
+    try:
+        return open(export.content.path, "rb")
+    except NotImplementedError:
+        return export.content.open("rb")
+
+
+def _serve_export(request, export):
+    """
+    Streams the export by blocks, with HTTP Range and conditional (ETag/Last-Modified) requests support. Gzipped
+    exports are sent as is (Content-Encoding: gzip) to clients accepting gzip and decompressed on the fly otherwise.
+    """
+    send_gzip = export.is_compressed and "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+    etag = quote_etag(f"{export.name}-{export.bytes_written}{'-gzip' if send_gzip else ''}")
+    last_modified = int(export.create_date.to_ad_datetime().timestamp())
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        return conditional
+
+    writer_class = export.writer_class
+    # Gzipped exports are either sent with Content-Encoding: gzip or decompressed, the client ends up with the content
+    extension = writer_class.extension[:-len(".gz")] if writer_class.gzipped else writer_class.extension
+    content_type = writer_class.content_type
+    export_file_name = F"export_{export.model}_{strftime(export.create_date, '%d/%m/%Y')}.{extension}"
+    response_kwargs = {"content_type": content_type, "as_attachment": True, "filename": export_file_name}
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+    }
+    if export.is_compressed:
+        headers["Vary"] = "Accept-Encoding"
+
+    if export.is_compressed and not send_gzip:
+        headers["Accept-Ranges"] = "none"
+        return _ExportResponse(_BlockReader(gzip.GzipFile(fileobj=_open_export(export), mode="rb")),
+                               headers=headers, **response_kwargs)
+
+    if send_gzip:
+        headers["Content-Encoding"] = "gzip"
+    headers["Accept-Ranges"] = "bytes"
+    size = export.content.size
+    requested_range = _parse_range(request.META.get("HTTP_RANGE"), size)
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and if_range != etag:
+        # The client's partial copy is outdated, send the whole file
+        requested_range = None
+    if requested_range is False:
+        return HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            headers={"Content-Range": f"bytes */{size}"})
+    if requested_range is None:
+        return _ExportResponse(_open_export(export), headers=headers, **response_kwargs)
+
+    start, end = requested_range
+    file = _open_export(export)
+    file.seek(start)
+    response = _ExportResponse(_BlockReader(file, end - start + 1), status=status.HTTP_206_PARTIAL_CONTENT,
+                               headers=headers, **response_kwargs)
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Length"] = end - start + 1
+    return response
 
 
 def _serialize_job(job):